@@ -38,3 +38,24 @@ else:
             return True
         except ImportError:
             return False
+
+
+if sys.version_info >= (3, 0):
+    from sys import intern
+else:
+    intern = intern  # noqa: F821
+
+
+def intern_string(value):
+    """Intern a string so that equal strings share a single object.
+
+    Matrix identifiers like user ids, room ids and event types are repeated
+    in almost every event, interning them while events are parsed keeps only
+    one copy of every identifier in memory.
+
+    Returns the value unchanged if it isn't a string.
+    """
+    if type(value) is str:
+        return intern(value)
+
+    return value
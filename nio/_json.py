@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018-2019 Damir Jelić <poljar@termina.org.uk>
+#
+# Permission to use, copy, modify, and/or distribute this software for
+# any purpose with or without fee is hereby granted, provided that the
+# above copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER
+# RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF
+# CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""nio JSON backend.
+
+This module encodes and decodes JSON using orjson or ujson if one of them is
+installed, the json module from the standard library is used otherwise.
+
+Decoding errors of every backend are subclasses of ValueError. orjson decodes
+integers that don't fit into 64 bits as floats, Matrix limits integers to 53
+bits so this doesn't affect valid Matrix data.
+
+Canonical JSON is used for signatures, so it needs to be byte-identical no
+matter which backend is used. The faster backends are only used for
+canonical JSON if the value consists of dictionaries with string keys,
+lists, tuples, strings, integers, booleans and None, the output of every
+backend is the same for those. Everything else, most notably floats which
+every backend formats differently, is encoded using the json module.
+
+StreamParser splits a JSON document that arrives in chunks into its members
+without decoding the whole document at once.
+"""
+
+from __future__ import unicode_literals
+
+import codecs
+import json
+import re
+from typing import Any, Iterable, List, Optional, Tuple, Union
+
+from ._compat import package_installed
+
+BACKENDS = ("orjson", "ujson", "json")
+
+_CANONICAL_TYPES = (str, int, bool, type(None))
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+
+backend = "json"
+
+
+def _find_backend():
+    # type: () -> str
+    for name in BACKENDS:
+        if name == "json" or package_installed(name):
+            return name
+
+    return "json"
+
+
+def _canonical_safe(value):
+    # type: (Any) -> bool
+    """Check that every backend produces the same canonical JSON."""
+    stack = [value]
+
+    while stack:
+        value = stack.pop()
+        value_type = type(value)
+
+        if value_type is dict:
+            for key in value:
+                if type(key) is not str:
+                    return False
+            stack.extend(value.values())
+        elif value_type is list or value_type is tuple:
+            stack.extend(value)
+        elif value_type not in _CANONICAL_TYPES:
+            return False
+
+    return True
+
+
+def _json_loads(data):
+    # type: (Union[bytes, str]) -> Any
+    return json.loads(data)
+
+
+def _json_dumps(value):
+    # type: (Any) -> str
+    return json.dumps(value, separators=(",", ":"))
+
+
+def _json_canonical_dumps(value):
+    # type: (Any) -> str
+    return json.dumps(
+        value,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        sort_keys=True,
+    )
+
+
+def use_json_backend(name=None):
+    # type: (Optional[str]) -> str
+    """Select the JSON library that nio uses.
+
+    Args:
+        name (str, optional): One of "orjson", "ujson" or "json". If no name
+            is given the fastest installed library is selected.
+
+    Returns the name of the selected backend.
+
+    Raises ValueError if the backend is unknown or not installed.
+    """
+    global backend, loads, dumps, canonical_dumps
+
+    name = name or _find_backend()
+
+    if name not in BACKENDS:
+        raise ValueError("Unknown JSON backend {}".format(name))
+
+    if name != "json" and not package_installed(name):
+        raise ValueError("JSON backend {} isn't installed".format(name))
+
+    if name == "orjson":
+        import orjson
+
+        def loads(data):
+            # type: (Union[bytes, str]) -> Any
+            return orjson.loads(data)
+
+        def dumps(value):
+            # type: (Any) -> str
+            try:
+                return orjson.dumps(value).decode("utf-8")
+            except TypeError:
+                return _json_dumps(value)
+
+        def canonical_dumps(value):
+            # type: (Any) -> str
+            if not _canonical_safe(value):
+                return _json_canonical_dumps(value)
+
+            try:
+                return orjson.dumps(
+                    value,
+                    option=orjson.OPT_SORT_KEYS
+                ).decode("utf-8")
+            except TypeError:
+                # Integers that don't fit into 64 bits and strings
+                # containing surrogates.
+                return _json_canonical_dumps(value)
+
+    elif name == "ujson":
+        import ujson
+
+        def loads(data):
+            # type: (Union[bytes, str]) -> Any
+            return ujson.loads(data)
+
+        def dumps(value):
+            # type: (Any) -> str
+            return ujson.dumps(value, escape_forward_slashes=False)
+
+        def canonical_dumps(value):
+            # type: (Any) -> str
+            if not _canonical_safe(value):
+                return _json_canonical_dumps(value)
+
+            return ujson.dumps(
+                value,
+                ensure_ascii=False,
+                escape_forward_slashes=False,
+                sort_keys=True,
+            )
+
+    else:
+        loads = _json_loads
+        dumps = _json_dumps
+        canonical_dumps = _json_canonical_dumps
+
+    backend = name
+    return name
+
+
+class StreamParser(object):
+    """Incremental parser for JSON documents that arrive in chunks.
+
+    The parser descends into the objects found at the given paths and
+    returns every other value as soon as it is complete, together with the
+    path of keys that leads to it. Only the value that is currently being
+    received needs to be kept in memory.
+
+    Values are decoded using the json module of the standard library, the
+    decoding of a value is only retried after the buffered data doubled in
+    size so large values don't get decoded over and over again.
+
+    Args:
+        expand (Iterable[Tuple[str, ...]]): The paths of the objects that
+            should be split into their members, the empty tuple is the top
+            level object.
+
+    Example:
+            >>> parser = StreamParser([(), ("rooms",)])
+            >>> parser.feed(b'{"rooms": {"a": 1, "b"')
+            [(('rooms', 'a'), 1)]
+            >>> parser.feed(b': [2]}, "next_batch": "s1"}')
+            [(('rooms', 'b'), [2]), (('next_batch',), 's1')]
+            >>> parser.close()
+            []
+
+    """
+
+    def __init__(self, expand=((),)):
+        # type: (Iterable[Tuple[str, ...]]) -> None
+        self.expand = set(expand)
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._offset = 0
+        self._chunks = []  # type: List[str]
+        self._chunks_size = 0
+        self._retry_size = 0
+        self._path = []  # type: List[str]
+        self._state = "value"
+        self._eof = False
+
+    def _skip_whitespace(self):
+        # type: () -> Optional[str]
+        self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+
+        if self._pos < len(self._buffer):
+            return self._buffer[self._pos]
+
+        return None
+
+    def _decode(self):
+        # type: () -> Tuple[bool, Any]
+        available = len(self._buffer) - self._pos
+
+        if not self._eof and available < self._retry_size:
+            return False, None
+
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        except ValueError:
+            if self._eof:
+                raise
+            self._retry_size = 2 * available
+            return False, None
+
+        # A number or a literal that ends with the buffer might continue in
+        # the next chunk, a number might also have been cut off before its
+        # fraction or exponent.
+        if (not self._eof and not isinstance(value, (dict, list, str))
+                and _NUMBER_TAIL.match(self._buffer, end).end()
+                == len(self._buffer)):
+            self._retry_size = available + 1
+            return False, None
+
+        self._retry_size = 0
+        self._pos = end
+        return True, value
+
+    def _unexpected(self, char):
+        # type: (str) -> ValueError
+        return ValueError("Unexpected character {!r} at position {}".format(
+            char, self._offset + self._pos
+        ))
+
+    def _close_object(self):
+        # type: () -> None
+        self._pos += 1
+
+        if self._path:
+            self._path.pop()
+            self._state = "next"
+        else:
+            self._state = "end"
+
+    def _step(self):
+        # type: () -> Tuple[bool, Optional[Tuple[Tuple[str, ...], Any]]]
+        char = self._skip_whitespace()
+
+        if char is None:
+            return False, None
+
+        if self._state == "value":
+            path = tuple(self._path)
+
+            if path in self.expand and char == "{":
+                self._pos += 1
+                self._state = "first_key"
+                return True, None
+
+            complete, value = self._decode()
+
+            if not complete:
+                return False, None
+
+            if self._path:
+                self._path.pop()
+                self._state = "next"
+            else:
+                self._state = "end"
+
+            return True, (path, value)
+
+        if self._state in ("first_key", "key"):
+            if char == "}" and self._state == "first_key":
+                self._close_object()
+                return True, None
+
+            if char != '"':
+                raise self._unexpected(char)
+
+            start = self._pos
+            complete, key = self._decode()
+
+            if not complete:
+                return False, None
+
+            char = self._skip_whitespace()
+
+            if char is None:
+                # Decode the key again once the colon arrived.
+                self._pos = start
+                self._retry_size = 0
+                return False, None
+
+            if char != ":":
+                raise self._unexpected(char)
+
+            self._pos += 1
+            self._path.append(key)
+            self._state = "value"
+            return True, None
+
+        if self._state == "next":
+            if char == ",":
+                self._pos += 1
+                self._state = "key"
+            elif char == "}":
+                self._close_object()
+            else:
+                raise self._unexpected(char)
+
+            return True, None
+
+        raise self._unexpected(char)
+
+    def _parse(self):
+        # type: () -> List[Tuple[Tuple[str, ...], Any]]
+        items = []
+
+        while True:
+            progress, item = self._step()
+
+            if not progress:
+                break
+
+            if item:
+                items.append(item)
+
+        return items
+
+    def _fill(self):
+        # type: () -> bool
+        available = len(self._buffer) - self._pos + self._chunks_size
+
+        # Don't copy the buffer for a value that won't be decoded yet, the
+        # chunks are only joined once the retry size is reached so every
+        # character is copied a bounded number of times.
+        if not self._eof and available < self._retry_size:
+            return False
+
+        self._offset += self._pos
+        self._buffer = self._buffer[self._pos:] + "".join(self._chunks)
+        self._pos = 0
+        self._chunks = []
+        self._chunks_size = 0
+        return True
+
+    def feed(self, data):
+        # type: (bytes) -> List[Tuple[Tuple[str, ...], Any]]
+        """Add a chunk of the document.
+
+        Returns a list of (path, value) tuples for the values that were
+        completed by this chunk.
+
+        Raises ValueError if the document isn't valid JSON.
+        """
+        text = self._text_decoder.decode(data)
+        self._chunks.append(text)
+        self._chunks_size += len(text)
+
+        if not self._fill():
+            return []
+
+        return self._parse()
+
+    def close(self):
+        # type: () -> List[Tuple[Tuple[str, ...], Any]]
+        """Signal the end of the document.
+
+        Returns a list of (path, value) tuples for the remaining values.
+
+        Raises ValueError if the document is incomplete or isn't valid JSON.
+        """
+        self._chunks.append(self._text_decoder.decode(b"", final=True))
+        self._eof = True
+        self._fill()
+        items = self._parse()
+
+        if self._state != "end":
+            raise ValueError("Incomplete JSON document")
+
+        char = self._skip_whitespace()
+
+        if char is not None:
+            raise self._unexpected(char)
+
+        return items
+
+
+loads = _json_loads
+dumps = _json_dumps
+canonical_dumps = _json_canonical_dumps
+
+use_json_backend()
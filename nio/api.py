@@ -22,12 +22,12 @@ This module contains primitives to build Matrix API http requests.
 
 from __future__ import unicode_literals
 
-import json
 from collections import defaultdict
 from enum import Enum, unique
 from typing import (Any, DefaultDict, Dict, Iterable, List,
                     Optional, Set, Sequence, Tuple, Union)
 
+from . import _json
 from .exceptions import LocalProtocolError
 from .http import Http2Request, HttpRequest, TransportRequest
 
@@ -95,6 +95,42 @@ class RoomPreset(Enum):
     public_chat = "public_chat"
 
 
+def lazy_loading_filter(timeline_limit=20, include_redundant_members=False):
+    # type: (Optional[int], bool) -> Dict[str, Any]
+    """Build a sync filter that lazy loads the members of rooms.
+
+    The server only sends the membership events of the senders of the events
+    in the response, instead of every member of every room, and the
+    timelines are limited to the given number of events. This makes initial
+    sync responses a lot smaller.
+
+    Args:
+        timeline_limit (int, optional): The maximum number of timeline events
+            per room, None leaves it to the server.
+        include_redundant_members (bool): Should membership events be sent
+            again even if they were already sent to this device.
+
+    Returns a filter dictionary that can be passed to sync() or
+    upload_filter().
+    """
+    member_filter = {
+        "lazy_load_members": True,
+        "include_redundant_members": include_redundant_members,
+    }  # type: Dict[str, Any]
+
+    timeline_filter = dict(member_filter)
+
+    if timeline_limit is not None:
+        timeline_filter["limit"] = timeline_limit
+
+    return {
+        "room": {
+            "state": member_filter,
+            "timeline": timeline_filter,
+        },
+    }
+
+
 class Api(object):
     """Matrix API class.
 
@@ -105,18 +141,13 @@ class Api(object):
     def to_json(content_dict):
         # type: (Dict[Any, Any]) -> str
         """Turn a dictionary into a json string."""
-        return json.dumps(content_dict, separators=(",", ":"))
+        return _json.dumps(content_dict)
 
     @staticmethod
     def to_canonical_json(content_dict):
         # type: (Dict[Any, Any]) -> str
         """Turn a dictionary into a canonical json string."""
-        return json.dumps(
-            content_dict,
-            ensure_ascii=False,
-            separators=(",", ":"),
-            sort_keys=True,
-        )
+        return _json.canonical_dumps(content_dict)
 
     @staticmethod
     def mimetype_to_msgtype(mimetype):
@@ -318,7 +349,7 @@ class Api(object):
         access_token,     # type: str
         since=None,       # type: Optional[str]
         timeout=None,     # type: Optional[int]
-        filter=None,      # type: Optional[Dict[Any, Any]]
+        filter=None,      # type: Optional[Union[str, Dict[Any, Any]]]
         full_state=None   # type: Optional[bool]
     ):
         # type: (...) -> Tuple[str, str]
@@ -332,8 +363,9 @@ class Api(object):
                 to.
             timeout(int): The maximum time to wait, in milliseconds, before
                 returning this request.
-            filter (Dict): A dictionary containing a filter configuration for
-                the request.
+            filter (Dict, str): A dictionary containing a filter configuration
+                for the request, or the id of a filter that was uploaded using
+                upload_filter().
         """
         query_parameters = {"access_token": access_token}
 
@@ -346,12 +378,40 @@ class Api(object):
         if timeout is not None:
             query_parameters["timeout"] = str(timeout)
 
-        if filter is not None:
-            filter_json = json.dumps(filter, separators=(",", ":"))
+        if isinstance(filter, str):
+            query_parameters["filter"] = filter
+
+        elif filter is not None:
+            filter_json = _json.dumps(filter)
             query_parameters["filter"] = filter_json
 
         return "GET", Api._build_path("sync", query_parameters)
 
+    @staticmethod
+    def upload_filter(
+        access_token,  # type: str
+        user_id,       # type: str
+        filter,        # type: Dict[Any, Any]
+    ):
+        # type: (...) -> Tuple[str, str, str]
+        """Upload a filter that can be used for sync requests.
+
+        Returns the HTTP method, HTTP path and data for the request.
+
+        Args:
+            access_token (str): The access token to be used with the request.
+            user_id (str): The id of the user the filter belongs to.
+            filter (Dict): A dictionary containing the filter configuration.
+        """
+        query_parameters = {"access_token": access_token}
+        path = "user/{user}/filter".format(user=user_id)
+
+        return (
+            "POST",
+            Api._build_path(path, query_parameters),
+            Api.to_json(filter)
+        )
+
     @staticmethod
     def room_send(
         access_token,  # type: str
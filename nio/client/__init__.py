@@ -4,3 +4,4 @@ from .base_client import Client, ClientConfig
 from .http_client import HttpClient, TransportType, RequestInfo
 if sys.version_info >= (3, 5):
     from .async_client import AsyncClient, AsyncClientConfig, DataProvider
+    from .client_manager import AsyncClientManager
@@ -15,25 +15,32 @@
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 import asyncio
+import hashlib
+import inspect
 import io
+import re
 import warnings
 from asyncio import Event
+from collections import deque
 from functools import partial, wraps
-from json.decoder import JSONDecodeError
 from pathlib import Path
 from typing import (Any, AsyncIterable, BinaryIO, Callable, Coroutine, Dict,
-                    Iterable, List, Optional, Sequence, Tuple, Type, Union)
+                    Iterable, List, Optional, Sequence, Set, Tuple, Type,
+                    Union)
 from uuid import UUID, uuid4
 
 import attr
 from aiofiles.threadpool.binary import AsyncBufferedReader
-from aiohttp import (ClientResponse, ClientSession, ContentTypeError,
-                     TraceConfig)
+from aiohttp import ClientResponse, ClientSession, TCPConnector, TraceConfig
 from aiohttp.client_exceptions import ClientConnectionError
 
 from . import Client, ClientConfig
-from .base_client import logged_in, store_loaded
-from ..api import (Api, MessageDirection, ResizingMethod, RoomVisibility,
+from .. import _json
+from .base_client import (CallbackList, ClientCallback, logged_in, logger,
+                          store_loaded)
+from .http2_transport import Http2Transport
+from ..api import (MATRIX_API_PATH, MATRIX_MEDIA_API_PATH, Api,
+                   MessageDirection, ResizingMethod, RoomVisibility,
                    RoomPreset)
 from ..crypto import (AsyncDataT, async_encrypt_attachment,
                       async_generator_from_data)
@@ -42,7 +49,7 @@ from ..exceptions import (GroupEncryptionError, LocalProtocolError,
                           TransferCancelledError)
 from ..events import RoomKeyRequest, RoomKeyRequestCancellation
 from ..event_builders import ToDeviceMessage
-from ..monitors import TransferMonitor
+from ..monitors import TimeSliceScheduler, TransferMonitor
 from ..responses import (DeleteDevicesError, DeleteDevicesResponse,
                          DeleteDevicesAuthResponse,
                          DevicesError, DevicesResponse,
@@ -70,17 +77,23 @@ from ..responses import (DeleteDevicesError, DeleteDevicesResponse,
                          RoomSendResponse, RoomTypingResponse, RoomTypingError,
                          ShareGroupSessionError,
                          ShareGroupSessionResponse, SyncError, SyncResponse,
-                         PartialSyncResponse,
+                         PartialSyncResponse, SyncResponseStream, SyncType,
                          ThumbnailError, ThumbnailResponse,
                          ToDeviceError, ToDeviceResponse,
-                         UploadError, UploadResponse)
+                         UploadError, UploadResponse, UploadFilterError,
+                         UploadFilterResponse)
 
 if False:
-    from ..events import MegolmEvent
+    from ..events import MegolmEvent, ValidationSampler
+    from ..rooms import MatrixRoom
     from .crypto import OlmDevice
 
 _ShareGroupSessionT = Union[ShareGroupSessionError, ShareGroupSessionResponse]
 
+_UploadFilterT = Union[UploadFilterResponse, UploadFilterError]
+
+_JoinedMembersT = Union[JoinedMembersResponse, JoinedMembersError]
+
 _ProfileGetDisplayNameT = Union[
     ProfileGetDisplayNameResponse,
     ProfileGetDisplayNameError
@@ -92,6 +105,9 @@ _ProfileSetDisplayNameT = Union[
 
 DataProvider = Callable[[int, int], AsyncDataT]
 
+# The content types aiohttp accepts as JSON.
+JSON_CONTENT_TYPE = re.compile(r"^application/(?:[\w.+-]+?\+)?json")
+
 
 @attr.s
 class ResponseCb(object):
@@ -99,6 +115,270 @@ class ResponseCb(object):
 
     func = attr.ib()
     filter = attr.ib(default=None)
+    coroutine = attr.ib(init=False)
+
+    def __attrs_post_init__(self):
+        self.coroutine = asyncio.iscoroutinefunction(self.func)
+
+
+@attr.s
+class _SyncProgress(object):
+    """The parts of a streamed sync response that were already handled.
+
+    A sync request whose response fails half way through is retried with
+    the same since token, the response to the retry contains the same
+    events again. The events that were handled for a since token are
+    remembered until the sync token moves on so that their callbacks don't
+    run a second time.
+
+    The server sends the to-device events in order, starting with the
+    oldest one that wasn't acknowledged by a newer since token, so only the
+    number of handled to-device events needs to be kept.
+    """
+
+    since = attr.ib(type=Optional[str])
+    to_device = attr.ib(default=0, type=int)
+    to_device_seen = attr.ib(default=0, type=int)
+    invited_rooms = attr.ib(factory=set, type=Set[str])
+    events = attr.ib(factory=set, type=Set[str])
+
+
+async def _run_callback(cb, *args):
+    if cb.coroutine:
+        await cb.func(*args)
+        return
+
+    result = cb.func(*args)
+
+    # Plain functions can still return something that needs to be awaited.
+    if inspect.isawaitable(result):
+        await result
+
+
+class _Waiter(object):
+    """Let coroutines wait until a condition of the object becomes true."""
+
+    _changed = None  # type: Optional[Event]
+
+    def _notify(self):
+        # type: () -> None
+        if self._changed:
+            self._changed.set()
+
+    async def _wait_until(self, condition):
+        # type: (Callable[[], Any]) -> None
+        if self._changed is None:
+            self._changed = Event()
+
+        while not condition():
+            self._changed.clear()
+            await self._changed.wait()
+
+
+class CallbackDispatcher(_Waiter):
+    """Run the event callbacks of different rooms concurrently.
+
+    The callbacks of a room are run one after the other in the order they
+    were dispatched, while the callbacks of different rooms run concurrently.
+    Exceptions raised by the callbacks are logged.
+
+    Args:
+        max_concurrency (int): The maximum number of callbacks that run at
+            the same time.
+        max_queued (int): The maximum number of callbacks that may wait to be
+            run, dispatch() waits until there's space in the queue once the
+            limit is reached.
+
+    Attributes:
+        queued (int): The number of callbacks that were dispatched but didn't
+            finish yet.
+
+    """
+
+    def __init__(self, max_concurrency, max_queued=1000):
+        # type: (int, int) -> None
+        self.max_concurrency = max_concurrency
+        self.max_queued = max_queued
+        self.queued = 0
+
+        self._queues = {}  # type: Dict[str, deque]
+        self._workers = {}  # type: Dict[str, asyncio.Future]
+        self._semaphore = None  # type: Optional[asyncio.Semaphore]
+
+    async def dispatch(self, room_id, cb, *args):
+        # type: (str, Any, Any) -> None
+        """Queue a callback to be run with the given arguments.
+
+        Args:
+            room_id (str): The room the callback is run for.
+            cb (ClientCallback): The callback to run.
+        """
+        await self.wait_for_space()
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        self._queues.setdefault(room_id, deque()).append((cb, args))
+        self.queued += 1
+
+        if room_id not in self._workers:
+            self._workers[room_id] = asyncio.ensure_future(
+                self._run_room(room_id)
+            )
+
+    async def _run_room(self, room_id):
+        # type: (str) -> None
+        queue = self._queues[room_id]
+
+        try:
+            while queue:
+                cb, args = queue.popleft()
+
+                try:
+                    async with self._semaphore:
+                        await _run_callback(cb, *args)
+                except Exception:
+                    logger.exception(
+                        "Error running callback for room {}".format(room_id)
+                    )
+                finally:
+                    self.queued -= 1
+                    self._notify()
+        finally:
+            self.queued -= len(queue)
+            del self._queues[room_id]
+            del self._workers[room_id]
+            self._notify()
+
+    async def wait_for_space(self):
+        # type: () -> None
+        """Wait until fewer than max_queued callbacks are queued."""
+        await self._wait_until(lambda: self.queued < self.max_queued)
+
+    async def join(self):
+        # type: () -> None
+        """Wait until all the dispatched callbacks have finished."""
+        await self._wait_until(lambda: not self.queued)
+
+    def cancel(self):
+        # type: () -> None
+        """Cancel the callbacks that are running or waiting to be run."""
+        for worker in list(self._workers.values()):
+            worker.cancel()
+
+
+class EventStream(_Waiter):
+    """An async iterator over the room events that the client receives.
+
+    Event streams are created using AsyncClient.events(). The events are
+    buffered until they are consumed, the overflow policy decides what
+    happens once the buffer is full:
+
+    * "block": The handling of the sync response, and with it the sync loop,
+      waits until there's space in the buffer.
+    * "drop_oldest": The oldest buffered event is dropped.
+    * "coalesce": The buffered events of the room the new event belongs to
+      are dropped, only the latest event of a room is kept. If there are no
+      buffered events of that room the oldest buffered event is dropped.
+
+    The stream stops receiving events once it's closed, the buffered events
+    can still be consumed. Leaving an async for loop over the stream, e.g.
+    with break, closes the stream as well, otherwise a stream that isn't
+    consumed anymore would block the sync loop once its buffer is full.
+
+    Attributes:
+        maxsize (int): The maximum number of buffered events.
+        overflow (str): The overflow policy.
+        dropped (int): The number of events that were dropped.
+
+    """
+
+    overflow_policies = ("block", "drop_oldest", "coalesce")
+
+    def __init__(self, callbacks, maxsize=100, overflow="block"):
+        # type: (CallbackList, int, str) -> None
+        if overflow not in self.overflow_policies:
+            raise ValueError("Invalid overflow policy {}".format(overflow))
+
+        if maxsize < 1:
+            raise ValueError("The maximum size needs to be at least 1")
+
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.closed = False
+
+        self._callbacks = callbacks
+        self._callback = None  # type: Optional[Any]
+        self._queue = deque()  # type: deque
+
+    def _space(self):
+        # type: () -> bool
+        return len(self._queue) < self.maxsize or self.closed
+
+    async def _put(self, room, event):
+        if self.closed:
+            return
+
+        if len(self._queue) >= self.maxsize:
+            if self.overflow == "block":
+                await self._wait_until(self._space)
+
+                if self.closed:
+                    return
+
+            elif self.overflow == "coalesce":
+                queued = len(self._queue)
+                self._queue = deque(
+                    item for item in self._queue
+                    if item[0].room_id != room.room_id
+                )
+                self.dropped += queued - len(self._queue)
+
+            if len(self._queue) >= self.maxsize:
+                self._queue.popleft()
+                self.dropped += 1
+
+        self._queue.append((room, event))
+        self._notify()
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        try:
+            while True:
+                await self._wait_until(lambda: self._queue or self.closed)
+
+                if not self._queue:
+                    return
+
+                item = self._queue.popleft()
+                self._notify()
+                yield item
+        finally:
+            # The generator is closed when the loop over it is left early,
+            # or when it's garbage collected.
+            self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def close(self):
+        # type: () -> None
+        """Stop receiving events."""
+        if self.closed:
+            return
+
+        self.closed = True
+
+        if self._callback in self._callbacks:
+            self._callbacks.remove(self._callback)
+
+        self._notify()
 
 
 async def on_request_chunk_sent(session, context, params):
@@ -110,16 +390,30 @@ async def on_request_chunk_sent(session, context, params):
         context_obj.transferred += len(params.chunk)
 
 
+def _create_client_session(config):
+    # type: (AsyncClientConfig) -> ClientSession
+    """Create a client session with a connector as configured."""
+    trace = TraceConfig()
+    trace.on_request_chunk_sent.append(on_request_chunk_sent)
+
+    connector = TCPConnector(
+        limit=config.max_connections,
+        limit_per_host=config.max_connections_per_host,
+        keepalive_timeout=config.keepalive_timeout,
+        use_dns_cache=config.dns_cache_ttl != 0,
+        ttl_dns_cache=config.dns_cache_ttl,
+    )
+
+    return ClientSession(connector=connector, trace_configs=[trace])
+
+
 def client_session(func):
     """Ensure that the Async client has a valid client session."""
 
     @wraps(func)
     async def wrapper(self, *args, **kwargs):
         if not self.client_session:
-            trace = TraceConfig()
-            trace.on_request_chunk_sent.append(on_request_chunk_sent)
-
-            self.client_session = ClientSession(trace_configs=[trace])
+            self.client_session = _create_client_session(self.config)
 
         return await func(self, *args, **kwargs)
 
@@ -150,12 +444,105 @@ class AsyncClientConfig(ClientConfig):
 
         max_timeout_retry_wait_time (float): The maximum time to wait between
             retries for timeouts, by default 60.
+
+        stream_sync (bool): Parse sync responses while they are being
+            received and handle every room as soon as it arrived, instead of
+            reading the whole response first. This bounds the memory that a
+            large sync response needs by the size of the largest room. The
+            sync response that is returned to the caller and passed to the
+            response callbacks doesn't contain any rooms or to-device events
+            in that case, those are only available to the event callbacks.
+            Defaults to False.
+
+        max_sync_events (int): The maximum number of room events of a sync
+            response that are handled at once. Larger sync responses are
+            handled in parts and the event loop gets to run other tasks
+            between the parts, so a large initial sync doesn't block it for
+            long. Can be overridden for a single sync() call. Defaults to 0,
+            which handles all events at once.
+
+        sync_time_slice (float, optional): How many seconds the handling of
+            a sync response may block the event loop before other tasks get
+            to run. The time the event loop was blocked is recorded by the
+            sync_scheduler of the client either way. Defaults to None, which
+            never interrupts the handling of a sync response.
+
+        callback_concurrency (int, optional): Run the event and ephemeral
+            callbacks of different rooms concurrently, at most the given
+            number at the same time. The callbacks of a room still run one
+            after the other, in order. Since the callbacks run after the
+            sync response was handled, the state of the room they get may
+            already contain later events. Exceptions raised by the callbacks
+            are logged. Defaults to None, which runs every callback while the
+            sync response is handled.
+
+        max_queued_callbacks (int): The maximum number of callbacks that may
+            wait to be run if callback_concurrency is set. Once it's reached
+            the handling of sync responses, and with it sync_forever(), waits
+            for callbacks to finish. Defaults to 1000.
+
+        upload_sync_filters (bool): Upload the filters that are passed to
+            sync() and sync_forever() once and use the id of the uploaded
+            filter for the sync requests, instead of sending the whole filter
+            with every request. The filter ids are kept in the store.
+            Defaults to True.
+
+        max_connections (int): The maximum number of simultaneous
+            connections of a connection pool, 0 for no limit. Defaults to
+            100.
+
+        max_connections_per_host (int): The maximum number of simultaneous
+            connections to the same host of a connection pool, 0 for no
+            limit. Defaults to 0.
+
+        keepalive_timeout (float): How many seconds an idle connection is
+            kept open to be reused. Defaults to 15.
+
+        dns_cache_ttl (int, optional): How many seconds resolved host names
+            are cached, None caches them forever and 0 disables the cache.
+            Defaults to 10.
+
+        tcp_nodelay (bool): Set TCP_NODELAY on the HTTP/2 connection, which
+            sends small requests right away instead of batching them with
+            later writes. aiohttp always sets it on the connections of its
+            pools, so this only applies if http2 is enabled. Defaults to
+            True.
+
+        separate_connection_pools (bool): Use separate connection pools for
+            sync requests, for media uploads and downloads, and for the
+            other requests. The long-polling sync requests and slow media
+            transfers then never delay other requests, like message sends,
+            that wait for a free connection. Every pool is configured with
+            the settings above. Defaults to False.
+
+        http2 (bool): Send all the requests as streams of a single HTTP/2
+            connection to the homeserver, instead of using the aiohttp
+            connection pools. Concurrent requests, e.g. message sends, key
+            queries and media transfers, then don't need a connection each,
+            and never wait for a free one behind a sync long-poll. For https
+            homeservers HTTP/2 is negotiated with ALPN, plain http ones are
+            spoken to with HTTP/2 prior knowledge. The connection pool
+            settings, except tcp_nodelay, don't apply, and a proxy can't be
+            used. Defaults to False.
     """
 
     max_limit_exceeded = attr.ib(type=Optional[int], default=None)
     max_timeouts = attr.ib(type=Optional[int], default=None)
     backoff_factor = attr.ib(type=float, default=0.1)
     max_timeout_retry_wait_time = attr.ib(type=float, default=60)
+    stream_sync = attr.ib(type=bool, default=False)
+    max_sync_events = attr.ib(type=int, default=0)
+    sync_time_slice = attr.ib(type=Optional[float], default=None)
+    callback_concurrency = attr.ib(type=Optional[int], default=None)
+    max_queued_callbacks = attr.ib(type=int, default=1000)
+    upload_sync_filters = attr.ib(type=bool, default=True)
+    max_connections = attr.ib(type=int, default=100)
+    max_connections_per_host = attr.ib(type=int, default=0)
+    keepalive_timeout = attr.ib(type=float, default=15.0)
+    dns_cache_ttl = attr.ib(type=Optional[int], default=10)
+    tcp_nodelay = attr.ib(type=bool, default=True)
+    separate_connection_pools = attr.ib(type=bool, default=False)
+    http2 = attr.ib(type=bool, default=False)
 
 
 class AsyncClient(Client):
@@ -177,10 +564,21 @@ class AsyncClient(Client):
             for skip SSL certificate validation connection.
         proxy (str, optional): The proxy that should be used for the HTTP
             connection.
+        client_session (ClientSession, optional): An aiohttp client session
+            that should be used for the requests of the client, e.g. one
+            that is shared with other clients. The client doesn't close a
+            session that was passed in, and uses it for every request even if
+            separate_connection_pools is set.
 
     Attributes:
         synced (Event): An asyncio event that is fired every time the client
             successfully syncs with the server.
+        sync_scheduler (TimeSliceScheduler): Lets the event loop run other
+            tasks while large sync responses are handled and records how
+            long the handling of the last sync blocked the event loop.
+        callback_dispatcher (CallbackDispatcher, optional): Runs the event
+            callbacks of different rooms concurrently if callback_concurrency
+            is set in the client config.
 
     A simple example can be found bellow.
 
@@ -226,16 +624,19 @@ class AsyncClient(Client):
             config=None,    # type: Optional[AsyncClientConfig]
             ssl=None,       # type: Optional[bool]
             proxy=None,     # type: Optional[str]
+            client_session=None,  # type: Optional[ClientSession]
     ):
         # type: (...) -> None
         self.homeserver = homeserver
-        self.client_session = None  # type: Optional[ClientSession]
+        self.client_session = client_session  # type: Optional[ClientSession]
+        self._pool_sessions = {}  # type: Dict[str, ClientSession]
+        self._shared_session = client_session is not None
 
         self.ssl = ssl
         self.proxy = proxy
 
         self.synced = Event()
-        self.response_callbacks = []  # type: List[ResponseCb]
+        self.response_callbacks = CallbackList()  # type: CallbackList
 
         self.sharing_session = dict()  # type: Dict[str, Event]
 
@@ -251,8 +652,76 @@ class AsyncClient(Client):
 
         self.config = config or AsyncClientConfig()  # type: AsyncClientConfig
 
+        if self.config.http2 and proxy:
+            raise LocalProtocolError(
+                "A proxy can't be used with the HTTP/2 transport"
+            )
+
+        self._http2_transport = None  # type: Optional[Http2Transport]
+        self._sync_progress = None  # type: Optional[_SyncProgress]
+        # The number of room timeline events that were handled.
+        self._handled_events = 0
+
+        self.sync_scheduler = TimeSliceScheduler(
+            self.config.sync_time_slice
+        )
+
+        self.callback_dispatcher = None  # type: Optional[CallbackDispatcher]
+        self._sync_filter_ids = {}  # type: Dict[Tuple[str, str], str]
+        self._member_loads = {}  # type: Dict[str, asyncio.Future]
+
+        if self.config.callback_concurrency:
+            self.callback_dispatcher = CallbackDispatcher(
+                self.config.callback_concurrency,
+                self.config.max_queued_callbacks,
+            )
+
         super().__init__(user, device_id, store_path, self.config)
 
+    def events(
+            self,
+            filter=None,       # type: Union[Type, Tuple[Type, ...], None]
+            room_id=None,      # type: Optional[str]
+            sender=None,       # type: Optional[str]
+            msgtype=None,      # type: Optional[str]
+            maxsize=100,       # type: int
+            overflow="block",  # type: str
+    ):
+        # type: (...) -> EventStream
+        """Get an async iterator over the room events the client receives.
+
+        The iterator yields (room, event) tuples for the room events that
+        the event callbacks would get, as an alternative to callbacks. The
+        events are received while the client syncs, e.g. in sync_forever().
+
+        Args:
+            filter (Type, Tuple[Type], optional): The event type or a tuple of
+                event types that should be received.
+            room_id (str, optional): Only receive events of this room.
+            sender (str, optional): Only receive events of this sender.
+            msgtype (str, optional): Only receive events with this msgtype.
+            maxsize (int): The maximum number of events that are buffered
+                until they are consumed.
+            overflow (str): What happens if the buffer is full, one of
+                "block", "drop_oldest" or "coalesce", see EventStream.
+
+        Example:
+            >>> async with client.events(RoomMessageText) as events:
+            ...     async for room, event in events:
+            ...         print(f"{room.display_name}: {event.body}")
+
+        """
+        stream = EventStream(self.event_callbacks, maxsize, overflow)
+        stream._callback = ClientCallback(
+            stream._put,
+            filter,
+            room_id,
+            sender,
+            msgtype,
+        )
+        self.event_callbacks.append(stream._callback)
+        return stream
+
     def add_response_callback(
             self,
             func,           # type: Coroutine[Any, Any, Response]
@@ -282,7 +751,7 @@ class AsyncClient(Client):
         self.response_callbacks.append(cb)
 
     async def parse_body(self, transport_response):
-        # type: (ClientResponse) -> Dict[Any, Any]
+        # type: (ClientResponse) -> Optional[Dict[Any, Any]]
         """Parse the body of the response.
 
         Args:
@@ -291,9 +760,21 @@ class AsyncClient(Client):
 
         Returns a dictionary representing the response.
         """
+        content_type = transport_response.headers.get("Content-Type", "")
+
+        if not JSON_CONTENT_TYPE.match(content_type.lower()):
+            return {}
+
+        body = await transport_response.read()
+
+        # Like aiohttp's json() method return None for an empty body, the
+        # response classes turn this into an error response.
+        if not body.strip():
+            return None
+
         try:
-            return await transport_response.json()
-        except (JSONDecodeError, ContentTypeError):
+            return _json.loads(body)
+        except ValueError:
             return {}
 
     async def create_matrix_response(
@@ -337,6 +818,10 @@ class AsyncClient(Client):
             parsed_dict = await self.parse_body(transport_response)
             resp = DeleteDevicesAuthResponse.from_dict(parsed_dict)
 
+        elif (response_class is SyncResponse and self.config.stream_sync
+                and transport_response.status == 200 and is_json):
+            resp = await self._stream_sync_response(transport_response, *data)
+
         else:
             parsed_dict = await self.parse_body(transport_response)
             resp = response_class.from_dict(parsed_dict, *data)
@@ -344,16 +829,124 @@ class AsyncClient(Client):
         resp.transport_response = transport_response
         return resp
 
+    async def _stream_sync_response(
+            self,
+            transport_response,  # type: ClientResponse
+            max_events=0,        # type: int
+            sampler=None,        # type: Optional[ValidationSampler]
+            lazy=False,          # type: Union[bool, Tuple[Type, ...]]
+    ):
+        # type: (...) -> Union[SyncResponse, SyncError]
+        """Parse and handle a sync response while it is being received.
+
+        Every room is handled as soon as it was received, the returned
+        response only contains the sync token, the one-time key counts and
+        the device lists.
+
+        If the response fails half way through, the events that were
+        already handled are skipped when the sync is retried with the same
+        since token. Room state and ephemeral events are handled again,
+        they describe the current state of the room and are safe to
+        repeat.
+        """
+        since = transport_response.url.query.get("since")
+
+        if not self._sync_progress or self._sync_progress.since != since:
+            self._sync_progress = _SyncProgress(since)
+
+        self._sync_progress.to_device_seen = 0
+
+        self.sync_scheduler.reset()
+        stream = SyncResponseStream(sampler, lazy, max_events)
+
+        try:
+            async for chunk in transport_response.content.iter_any():
+                for part in stream.feed(chunk):
+                    await self._handle_sync_part(part, max_events)
+
+                if stream.response:
+                    break
+
+            for part in stream.close():
+                await self._handle_sync_part(part, max_events)
+        finally:
+            # Give the connection back, or close it if the body wasn't read
+            # completely because of an error.
+            transport_response.release()
+
+        if isinstance(stream.response, SyncResponse):
+            self._sync_progress = None
+
+        return stream.response
+
+    async def _handle_sync_part(self, response, max_events=0):
+        # type: (SyncType, int) -> None
+        while True:
+            self.sync_scheduler.resume()
+
+            try:
+                await self._handle_to_device(response)
+                await self._handle_invited_rooms(response)
+                await self._handle_joined_rooms(response)
+            finally:
+                self.sync_scheduler.pause()
+
+            if not isinstance(response, PartialSyncResponse):
+                break
+
+            await asyncio.sleep(0)
+            response = response.next_part(max_events)
+
+    async def _run_sync_callback(self, cb, *args):
+        scheduler = self.sync_scheduler
+
+        if not cb.coroutine or not scheduler.running:
+            await _run_callback(cb, *args)
+            return
+
+        # The callback yields to the event loop while it's awaited, the time
+        # it takes isn't time the sync handling blocked the event loop.
+        scheduler.pause()
+
+        try:
+            await cb.func(*args)
+        finally:
+            scheduler.resume()
+
+    async def _run_room_callback(self, room_id, cb, *args):
+        dispatcher = self.callback_dispatcher
+
+        if not dispatcher:
+            await self._run_sync_callback(cb, *args)
+            return
+
+        if dispatcher.queued >= dispatcher.max_queued:
+            # Waiting for the callbacks doesn't block the event loop.
+            self.sync_scheduler.pause()
+            await dispatcher.wait_for_space()
+            self.sync_scheduler.resume()
+
+        await dispatcher.dispatch(room_id, cb, *args)
+
     async def _run_to_device_callbacks(self, event):
-        for cb in self.to_device_callbacks:
-            if (cb.filter is None
-                    or isinstance(event, cb.filter)):
-                await asyncio.coroutine(cb.func)(event)
+        for cb in self.to_device_callbacks.matching(event):
+            await self._run_sync_callback(cb, event)
 
     async def _handle_to_device(self, response):
         decrypted_to_device = []  # type: ignore
+        progress = self._sync_progress
 
         for index, to_device_event in enumerate(response.to_device_events):
+            await self.sync_scheduler.checkpoint()
+
+            if progress:
+                progress.to_device_seen += 1
+
+                if progress.to_device_seen <= progress.to_device:
+                    continue
+
+                progress.to_device = progress.to_device_seen
+
             decrypted_event = self._handle_decrypt_to_device(to_device_event)
 
             if decrypted_event:
@@ -374,26 +967,61 @@ class AsyncClient(Client):
         self._replace_decrypted_to_device(decrypted_to_device, response)
 
     async def _handle_invited_rooms(self, response):
+        progress = self._sync_progress
+
         for room_id, info in response.rooms.invite.items():
+            if progress:
+                if room_id in progress.invited_rooms:
+                    continue
+
+                progress.invited_rooms.add(room_id)
+
             room = self._get_invited_room(room_id)
 
             for event in info.invite_state:
+                await self.sync_scheduler.checkpoint()
+
                 room.handle_event(event)
 
-                for cb in self.event_callbacks:
-                    if (cb.filter is None or isinstance(event, cb.filter)):
-                        await asyncio.coroutine(cb.func)(room, event)
+                for cb in self.event_callbacks.matching(event, room_id):
+                    await self._run_room_callback(room_id, cb, room, event)
 
     async def _handle_joined_rooms(self, response):
         encrypted_rooms = set()
+        progress = self._sync_progress
 
         for room_id, join_info in response.rooms.join.items():
-            self._handle_joined_state(room_id, join_info, encrypted_rooms)
+            await self.sync_scheduler.checkpoint()
+
+            room = self._get_joined_room(room_id)
+
+            for event in join_info.state:
+                await self.sync_scheduler.checkpoint()
+
+                self._handle_joined_state_event(
+                    event,
+                    room_id,
+                    room,
+                    encrypted_rooms
+                )
+
+            self._handle_room_summary(room_id, room, join_info.summary)
 
-            room = self.rooms[room_id]
             decrypted_events = []
 
             for index, event in enumerate(join_info.timeline.events):
+                await self.sync_scheduler.checkpoint()
+
+                event_id = getattr(event, "event_id", None)
+
+                if progress and event_id:
+                    if event_id in progress.events:
+                        continue
+
+                    progress.events.add(event_id)
+
+                self._handled_events += 1
+
                 decrypted_event = self._handle_timeline_event(
                     event,
                     room_id,
@@ -405,9 +1033,8 @@ class AsyncClient(Client):
                     event = decrypted_event
                     decrypted_events.append((index, decrypted_event))
 
-                for cb in self.event_callbacks:
-                    if (cb.filter is None or isinstance(event, cb.filter)):
-                        await asyncio.coroutine(cb.func)(room, event)
+                for cb in self.event_callbacks.matching(event, room_id):
+                    await self._run_room_callback(room_id, cb, room, event)
 
             # Replace the Megolm events with decrypted ones
             for decrypted_event in decrypted_events:
@@ -417,9 +1044,8 @@ class AsyncClient(Client):
             for event in join_info.ephemeral:
                 room.handle_ephemeral_event(event)
 
-                for cb in self.ephemeral_callbacks:
-                    if (cb.filter is None or isinstance(event, cb.filter)):
-                        await asyncio.coroutine(cb.func)(room, event)
+                for cb in self.ephemeral_callbacks.matching(event):
+                    await self._run_room_callback(room_id, cb, room, event)
 
             if room.encrypted and self.olm is not None:
                 self.olm.update_tracked_users(room)
@@ -428,15 +1054,13 @@ class AsyncClient(Client):
 
         if self.store:
             self.store.save_encrypted_rooms(encrypted_rooms)
+            self._save_changed_rooms()
 
     async def _handle_expired_verifications(self):
         expired_verifications = self.olm.clear_verifications()
 
         for event in expired_verifications:
-            for cb in self.to_device_callbacks:
-                if (cb.filter is None
-                        or isinstance(event, cb.filter)):
-                    await asyncio.coroutine(cb.func)(event)
+            await self._run_to_device_callbacks(event)
 
     async def _handle_sync(self, response):
         # We already recieved such a sync response, do nothing in that case.
@@ -449,16 +1073,21 @@ class AsyncClient(Client):
             if self.config.store_sync_tokens and self.store:
                 self.store.save_sync_token(self.next_batch)
 
-        await self._handle_to_device(response)
+        self.sync_scheduler.resume()
 
-        await self._handle_invited_rooms(response)
+        try:
+            await self._handle_to_device(response)
+
+            await self._handle_invited_rooms(response)
 
-        await self._handle_joined_rooms(response)
+            await self._handle_joined_rooms(response)
 
-        if self.olm:
-            await self._handle_expired_verifications()
-            self._handle_olm_events(response)
-            await self._collect_key_requests()
+            if self.olm:
+                await self._handle_expired_verifications()
+                self._handle_olm_events(response)
+                await self._collect_key_requests()
+        finally:
+            self.sync_scheduler.pause()
 
     async def _collect_key_requests(self):
         events = self.olm.collect_key_requests()
@@ -503,6 +1132,7 @@ class AsyncClient(Client):
         content_type  = None,
         trace_context = None,
         data_provider: Optional[DataProvider] = None,
+        receive       = True,
     ):
         headers = {"content-type": content_type} if content_type else {}
 
@@ -547,9 +1177,31 @@ class AsyncClient(Client):
                 wait = await self.get_timeout_retry_wait_time(got_timeouts)
                 await asyncio.sleep(wait)
 
-        await self.receive_response(resp)
+        if receive:
+            await self.receive_response(resp)
+
         return resp
 
+    def _session_for_path(self, path):
+        # type: (str) -> ClientSession
+        """Get the client session whose connection pool handles the path."""
+        assert self.client_session
+
+        if self._shared_session or not self.config.separate_connection_pools:
+            return self.client_session
+
+        if path.startswith(MATRIX_API_PATH + "/sync"):
+            pool = "sync"
+        elif path.startswith(MATRIX_MEDIA_API_PATH):
+            pool = "media"
+        else:
+            return self.client_session
+
+        if pool not in self._pool_sessions:
+            self._pool_sessions[pool] = _create_client_session(self.config)
+
+        return self._pool_sessions[pool]
+
     @client_session
     async def send(
         self,
@@ -571,10 +1223,23 @@ class AsyncClient(Client):
                 should be used with the request.
             trace_context (Any, optional): An object to use for the
                 ClientSession TraceConfig context
+
+        Returns an Http2ClientResponse instead of a ClientResponse if the
+        http2 transport is configured.
         """
-        assert self.client_session
+        if self.config.http2:
+            if not self._http2_transport:
+                self._http2_transport = Http2Transport(
+                    self.homeserver, self.ssl, self.config.tcp_nodelay
+                )
+
+            return await self._http2_transport.request(
+                method, path, data, headers, trace_context,
+            )
 
-        return await self.client_session.request(
+        session = self._session_for_path(path)
+
+        return await session.request(
             method,
             self.homeserver + path,
             data              = data,
@@ -632,7 +1297,8 @@ class AsyncClient(Client):
             timeout=None,      # type: Optional[int]
             sync_filter=None,  # type: Optional[Dict[Any, Any]]
             since=None,        # type: Optional[str]
-            full_state=None    # type: Optional[bool]
+            full_state=None,   # type: Optional[bool]
+            max_events=None,   # type: Optional[int]
     ):
         # type: (...) -> Union[SyncResponse, SyncError]
         """Synchronise the client's state with the latest state on the server.
@@ -651,10 +1317,45 @@ class AsyncClient(Client):
             since(str, optional): A token specifying a point in time where to
                 continue the sync from. Defaults to the last sync token we
                 received from the server using this API call.
+            max_events(int, optional): The maximum number of room events that
+                are handled at once. If the response contains more events it
+                is handled in parts, other tasks get to run between the parts.
+                Defaults to the max_sync_events setting of the client config.
 
         Returns either a `SyncResponse` if the request was successful or
-        a `SyncError` if there was an error with the request.
+        a `SyncError` if there was an error with the request. If the response
+        was handled in parts the returned `SyncResponse` is the last part,
+        which contains the sync token but only the rest of the room events.
         """
+        if max_events is None:
+            max_events = self.config.max_sync_events
+
+        response = await self._sync_request(
+            timeout,
+            sync_filter,
+            since,
+            full_state,
+            max_events,
+        )
+
+        return await self._receive_sync(response, max_events)
+
+    async def _sync_request(
+            self,
+            timeout=None,      # type: Optional[int]
+            sync_filter=None,  # type: Optional[Dict[Any, Any]]
+            since=None,        # type: Optional[str]
+            full_state=None,   # type: Optional[bool]
+            max_events=0,      # type: int
+    ):
+        # type: (...) -> Union[SyncType, SyncError]
+        """Send a sync request without handling the response.
+
+        Only streamed sync responses are handled while they are received.
+        """
+        if isinstance(sync_filter, dict) and self.config.upload_sync_filters:
+            filter_id = await self._sync_filter_id(sync_filter)
+            sync_filter = filter_id or sync_filter
 
         sync_token = since or self.next_batch
         method, path = Api.sync(
@@ -665,13 +1366,104 @@ class AsyncClient(Client):
             full_state=full_state
         )
 
-        response = await self._send(SyncResponse, method, path)
+        return await self._send(
+            SyncResponse,
+            method,
+            path,
+            response_data=(
+                max_events,
+                self.validation_sampler,
+                self._lazy_events(),
+            ),
+            receive=False,
+        )
+
+    async def _sync_filter_id(self, sync_filter):
+        # type: (Dict[Any, Any]) -> Optional[str]
+        """Get the id of a sync filter, uploading the filter if needed.
+
+        Returns None if the filter couldn't be uploaded.
+        """
+        filter_hash = hashlib.sha256(
+            _json.canonical_dumps(sync_filter).encode("utf-8")
+        ).hexdigest()
+        key = (self.user_id, filter_hash)
+
+        filter_id = self._sync_filter_ids.get(key)
+
+        if filter_id:
+            return filter_id
+
+        if self.store:
+            filter_id = self.store.load_sync_filter(filter_hash)
+
+        if not filter_id:
+            response = await self.upload_filter(sync_filter)
+
+            if not isinstance(response, UploadFilterResponse):
+                return None
+
+            filter_id = response.filter_id
+
+            if self.store:
+                self.store.save_sync_filter(filter_hash, filter_id)
+
+        self._sync_filter_ids[key] = filter_id
+        return filter_id
+
+    async def _receive_sync(
+            self,
+            response,      # type: Union[SyncType, SyncError]
+            max_events=0,  # type: int
+    ):
+        # type: (...) -> Union[SyncResponse, SyncError]
+        """Handle a sync response, part by part if it was split up."""
+        # Streamed responses were handled while they were received.
+        if not self.config.stream_sync:
+            self.sync_scheduler.reset()
+
+        await self.receive_response(response)
+
+        while isinstance(response, PartialSyncResponse):
+            # Let other tasks run before the next part of the response is
+            # parsed and handled.
+            await asyncio.sleep(0)
+
+            transport_response = response.transport_response
+            response = response.next_part(max_events)
+            response.transport_response = transport_response
+
+            await self.receive_response(response)
 
         self.synced.set()
         self.synced.clear()
 
         return response
 
+    @logged_in
+    async def upload_filter(self, sync_filter):
+        # type: (Dict[Any, Any]) -> _UploadFilterT
+        """Upload a filter that can be used for sync requests.
+
+        The id of the uploaded filter can be passed to sync() instead of the
+        filter itself. Filters that are passed to sync() get uploaded
+        automatically if upload_sync_filters is set in the client config.
+
+        Returns either a `UploadFilterResponse` if the request was successful
+        or a `UploadFilterError` if there was an error with the request.
+
+        Args:
+            sync_filter (Dict[Any, Any]): The filter configuration, e.g. one
+                built by lazy_loading_filter().
+        """
+        method, path, data = Api.upload_filter(
+            self.access_token,
+            self.user_id,
+            sync_filter,
+        )
+
+        return await self._send(UploadFilterResponse, method, path, data)
+
     @logged_in
     async def send_to_device_messages(self):
         # type: () -> List[ToDeviceResponse]
@@ -690,19 +1482,18 @@ class AsyncClient(Client):
     async def run_response_callbacks(self, responses):
         """Run the configured response callbacks for the given responses."""
         for response in responses:
-            for cb in self.response_callbacks:
-                if (cb.filter is None
-                        or isinstance(response, cb.filter)):
-                    await asyncio.coroutine(cb.func)(response)
+            for cb in self.response_callbacks.matching(response):
+                await _run_callback(cb, response)
 
     @logged_in
     async def sync_forever(
             self,
-            timeout=None,         # type: Optional[int]
-            sync_filter=None,     # type: Optional[Dict[Any, Any]]
-            since=None,           # type: Optional[str]
-            full_state=None,      # type: Optional[bool]
-            loop_sleep_time=None  # type: Optional[int]
+            timeout=None,          # type: Optional[int]
+            sync_filter=None,      # type: Optional[Dict[Any, Any]]
+            since=None,            # type: Optional[str]
+            full_state=None,       # type: Optional[bool]
+            loop_sleep_time=None,  # type: Optional[int]
+            pipelined=False,       # type: bool
     ):
         # type: (...) -> None
         """Continuously sync with the configured homeserver.
@@ -732,16 +1523,130 @@ class AsyncClient(Client):
                 sync requests will use the token from the last sync response.
             loop_sleep_time (int, optional): The sleep time, if any, between
                 successful sync loop iterations in milliseconds.
+            pipelined (bool): Send the next sync request as soon as the sync
+                token of the last response is known, while the last response
+                is still being handled, its response callbacks run and the
+                other requests are in flight. Sync responses are still
+                handled one after the other, in order. Streamed sync
+                responses are handled while they are received, so the next
+                sync request is sent once the last one was handled in that
+                case. Defaults to False.
 
         """
+        if pipelined:
+            await self._sync_forever_pipelined(
+                timeout,
+                sync_filter,
+                since,
+                full_state,
+                loop_sleep_time,
+            )
+            return
+
         while True:
             try:
-                tasks = [
-                    asyncio.ensure_future(coro) for coro in (
-                        self.sync(timeout, sync_filter, since, full_state),
-                        self.send_to_device_messages()
-                    )
-                ]
+                await self._sync_once(timeout, sync_filter, since, full_state)
+
+                full_state = None
+                since = None
+
+                if loop_sleep_time:
+                    await asyncio.sleep(loop_sleep_time / 1000)
+
+            except asyncio.CancelledError:
+                break
+
+    async def _sync_once(
+            self,
+            timeout=None,      # type: Optional[int]
+            sync_filter=None,  # type: Optional[Dict[Any, Any]]
+            since=None,        # type: Optional[str]
+            full_state=None,   # type: Optional[bool]
+    ):
+        # type: (...) -> Union[SyncResponse, SyncError]
+        """Run a single iteration of the sync_forever() loop.
+
+        Syncs and sends the other required requests, then runs the response
+        callbacks of every response. Returns the sync response.
+        """
+        tasks = []
+
+        try:
+            if self.callback_dispatcher:
+                await self.callback_dispatcher.wait_for_space()
+
+            sync_task = asyncio.ensure_future(
+                self.sync(timeout, sync_filter, since, full_state)
+            )
+            tasks = [
+                sync_task,
+                asyncio.ensure_future(self.send_to_device_messages()),
+            ]
+
+            if self.should_upload_keys:
+                tasks.append(asyncio.ensure_future(self.keys_upload()))
+
+            if self.should_query_keys:
+                tasks.append(asyncio.ensure_future(self.keys_query()))
+
+            if self.should_claim_keys:
+                tasks.append(asyncio.ensure_future(
+                    self.keys_claim(self.get_users_for_key_claiming())
+                ))
+
+            for response in asyncio.as_completed(tasks):
+                await self.run_response_callbacks((await response,))
+
+            return sync_task.result()
+
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+
+            raise
+
+    async def _sync_forever_pipelined(
+            self,
+            timeout=None,         # type: Optional[int]
+            sync_filter=None,     # type: Optional[Dict[Any, Any]]
+            since=None,           # type: Optional[str]
+            full_state=None,      # type: Optional[bool]
+            loop_sleep_time=None  # type: Optional[int]
+    ):
+        # type: (...) -> None
+        max_events = self.config.max_sync_events
+        next_sync = asyncio.ensure_future(self._sync_request(
+            timeout, sync_filter, since, full_state, max_events
+        ))
+        tasks = [next_sync]
+
+        while True:
+            try:
+                response = await next_sync
+
+                if isinstance(response, (SyncResponse, PartialSyncResponse)):
+                    since = response.next_batch
+
+                if self.config.stream_sync:
+                    await self._receive_sync(response, max_events)
+
+                if self.callback_dispatcher:
+                    await self.callback_dispatcher.wait_for_space()
+
+                if loop_sleep_time:
+                    await asyncio.sleep(loop_sleep_time / 1000)
+
+                next_sync = asyncio.ensure_future(self._sync_request(
+                    timeout, sync_filter, since, None, max_events
+                ))
+                tasks = [next_sync]
+
+                if not self.config.stream_sync:
+                    response = await self._receive_sync(response, max_events)
+
+                tasks.append(
+                    asyncio.ensure_future(self.send_to_device_messages())
+                )
 
                 if self.should_upload_keys:
                     tasks.append(asyncio.ensure_future(self.keys_upload()))
@@ -754,14 +1659,10 @@ class AsyncClient(Client):
                         self.keys_claim(self.get_users_for_key_claiming())
                     ))
 
-                for response in asyncio.as_completed(tasks):
-                    await self.run_response_callbacks((await response,))
-
-                full_state = None
-                since = None
+                await self.run_response_callbacks([response])
 
-                if loop_sleep_time:
-                    await asyncio.sleep(loop_sleep_time / 1000)
+                for response in asyncio.as_completed(tasks[1:]):
+                    await self.run_response_callbacks((await response,))
 
             except asyncio.CancelledError:
                 for task in tasks:
@@ -1041,6 +1942,78 @@ class AsyncClient(Client):
             response_data=(room_id, )
         )
 
+    @logged_in
+    async def load_room_members(self, room_id):
+        # type: (str) -> Optional[_JoinedMembersT]
+        """Load the full member list of a room if it isn't loaded yet.
+
+        Rooms that are synced with lazy loaded members only contain the
+        members that are relevant for the synced events. This method fetches
+        the joined members of such a room on demand, concurrent calls for the
+        same room share a single request. If the room is encrypted the keys
+        of the new members are queried as well.
+
+        Returns None if the members of the room are already loaded, otherwise
+        the `JoinedMembersResponse` or `JoinedMembersError` of the request.
+
+        Args:
+            room_id (str): The room id of the room for which the members
+                should be loaded.
+
+        Raises `LocalProtocolError` if no room with the given id exists.
+        """
+        try:
+            room = self.rooms[room_id]
+        except KeyError:
+            raise LocalProtocolError("No such room with id {}".format(room_id))
+
+        if room.members_synced:
+            return None
+
+        future = self._member_loads.get(room_id)
+
+        if not future:
+            future = asyncio.ensure_future(self._load_room_members(room_id))
+            self._member_loads[room_id] = future
+            future.add_done_callback(
+                lambda _: self._member_loads.pop(room_id, None)
+            )
+
+        return await asyncio.shield(future)
+
+    async def _load_room_members(self, room_id):
+        # type: (str) -> _JoinedMembersT
+        response = await self.joined_members(room_id)
+        responses = [response]
+
+        if (self.rooms[room_id].encrypted and self.olm
+                and self.should_query_keys):
+            responses.append(await self.keys_query())
+
+        await self.run_response_callbacks(responses)
+
+        return response
+
+    async def room_user_name(self, room_id, user_id):
+        # type: (str, str) -> Optional[str]
+        """Get the disambiguated display name of a user in a room.
+
+        Works like `MatrixRoom.user_name()` but loads the members of the room
+        first if they are lazily loaded, so that the user is found and the
+        name is disambiguated against all the other members of the room.
+
+        Args:
+            room_id (str): The room id of the room the user is a member of.
+            user_id (str): The user id of the user.
+        """
+        room = self.rooms.get(room_id)
+
+        if not room:
+            return None
+
+        await self.load_room_members(room_id)
+        return room.user_name(user_id)
+
     @logged_in
     async def room_send(
             self,
@@ -1115,13 +2088,7 @@ class AsyncClient(Client):
                     await self.run_response_callbacks([share])
 
             except MembersSyncError:
-                responses = []
-                responses.append(await self.joined_members(room_id))
-
-                if self.should_query_keys:
-                    responses.append(await self.keys_query())
-
-                await self.run_response_callbacks(responses)
+                await self.load_room_members(room_id)
 
         raise SendRetryError("Max retries exceeded while trying to send "
                              "the message")
@@ -1237,12 +2204,16 @@ class AsyncClient(Client):
 
         shared_with = set()
 
-        missing_sessions = self.get_missing_sessions(room_id)
+        try:
+            # The group session needs to be shared with every member of the
+            # room, load them if the members are lazily loaded.
+            await self.load_room_members(room_id)
 
-        if missing_sessions:
-            await self.keys_claim(missing_sessions)
+            missing_sessions = self.get_missing_sessions(room_id)
+
+            if missing_sessions:
+                await self.keys_claim(missing_sessions)
 
-        try:
             while True:
                 user_set, to_device_dict = self.olm.share_group_session(
                     room_id,
@@ -1334,10 +2305,22 @@ class AsyncClient(Client):
 
     async def close(self):
         """Close the underlying http session."""
-        if self.client_session:
+        if self.callback_dispatcher:
+            self.callback_dispatcher.cancel()
+
+        if self.client_session and not self._shared_session:
             await self.client_session.close()
             self.client_session = None
 
+        for session in self._pool_sessions.values():
+            await session.close()
+
+        self._pool_sessions.clear()
+
+        if self._http2_transport:
+            await self._http2_transport.close()
+            self._http2_transport = None
+
     @store_loaded
     async def export_keys(self, outfile, passphrase, count=10000):
         """Export all the Megolm decryption keys of this device.
@@ -14,6 +14,7 @@
 # CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
+import asyncio
 from functools import wraps
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Type, Union
 
@@ -23,10 +24,11 @@ from collections import defaultdict
 import warnings
 
 from ..crypto import ENCRYPTION_ENABLED
-from ..events import (BadEventType, Event, KeyVerificationEvent, MegolmEvent,
-                      RoomEncryptionEvent, RoomMemberEvent,
-                      ToDeviceEvent, EncryptedToDeviceEvent, RoomKeyRequest,
-                      RoomKeyRequestCancellation)
+from ..events import (BadEvent, BadEventType, Event, KeyVerificationEvent,
+                      LazyEvent, MegolmEvent, RoomEncryptionEvent,
+                      RoomMemberEvent, ToDeviceEvent, EncryptedToDeviceEvent,
+                      RoomKeyRequest, RoomKeyRequestCancellation,
+                      UnknownBadEvent, ValidationSampler)
 from ..exceptions import LocalProtocolError, MembersSyncError
 from ..log import logger_group
 from ..responses import (ErrorResponse, JoinedMembersResponse,
@@ -37,6 +39,7 @@ from ..responses import (ErrorResponse, JoinedMembersResponse,
                          RoomMessagesResponse, ShareGroupSessionResponse,
                          SyncResponse, SyncType, ToDeviceResponse)
 from ..rooms import MatrixInvitedRoom, MatrixRoom
+from ..schemas import use_compiled_validators
 
 if ENCRYPTION_ENABLED:
     from ..crypto import Olm, DeviceStore
@@ -82,6 +85,152 @@ class ClientCallback(object):
 
     func = attr.ib()
     filter = attr.ib()
+    room_id = attr.ib(default=None)
+    sender = attr.ib(default=None)
+    msgtype = attr.ib(default=None)
+    coroutine = attr.ib(init=False)
+    scope = attr.ib(init=False)
+
+    def __attrs_post_init__(self):
+        self.coroutine = asyncio.iscoroutinefunction(self.func)
+        self.scope = tuple(
+            name for name in ("room_id", "sender", "msgtype")
+            if getattr(self, name) is not None
+        )
+
+
+def _scope_value(obj, room_id, name):
+    # type: (Any, Optional[str], str) -> Optional[str]
+    if name == "room_id":
+        return room_id
+
+    if name == "sender":
+        value = getattr(obj, "sender", None)
+    else:
+        # Look at the source so lazy events don't need to be parsed.
+        source = getattr(obj, "source", None)
+        content = source.get("content") if isinstance(source, dict) else None
+        value = content.get("msgtype") if isinstance(content, dict) else None
+
+    # The source of a lazy event isn't validated, the values are used as
+    # dictionary keys.
+    return value if isinstance(value, str) else None
+
+
+# Room events whose content is needed to update the room, lazy events of these
+# classes are parsed before they are handled.
+_ROOM_UPDATE_CLASSES = MatrixRoom.state_event_classes + (MegolmEvent,)
+
+
+def _resolve_room_update(event):
+    # type: (Any) -> Any
+    """Parse a lazy event if it updates the room.
+
+    A lazy event passes isinstance() checks for the class of its event type
+    until it's parsed, an invalid one only turns into a BadEvent then. It
+    needs to be parsed before its class decides how it's handled.
+    """
+    if type(event) is LazyEvent and isinstance(event, _ROOM_UPDATE_CLASSES):
+        return event.resolve()
+
+    return event
+
+
+class CallbackList(list):
+    """A list of callbacks that finds the callbacks for an object quickly.
+
+    The callbacks whose filter matches a class are looked up once and cached,
+    modifying the list clears the cache. Callbacks that are limited to a
+    room, a sender or a msgtype are kept in a dictionary per combination of
+    those, so only the callbacks for the room, sender and msgtype of an event
+    are looked at.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._index = {}  # type: Dict[Type, Tuple[Any, ...]]
+
+    def _for_class(self, cls):
+        # type: (Type) -> Tuple[Any, ...]
+        try:
+            return self._index[cls]
+        except KeyError:
+            pass
+
+        scopes = {}  # type: Dict[Tuple[str, ...], Dict[Tuple, List]]
+
+        for position, cb in enumerate(self):
+            if cb.filter is not None and not issubclass(cls, cb.filter):
+                continue
+
+            scope = getattr(cb, "scope", ())
+            key = tuple(getattr(cb, name) for name in scope)
+            scopes.setdefault(scope, {}).setdefault(key, []).append(
+                (position, cb)
+            )
+
+        index = tuple(
+            (scope, {
+                key: (tuple(entries), tuple(cb for _, cb in entries))
+                for key, entries in buckets.items()
+            })
+            for scope, buckets in scopes.items()
+        )
+        self._index[cls] = index
+        return index
+
+    def matching(self, obj, room_id=None):
+        # type: (Any, Optional[str]) -> Tuple[Any, ...]
+        """Get the callbacks whose filter matches the given object.
+
+        Args:
+            obj (Any): The event or response the callbacks are looked up for.
+            room_id (str, optional): The room the event belongs to.
+        """
+        cls = obj.__class__
+
+        # Objects like lazy events pretend to be of another class.
+        classes = (cls,) if type(obj) is cls else (cls, type(obj))
+        found = []
+
+        for klass in classes:
+            for scope, buckets in self._for_class(klass):
+                bucket = buckets.get(
+                    tuple(_scope_value(obj, room_id, name) for name in scope)
+                )
+
+                if bucket:
+                    found.append(bucket)
+
+        if not found:
+            return ()
+
+        if len(found) == 1:
+            return found[0][1]
+
+        callbacks = {}
+
+        for entries, _ in found:
+            callbacks.update(entries)
+
+        return tuple(cb for _, cb in sorted(callbacks.items()))
+
+
+def _clearing_index(name):
+    method = getattr(list, name)
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._index.clear()
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+for _name in ("__setitem__", "__delitem__", "__iadd__", "__imul__", "append",
+              "extend", "insert", "pop", "remove", "clear", "sort",
+              "reverse"):
+    setattr(CallbackList, _name, _clearing_index(_name))
 
 
 @attr.s(frozen=True)
@@ -99,6 +248,36 @@ class ClientConfig(object):
             end to end encryption keys.
         store_sync_tokens (bool, optional): Should the client store and restore
             sync tokens.
+        store_room_state (bool, optional): Should the client store the state
+            of the joined rooms, the room members, names, topics, power levels
+            and so on, and restore it when the store is loaded. Changes are
+            saved after every sync response. Together with store_sync_tokens
+            this lets a restarted client continue with incremental syncs
+            instead of a full state sync. The members of a restored room are
+            only loaded from the store once they are needed.
+        compiled_validators (bool, optional): Should JSON schemas be validated
+            using generated validation functions instead of jsonschema. This
+            is a process wide setting, see
+            ``nio.schemas.use_compiled_validators()``.
+        event_validation_sample_rate (float, optional): Set this only if the
+            homeserver is trusted. If set, sync responses are checked against
+            their schema but only the given fraction of the events they
+            contain is, between 0.0 and 1.0. Events that fail to parse are
+            validated regardless. The number of validated and skipped events
+            is available through the ``validation_sampler`` attribute of the
+            client. By default every event is validated.
+        lazy_events (bool, optional): Should the room state and timeline
+            events of sync responses be LazyEvent objects that are parsed
+            once one of their attributes is used. Events that the client
+            doesn't need to inspect to keep the room state up to date, and
+            that no callback looks into, are never parsed.
+        parse_callback_events_only (bool, optional): Should only the room
+            events that the client needs to keep the room state up to date
+            and the events that match a registered event callback filter be
+            parsed when a sync response is received. The other room events
+            are LazyEvent objects that give access to the event source and
+            get parsed if they are used. Has no effect if an event callback
+            without a filter, or with a BadEvent filter, is registered.
 
     Raises an ImportWarning if encryption_enabled is true but the dependencies
     for encryption aren't installed.
@@ -115,6 +294,12 @@ class ClientConfig(object):
     store_name = attr.ib(type=str, default="")
     pickle_key = attr.ib(type=str, default="DEFAULT_KEY")
     store_sync_tokens = attr.ib(type=bool, default=False)
+    store_room_state = attr.ib(type=bool, default=False)
+    compiled_validators = attr.ib(type=bool, default=False)
+    event_validation_sample_rate = attr.ib(type=Optional[float],
+                                           default=None)
+    lazy_events = attr.ib(type=bool, default=False)
+    parse_callback_events_only = attr.ib(type=bool, default=False)
 
     def __attrs_post_init__(self):
         if not ENCRYPTION_ENABLED and self.encryption_enabled:
@@ -135,6 +320,9 @@ class Client(object):
        rooms (Dict[str, MatrixRoom)): A dictionary containing a mapping of room
            ids to MatrixRoom objects. All the rooms a user is joined to will be
            here after a sync.
+       validation_sampler (ValidationSampler, optional): The sampler that
+           decides which events of a sync response get validated, only set
+           if ``event_validation_sample_rate`` is configured.
 
     Args:
        user (str): User that will be used to log in.
@@ -162,6 +350,9 @@ class Client(object):
         self.store = None  # type: Optional[MatrixStore]
         self.config = config or ClientConfig()
 
+        if self.config.compiled_validators:
+            use_compiled_validators()
+
         self.user_id = ""
         self.access_token = ""
         self.next_batch = ""
@@ -171,9 +362,20 @@ class Client(object):
         self.invited_rooms = dict()  # type: Dict[str, MatrixRoom]
         self.encrypted_rooms = set()  # type: Set[str]
 
-        self.event_callbacks = []      # type: List[ClientCallback]
-        self.ephemeral_callbacks = []  # type: List[ClientCallback]
-        self.to_device_callbacks = []  # type: List[ClientCallback]
+        # The rooms whose state changed since it was last saved, mapping to
+        # the ids of the changed members.
+        self._changed_rooms = defaultdict(set)  # type: Dict[str, Set[str]]
+
+        self.validation_sampler = None  # type: Optional[ValidationSampler]
+
+        if self.config.event_validation_sample_rate is not None:
+            self.validation_sampler = ValidationSampler(
+                self.config.event_validation_sample_rate
+            )
+
+        self.event_callbacks = CallbackList()      # type: CallbackList
+        self.ephemeral_callbacks = CallbackList()  # type: CallbackList
+        self.to_device_callbacks = CallbackList()  # type: CallbackList
 
     @property
     def logged_in(self):
@@ -330,6 +532,10 @@ class Client(object):
             if self.config.store_sync_tokens:
                 self.loaded_sync_token = self.store.load_sync_token()
 
+            if self.config.store_room_state:
+                for room_id, room in self.store.load_rooms().items():
+                    self.rooms.setdefault(room_id, room)
+
     def room_contains_unverified(self, room_id):
         # type: (str) -> bool
         """Check if a room contains unverified devices.
@@ -576,10 +782,8 @@ class Client(object):
             response.to_device_events[index] = event
 
     def _run_to_device_callbacks(self, event):
-        for cb in self.to_device_callbacks:
-            if (cb.filter is None
-                    or isinstance(event, cb.filter)):
-                cb.func(event)
+        for cb in self.to_device_callbacks.matching(event):
+            cb.func(event)
 
     def _handle_to_device(self, response):
         decrypted_to_device = []  # type: ignore
@@ -613,6 +817,40 @@ class Client(object):
 
         return self.invited_rooms[room_id]
 
+    def _lazy_events(self):
+        # type: () -> Union[bool, Tuple[Type, ...]]
+        """Get the lazy argument for parsing sync responses.
+
+        Returns True if every room event should be lazy, a tuple of the event
+        classes that need to be parsed if only the events the client needs
+        should be parsed, False otherwise.
+        """
+        if self.config.lazy_events:
+            return True
+
+        if not self.config.parse_callback_events_only:
+            return False
+
+        classes = list(MatrixRoom.state_event_classes)
+        classes.append(MegolmEvent)
+
+        for cb in self.event_callbacks:
+            if cb.filter is None:
+                return False
+
+            filters = cb.filter if isinstance(cb.filter, tuple) else (
+                cb.filter,
+            )
+
+            # Any event can turn into a bad event once it's parsed.
+            if any(issubclass(f, (BadEvent, UnknownBadEvent))
+                   for f in filters):
+                return False
+
+            classes.extend(filters)
+
+        return tuple(classes)
+
     def _handle_invited_rooms(self, response):
         for room_id, info in response.rooms.invite.items():
             room = self._get_invited_room(room_id)
@@ -620,11 +858,31 @@ class Client(object):
             for event in info.invite_state:
                 room.handle_event(event)
 
-                for cb in self.event_callbacks:
-                    if (cb.filter is None or isinstance(event, cb.filter)):
-                        cb.func(room, event)
+                for cb in self.event_callbacks.matching(event, room_id):
+                    cb.func(room, event)
 
-    def _handle_joined_state(self, room_id, join_info, encrypted_rooms):
+    def _room_state_changed(self, room_id, user_id=None):
+        # type: (str, Optional[str]) -> None
+        if not (self.store and self.config.store_room_state):
+            return
+
+        changed_members = self._changed_rooms[room_id]
+
+        if user_id:
+            changed_members.add(user_id)
+
+    def _save_changed_rooms(self):
+        # type: () -> None
+        changed_rooms = self._changed_rooms
+        self._changed_rooms = defaultdict(set)
+
+        for room_id, changed_members in changed_rooms.items():
+            room = self.rooms.get(room_id)
+
+            if room:
+                self.store.save_room(room, changed_members)
+
+    def _get_joined_room(self, room_id):
         if room_id in self.invited_rooms:
             del self.invited_rooms[room_id]
 
@@ -635,24 +893,47 @@ class Client(object):
                 self.user_id,
                 room_id in self.encrypted_rooms
             )
+            self._room_state_changed(room_id)
 
-        room = self.rooms[room_id]
+        return self.rooms[room_id]
 
-        for event in join_info.state:
-            if isinstance(event, RoomEncryptionEvent):
-                encrypted_rooms.add(room_id)
+    def _handle_joined_state_event(self, event, room_id, room,
+                                   encrypted_rooms):
+        event = _resolve_room_update(event)
 
-            if isinstance(event, RoomMemberEvent):
-                if room.handle_membership(event):
-                    self._invalidate_session_for_member_event(room_id)
-            else:
-                room.handle_event(event)
+        if isinstance(event, RoomEncryptionEvent):
+            encrypted_rooms.add(room_id)
 
-        if join_info.summary:
-            room.update_summary(join_info.summary)
+        if isinstance(event, RoomMemberEvent):
+            if room.handle_membership(event):
+                self._invalidate_session_for_member_event(room_id)
+
+            self._room_state_changed(room_id, event.state_key)
+        else:
+            room.handle_event(event)
+            self._room_state_changed(room_id)
+
+    def _handle_room_summary(self, room_id, room, summary):
+        if summary:
+            room.update_summary(summary)
+            self._room_state_changed(room_id)
+
+    def _handle_joined_state(self, room_id, join_info, encrypted_rooms):
+        room = self._get_joined_room(room_id)
+
+        for event in join_info.state:
+            self._handle_joined_state_event(
+                event,
+                room_id,
+                room,
+                encrypted_rooms
+            )
+
+        self._handle_room_summary(room_id, room, join_info.summary)
 
     def _handle_timeline_event(self, event, room_id, room, encrypted_rooms):
         decrypted_event = None
+        event = _resolve_room_update(event)
 
         if isinstance(event, MegolmEvent) and self.olm:
             event.room_id = room_id
@@ -667,9 +948,14 @@ class Client(object):
         if isinstance(event, RoomMemberEvent):
             if room.handle_membership(event):
                 self._invalidate_session_for_member_event(room_id)
+
+            self._room_state_changed(room_id, event.state_key)
         else:
             room.handle_event(event)
 
+            if isinstance(event, MatrixRoom.state_event_classes):
+                self._room_state_changed(room_id)
+
         return decrypted_event
 
     def _handle_joined_rooms(self, response):
@@ -693,9 +979,8 @@ class Client(object):
                     event = decrypted_event
                     decrypted_events.append((index, decrypted_event))
 
-                for cb in self.event_callbacks:
-                    if (cb.filter is None or isinstance(event, cb.filter)):
-                        cb.func(room, event)
+                for cb in self.event_callbacks.matching(event, room_id):
+                    cb.func(room, event)
 
             # Replace the Megolm events with decrypted ones
             for decrypted_event in decrypted_events:
@@ -705,9 +990,8 @@ class Client(object):
             for event in join_info.ephemeral:
                 room.handle_ephemeral_event(event)
 
-                for cb in self.ephemeral_callbacks:
-                    if (cb.filter is None or isinstance(event, cb.filter)):
-                        cb.func(room, event)
+                for cb in self.ephemeral_callbacks.matching(event):
+                    cb.func(room, event)
 
             if room.encrypted and self.olm is not None:
                 self.olm.update_tracked_users(room)
@@ -716,15 +1000,14 @@ class Client(object):
 
         if self.store:
             self.store.save_encrypted_rooms(encrypted_rooms)
+            self._save_changed_rooms()
 
     def _handle_expired_verifications(self):
         expired_verifications = self.olm.clear_verifications()
 
         for event in expired_verifications:
-            for cb in self.to_device_callbacks:
-                if (cb.filter is None
-                        or isinstance(event, cb.filter)):
-                    cb.func(event)
+            for cb in self.to_device_callbacks.matching(event):
+                cb.func(event)
 
     def _handle_olm_events(self, response):
         changed_users = set()
@@ -862,6 +1145,13 @@ class Client(object):
             room.add_member(
                 member.user_id, member.display_name, member.avatar_url
             )
+            self._room_state_changed(room.room_id, member.user_id)
+
+        room.members_loaded = True
+        self._room_state_changed(room.room_id)
+
+        if self.store:
+            self._save_changed_rooms()
 
         if room.encrypted and self.olm is not None:
             self.olm.update_tracked_users(room)
@@ -875,6 +1165,9 @@ class Client(object):
             if room.encrypted and self.store:
                 self.store.delete_encrypted_room(room.room_id)
 
+            if self.store and self.config.store_room_state:
+                self.store.delete_room(room.room_id)
+
         elif response.room_id in self.invited_rooms:
             del self.invited_rooms[response.room_id]
 
@@ -1051,8 +1344,15 @@ class Client(object):
 
         return message_type, content
 
-    def add_event_callback(self, callback, filter):
-        # type: (Callable[[MatrixRoom, Event], None], Tuple[Type]) -> None
+    def add_event_callback(
+            self,
+            callback,      # type: Callable[[MatrixRoom, Event], None]
+            filter,        # type: Union[Type, Tuple[Type, ...], None]
+            room_id=None,  # type: Optional[str]
+            sender=None,   # type: Optional[str]
+            msgtype=None,  # type: Optional[str]
+    ):
+        # type: (...) -> None
         """Add a callback that will be executed on room events.
 
         The callback can be used on joined rooms as well as on invited rooms.
@@ -1065,9 +1365,23 @@ class Client(object):
                 argument is found in a room timeline.
             filter (Type, Tuple[Type]): The event type or a tuple containing
                 multiple types for which the function will be called.
+            room_id (str, optional): Only call the function for events of
+                the room with the given id.
+            sender (str, optional): Only call the function for events sent by
+                the user with the given id.
+            msgtype (str, optional): Only call the function for events with
+                the given msgtype in their content, e.g. "m.text".
+
+        Example:
+            >>> client.add_event_callback(
+            ...     command_cb,
+            ...     RoomMessageText,
+            ...     room_id="!commands:example.org",
+            ...     msgtype="m.text",
+            ... )
 
         """
-        cb = ClientCallback(callback, filter)
+        cb = ClientCallback(callback, filter, room_id, sender, msgtype)
         self.event_callbacks.append(cb)
 
     def add_ephermeral_callback(self, callback, filter):
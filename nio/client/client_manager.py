@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018, 2019 Damir Jelić <poljar@termina.org.uk>
+#
+# Permission to use, copy, modify, and/or distribute this software for
+# any purpose with or without fee is hereby granted, provided that the
+# above copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER
+# RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF
+# CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+import attr
+from aiohttp import ClientSession
+
+from ..events import ValidationSampler
+from ..exceptions import LocalProtocolError
+from ..monitors import SyncMetrics
+from ..responses import SyncError
+from .async_client import (AsyncClient, AsyncClientConfig,
+                           _create_client_session)
+from .base_client import logger
+
+
+@attr.s
+class _Account(object):
+    client = attr.ib(type=AsyncClient)
+    sync_filter = attr.ib(default=None, type=Optional[Dict[Any, Any]])
+    since = attr.ib(default=None, type=Optional[str])
+    full_state = attr.ib(default=None, type=Optional[bool])
+    metrics = attr.ib(default=attr.Factory(SyncMetrics), type=SyncMetrics)
+    queued = attr.ib(default=False, type=bool)
+    timer = attr.ib(default=None, type=Optional[asyncio.TimerHandle])
+
+
+class AsyncClientManager(object):
+    """Host many AsyncClient accounts in one process.
+
+    The clients of the manager share one aiohttp session, and with it one
+    connection pool, as well as one validation sampler. Instead of running
+    sync_forever() for every account, a fixed number of sync workers sync
+    the accounts in turn. The number of tasks and of sockets used for sync
+    requests is bounded by max_concurrent_syncs, no matter how many accounts
+    the manager hosts.
+
+    Every turn of an account does the same as an iteration of
+    sync_forever(): it syncs, sends the to-device messages and key requests
+    the client needs and runs the response callbacks. The account is then
+    queued for its next turn.
+
+    Args:
+        homeserver (str): The URL of the homeserver of the accounts.
+        config (AsyncClientConfig, optional): The configuration of the
+            clients, the connection settings also configure the shared
+            connection pool.
+        max_concurrent_syncs (int): How many accounts are synced at the same
+            time.
+        sync_timeout (int, optional): The long-poll timeout of the sync
+            requests in milliseconds. If there are many more accounts than
+            max_concurrent_syncs, a short timeout keeps the time between
+            the turns of an account short. Without a timeout the server
+            answers right away and the accounts are polled in a busy loop.
+        stagger (float): The time in seconds between the starts of the sync
+            workers, so the long-polls of the accounts don't all start and
+            end at the same time.
+        error_delay (float): How many seconds an account waits for its next
+            turn after a failed sync, or if it isn't logged in.
+        ssl (bool/ssl.SSLContext, optional): SSL validation mode, see
+            AsyncClient.
+        proxy (str, optional): The proxy that should be used for the HTTP
+            connections.
+
+    Attributes:
+        validation_sampler (ValidationSampler, optional): The sampler that is
+            shared by the clients, only set if event_validation_sample_rate
+            is configured.
+        active_syncs (int): The number of accounts that are being synced.
+
+    Example:
+            >>> manager = AsyncClientManager("https://example.org",
+            ...                              max_concurrent_syncs=50,
+            ...                              sync_timeout=5000)
+            >>> for user, password in accounts:
+            ...     client = manager.add_client(user)
+            ...     await client.login(password)
+            >>> await manager.run()
+
+    """
+
+    def __init__(
+            self,
+            homeserver,               # type: str
+            config=None,              # type: Optional[AsyncClientConfig]
+            max_concurrent_syncs=10,  # type: int
+            sync_timeout=30000,       # type: Optional[int]
+            stagger=0.1,              # type: float
+            error_delay=5.0,          # type: float
+            ssl=None,                 # type: Optional[bool]
+            proxy=None,               # type: Optional[str]
+    ):
+        # type: (...) -> None
+        if max_concurrent_syncs < 1:
+            raise ValueError("max_concurrent_syncs must be at least 1")
+
+        self.homeserver = homeserver
+        self.config = config or AsyncClientConfig()
+        self.max_concurrent_syncs = max_concurrent_syncs
+        self.sync_timeout = sync_timeout
+        self.stagger = stagger
+        self.error_delay = error_delay
+        self.ssl = ssl
+        self.proxy = proxy
+
+        self.validation_sampler = None  # type: Optional[ValidationSampler]
+
+        if self.config.event_validation_sample_rate is not None:
+            self.validation_sampler = ValidationSampler(
+                self.config.event_validation_sample_rate
+            )
+
+        self.active_syncs = 0
+        self._session = None  # type: Optional[ClientSession]
+        self._accounts = dict()  # type: Dict[str, _Account]
+        # The queue holds the accounts themselves instead of their users, an
+        # entry of an account that was removed, and maybe added again in the
+        # meantime, doesn't match the registration of the user anymore.
+        self._queue = None  # type: Optional[asyncio.Queue]
+
+    @property
+    def clients(self):
+        # type: () -> Dict[str, AsyncClient]
+        """The clients of the manager, keyed by their user."""
+        return {
+            user: account.client for user, account in self._accounts.items()
+        }
+
+    @property
+    def metrics(self):
+        # type: () -> Dict[str, SyncMetrics]
+        """The sync metrics of every account, keyed by user."""
+        return {
+            user: account.metrics for user, account in self._accounts.items()
+        }
+
+    def aggregate_metrics(self):
+        # type: () -> SyncMetrics
+        """Get the sync metrics of all the accounts summed up."""
+        return SyncMetrics.combine(
+            account.metrics for account in self._accounts.values()
+        )
+
+    @property
+    def queued(self):
+        # type: () -> int
+        """The number of accounts that wait for their turn to sync."""
+        return self._queue.qsize() if self._queue else 0
+
+    def _get_session(self):
+        # type: () -> ClientSession
+        if not self._session:
+            self._session = _create_client_session(self.config)
+
+        return self._session
+
+    def add_client(
+            self,
+            user,              # type: str
+            device_id="",      # type: Optional[str]
+            store_path="",     # type: Optional[str]
+            sync_filter=None,  # type: Optional[Dict[Any, Any]]
+            since=None,        # type: Optional[str]
+            full_state=None,   # type: Optional[bool]
+    ):
+        # type: (...) -> AsyncClient
+        """Add an account to the manager.
+
+        Creates a client for the account that uses the shared session. The
+        client needs to be logged in, or have its access token restored,
+        before it gets synced. This method should be called while the event
+        loop is running.
+
+        Args:
+            user (str): The user of the account.
+            device_id (str, optional): The device id of the account.
+            store_path (str, optional): The directory that should be used for
+                the store of the account.
+            sync_filter (Dict[Any, Any], optional): A filter that should be
+                used for the sync requests of the account.
+            since (str, optional): The sync token the first sync of the
+                account should start from.
+            full_state (bool, optional): Should the first sync of the account
+                include the full state of every room.
+
+        Returns the new AsyncClient.
+
+        Raises LocalProtocolError if the manager already has an account with
+        the same user.
+        """
+        if user in self._accounts:
+            raise LocalProtocolError(
+                "An account for {} was already added".format(user)
+            )
+
+        client = AsyncClient(
+            self.homeserver,
+            user,
+            device_id,
+            store_path,
+            config=self.config,
+            ssl=self.ssl,
+            proxy=self.proxy,
+            client_session=self._get_session(),
+        )
+        client.validation_sampler = self.validation_sampler
+
+        account = _Account(client, sync_filter, since, full_state)
+        self._accounts[user] = account
+        self._enqueue(account)
+
+        return client
+
+    def remove_client(self, user):
+        # type: (str) -> Optional[AsyncClient]
+        """Remove an account from the manager.
+
+        The account isn't synced anymore, a sync that is in progress is
+        finished. The client isn't closed.
+
+        Returns the client of the account or None if there is no such
+        account.
+        """
+        account = self._accounts.pop(user, None)
+
+        if not account:
+            return None
+
+        self._cancel_timer(account)
+        return account.client
+
+    async def run(self):
+        # type: () -> None
+        """Sync the accounts of the manager until this task is cancelled."""
+        self._queue = asyncio.Queue()
+
+        for account in self._accounts.values():
+            self._enqueue(account)
+
+        workers = [
+            asyncio.ensure_future(self._sync_worker(i * self.stagger))
+            for i in range(self.max_concurrent_syncs)
+        ]
+
+        try:
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+            for account in self._accounts.values():
+                self._cancel_timer(account)
+                account.queued = False
+
+            self._queue = None
+
+    def _registered(self, account):
+        # type: (_Account) -> bool
+        return self._accounts.get(account.client.user) is account
+
+    @staticmethod
+    def _cancel_timer(account):
+        # type: (_Account) -> None
+        if account.timer:
+            account.timer.cancel()
+            account.timer = None
+
+    def _enqueue(self, account):
+        # type: (_Account) -> None
+        account.timer = None
+
+        if not self._queue or account.queued or not self._registered(account):
+            return
+
+        account.queued = True
+        self._queue.put_nowait(account)
+
+    def _requeue(self, account, delay=0.0):
+        # type: (_Account, float) -> None
+        if not self._queue or not self._registered(account):
+            return
+
+        self._cancel_timer(account)
+
+        if delay:
+            account.timer = asyncio.get_event_loop().call_later(
+                delay, self._enqueue, account
+            )
+        else:
+            self._enqueue(account)
+
+    async def _sync_worker(self, delay):
+        # type: (float) -> None
+        if delay:
+            await asyncio.sleep(delay)
+
+        while True:
+            account = await self._queue.get()
+            account.queued = False
+
+            # The account was removed after it was queued.
+            if not self._registered(account):
+                continue
+
+            if not account.client.logged_in:
+                self._requeue(account, self.error_delay)
+                continue
+
+            self._requeue(account, await self._sync_account(account))
+
+    async def _sync_account(self, account):
+        # type: (_Account) -> float
+        """Give an account its turn to sync.
+
+        Returns how many seconds the account should wait for its next turn.
+        """
+        client = account.client
+        handled_events = client._handled_events
+
+        self.active_syncs += 1
+        start = time.monotonic()
+
+        try:
+            response = await client._sync_once(
+                self.sync_timeout,
+                account.sync_filter,
+                account.since,
+                account.full_state,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(
+                "Sync of {} failed".format(client.user)
+            )
+            account.metrics.record_error(time.monotonic() - start)
+            return self.error_delay
+        finally:
+            self.active_syncs -= 1
+
+        duration = time.monotonic() - start
+
+        if isinstance(response, SyncError):
+            account.metrics.record_error(duration)
+            return self.error_delay
+
+        # The initial sync settings are kept until a sync succeeded, the
+        # following syncs continue from the token of the client.
+        account.since = None
+        account.full_state = None
+
+        # Streamed sync responses don't keep their rooms, so the events are
+        # counted by the client while it handles them.
+        account.metrics.record(
+            duration,
+            client._handled_events - handled_events,
+        )
+
+        return 0.0
+
+    async def close(self):
+        # type: () -> None
+        """Close the clients of the manager and the shared session."""
+        for account in self._accounts.values():
+            await account.client.close()
+
+        if self._session:
+            await self._session.close()
+            self._session = None
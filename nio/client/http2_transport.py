@@ -0,0 +1,768 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018, 2019 Damir Jelić <poljar@termina.org.uk>
+#
+# Permission to use, copy, modify, and/or distribute this software for
+# any purpose with or without fee is hereby granted, provided that the
+# above copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER
+# RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF
+# CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""HTTP/2 transport for the AsyncClient.
+
+The transport sends all the requests of a client as streams of a single
+HTTP/2 connection, using the h2 state machine over asyncio streams. The
+responses it returns provide the parts of the aiohttp ClientResponse
+interface that the AsyncClient uses.
+"""
+
+import asyncio
+import socket
+import ssl
+from collections import deque
+from functools import partial
+from types import MappingProxyType
+from typing import (Any, AsyncIterable, Callable, Deque, Dict, Iterable,
+                    List, Optional, Tuple, Union)
+
+import h2.config
+import h2.connection
+import h2.events
+import h2.exceptions
+from aiohttp.client_exceptions import ClientConnectionError, ClientPayloadError
+from aiohttp.client_reqrep import ContentDisposition
+from aiohttp.multipart import (content_disposition_filename,
+                               parse_content_disposition)
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from ..exceptions import RemoteTransportError
+from ..monitors import TransferMonitor
+
+READ_SIZE = 65535
+
+_HeadersT = List[Tuple[str, str]]
+_BodyT = Union[None, str, bytes, Iterable[bytes], AsyncIterable[bytes]]
+
+
+class Http2StreamContent(object):
+    """The body of a HTTP/2 response, received while it is being read.
+
+    Args:
+        acknowledge (Callable[[int], None], optional): Called with the flow
+            controlled size of every chunk once it was read, or discarded.
+            The server only sends as much data as the flow control window
+            allows, so a body that isn't read stops the server from sending
+            more of it.
+    """
+
+    def __init__(self, acknowledge=None):
+        # type: (Optional[Callable[[int], None]]) -> None
+        self._acknowledge = acknowledge
+        self._chunks = deque()  # type: Deque[Tuple[bytes, int]]
+        self._eof = False
+        self._exception = None  # type: Optional[Exception]
+        self._waiter = None  # type: Optional[asyncio.Future]
+
+    def _wake(self):
+        # type: () -> None
+        if self._waiter and not self._waiter.done():
+            self._waiter.set_result(None)
+
+        self._waiter = None
+
+    def _acknowledged(self, size):
+        # type: (int) -> None
+        if size and self._acknowledge:
+            self._acknowledge(size)
+
+    def feed_data(self, data, size=None):
+        # type: (bytes, Optional[int]) -> None
+        """Add a received chunk to the body.
+
+        The size of the chunk, including padding, is passed to the
+        acknowledge callback once it was read.
+        """
+        size = len(data) if size is None else size
+
+        if data:
+            self._chunks.append((data, size))
+            self._wake()
+        else:
+            self._acknowledged(size)
+
+    def feed_eof(self):
+        # type: () -> None
+        self._eof = True
+        self._wake()
+
+    def set_exception(self, exception):
+        # type: (Exception) -> None
+        self._exception = exception
+        self._wake()
+
+    def at_eof(self):
+        # type: () -> bool
+        return self._eof and not self._chunks
+
+    async def readany(self):
+        # type: () -> bytes
+        """Read the next received chunk of the body.
+
+        Returns an empty byte string once the whole body was read.
+        """
+        while not self._chunks and not self._eof and not self._exception:
+            self._waiter = asyncio.get_event_loop().create_future()
+            await self._waiter
+
+        if self._chunks:
+            data, size = self._chunks.popleft()
+            self._acknowledged(size)
+            return data
+
+        if self._exception:
+            raise self._exception
+
+        return b""
+
+    async def iter_any(self):
+        """Iterate over the chunks of the body as they are received."""
+        while True:
+            chunk = await self.readany()
+
+            if not chunk:
+                return
+
+            yield chunk
+
+    async def read(self):
+        # type: () -> bytes
+        """Read the rest of the body."""
+        chunks = []
+
+        async for chunk in self.iter_any():
+            chunks.append(chunk)
+
+        return b"".join(chunks)
+
+    def discard(self):
+        # type: () -> None
+        """Drop the chunks that were received but not read yet."""
+        while self._chunks:
+            _, size = self._chunks.popleft()
+            self._acknowledged(size)
+
+
+class Http2ClientResponse(object):
+    """A response received over a HTTP/2 connection.
+
+    Provides the subset of the aiohttp ClientResponse interface the
+    AsyncClient relies on.
+
+    Attributes:
+        method (str): The method of the request.
+        url (URL): The URL of the request.
+        status (int): The status code of the response.
+        headers (CIMultiDictProxy): The case-insensitive response headers.
+        content (Http2StreamContent): The body of the response, which can be
+            read while it is being received.
+    """
+
+    version = (2, 0)
+
+    def __init__(
+            self,
+            method,      # type: str
+            url,         # type: URL
+            status,      # type: int
+            headers,     # type: _HeadersT
+            content,     # type: Http2StreamContent
+            reset=None,  # type: Optional[Callable[[], None]]
+    ):
+        # type: (...) -> None
+        self.method = method
+        self.url = url
+        self.status = status
+        self.headers = CIMultiDictProxy(CIMultiDict(headers))
+        self.content = content
+        self._reset = reset
+        self._body = None  # type: Optional[bytes]
+
+    @property
+    def content_type(self):
+        # type: () -> str
+        raw = self.headers.get("Content-Type")
+
+        if not raw:
+            return "application/octet-stream"
+
+        return raw.split(";", 1)[0].strip().lower()
+
+    @property
+    def content_disposition(self):
+        # type: () -> Optional[ContentDisposition]
+        raw = self.headers.get("Content-Disposition")
+
+        if raw is None:
+            return None
+
+        disposition_type, params = parse_content_disposition(raw)
+        filename = content_disposition_filename(params)
+
+        return ContentDisposition(
+            disposition_type, MappingProxyType(params), filename
+        )
+
+    async def read(self):
+        # type: () -> bytes
+        """Read the whole body of the response."""
+        if self._body is None:
+            self._body = await self.content.read()
+
+        return self._body
+
+    def release(self):
+        # type: () -> None
+        """Stop receiving the body of the response.
+
+        The stream is reset if the body wasn't read completely, so the server
+        stops sending the rest of it.
+        """
+        if self.content.at_eof():
+            return
+
+        self.content.discard()
+
+        if self._reset:
+            self._reset()
+
+    def __repr__(self):
+        return "<Http2ClientResponse({}) [{}]>".format(self.url, self.status)
+
+
+class _Stream(object):
+    def __init__(self, headers, content):
+        # type: (asyncio.Future, Http2StreamContent) -> None
+        self.headers = headers
+        self.content = content
+
+
+class Http2Connection(object):
+    """A HTTP/2 connection that multiplexes requests as streams.
+
+    The connection is driven by a reader task that dispatches the received
+    frames to the streams. Requests wait if the server's limit of concurrent
+    streams is reached, and request bodies are sent as the flow control
+    windows of the server allow.
+
+    Attributes:
+        closed (bool): True once the connection was lost or the server asked
+            for it to be closed, new requests need a new connection.
+    """
+
+    def __init__(self, reader, writer, scheme, authority):
+        # type: (asyncio.StreamReader, asyncio.StreamWriter, str, str) -> None
+        self.scheme = scheme
+        self.authority = authority
+        self.closed = False
+
+        self._reader = reader
+        self._writer = writer
+        self._streams = dict()  # type: Dict[int, _Stream]
+        self._changed = None  # type: Optional[asyncio.Future]
+        self._settings_received = False
+
+        config = h2.config.H2Configuration(
+            client_side=True,
+            header_encoding="utf-8",
+        )
+        self._h2 = h2.connection.H2Connection(config=config)
+        self._h2.initiate_connection()
+        self._flush()
+
+        self._read_task = asyncio.ensure_future(self._read_loop())
+
+    @property
+    def open_streams(self):
+        # type: () -> int
+        """The number of requests that are waiting for their response."""
+        return len(self._streams)
+
+    def _flush(self):
+        # type: () -> None
+        data = self._h2.data_to_send()
+
+        if data and not self._writer.transport.is_closing():
+            self._writer.write(data)
+
+    def _notify(self):
+        # type: () -> None
+        """Wake up the requests that wait for a stream or window update."""
+        if self._changed and not self._changed.done():
+            self._changed.set_result(None)
+
+        self._changed = None
+
+    async def _wait_for_change(self):
+        # type: () -> None
+        if self._changed is None:
+            self._changed = asyncio.get_event_loop().create_future()
+
+        await asyncio.shield(self._changed)
+
+        if self.closed:
+            raise ClientConnectionError("The HTTP/2 connection was closed")
+
+    async def wait_for_settings(self):
+        # type: () -> None
+        """Wait until the server sent its settings.
+
+        The settings contain the number of streams the server allows to be
+        open at once, which is unlimited until they arrive.
+        """
+        while not self._settings_received:
+            await self._wait_for_change()
+
+    async def request(
+            self,
+            method,              # type: str
+            path,                # type: str
+            data=None,           # type: _BodyT
+            headers=None,        # type: Optional[Dict[str, str]]
+            trace_context=None,  # type: Any
+    ):
+        # type: (...) -> Http2ClientResponse
+        """Send a request as a new stream of the connection.
+
+        Returns once the response headers were received, the body of the
+        response can be read from the returned response.
+        """
+        while (self._h2.open_outbound_streams
+               >= self._h2.remote_settings.max_concurrent_streams):
+            await self._wait_for_change()
+
+        if self.closed:
+            raise ClientConnectionError("The HTTP/2 connection was closed")
+
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        request_headers = [
+            (":method", method.upper()),
+            (":scheme", self.scheme),
+            (":authority", self.authority),
+            (":path", path),
+        ]
+        request_headers += [
+            (name.lower(), value) for name, value in (headers or {}).items()
+        ]
+
+        if isinstance(data, bytes):
+            request_headers.append(("content-length", str(len(data))))
+
+        loop = asyncio.get_event_loop()
+        stream_id = self._h2.get_next_available_stream_id()
+        stream = _Stream(
+            loop.create_future(),
+            Http2StreamContent(partial(self._acknowledge, stream_id)),
+        )
+        # The request doesn't wait for the headers if sending its body fails,
+        # don't let that be logged as an unretrieved exception.
+        stream.headers.add_done_callback(
+            lambda f: f.cancelled() or f.exception()
+        )
+        self._streams[stream_id] = stream
+
+        self._h2.send_headers(stream_id, request_headers,
+                              end_stream=data is None)
+        self._flush()
+
+        try:
+            if data is not None:
+                await self._send_body(stream_id, data, trace_context)
+
+            status, response_headers = await stream.headers
+        except asyncio.CancelledError:
+            self._reset_stream(stream_id)
+            raise
+
+        return Http2ClientResponse(
+            method,
+            URL("{}://{}{}".format(self.scheme, self.authority, path)),
+            status,
+            response_headers,
+            stream.content,
+            partial(self._reset_stream, stream_id),
+        )
+
+    def _acknowledge(self, stream_id, size):
+        # type: (int, int) -> None
+        """Let the server send more data once a chunk of a body was read."""
+        self._h2.acknowledge_received_data(size, stream_id)
+        self._flush()
+
+    def _reset_stream(self, stream_id):
+        # type: (int) -> None
+        if self._streams.pop(stream_id, None) is None or self.closed:
+            return
+
+        try:
+            self._h2.reset_stream(stream_id)
+        except h2.exceptions.StreamClosedError:
+            pass
+
+        self._flush()
+        self._notify()
+
+    async def _send_body(self, stream_id, data, trace_context):
+        # type: (int, _BodyT, Any) -> None
+        if isinstance(data, bytes):
+            await self._send_chunk(stream_id, data, trace_context)
+        elif hasattr(data, "__aiter__"):
+            async for chunk in data:  # type: ignore
+                await self._send_chunk(stream_id, chunk, trace_context)
+        else:
+            for chunk in data:  # type: ignore
+                await self._send_chunk(stream_id, chunk, trace_context)
+
+        if stream_id in self._streams:
+            self._h2.end_stream(stream_id)
+        else:
+            # Close our side of a stream the server already finished,
+            # otherwise it would keep counting as an open stream.
+            try:
+                self._h2.reset_stream(stream_id)
+            except h2.exceptions.StreamClosedError:
+                pass
+
+        self._flush()
+
+    async def _send_chunk(self, stream_id, chunk, trace_context):
+        # type: (int, bytes, Any) -> None
+        view = memoryview(chunk)
+
+        while view:
+            if self.closed:
+                raise ClientConnectionError("The HTTP/2 connection was closed")
+
+            # The server already answered and closed the stream, the rest of
+            # the body isn't needed anymore.
+            if stream_id not in self._streams:
+                return
+
+            window = min(
+                self._h2.local_flow_control_window(stream_id),
+                self._h2.max_outbound_frame_size,
+            )
+
+            if window <= 0:
+                await self._wait_for_change()
+                continue
+
+            size = min(window, len(view))
+            self._h2.send_data(stream_id, view[:size].tobytes())
+            view = view[size:]
+
+            self._flush()
+
+            try:
+                await self._writer.drain()
+            except OSError as e:
+                raise ClientConnectionError(
+                    "The HTTP/2 connection was lost: {}".format(e)
+                ) from e
+
+            if isinstance(trace_context, TransferMonitor):
+                trace_context.transferred += size
+
+    async def _read_loop(self):
+        # type: () -> None
+        error = None  # type: Optional[Exception]
+
+        try:
+            while True:
+                data = await self._reader.read(READ_SIZE)
+
+                if not data:
+                    break
+
+                for event in self._h2.receive_data(data):
+                    self._handle_event(event)
+
+                self._flush()
+
+        except asyncio.CancelledError:
+            pass
+        except (OSError, h2.exceptions.ProtocolError) as e:
+            error = e
+        finally:
+            self._connection_lost(error)
+
+    def _handle_event(self, event):
+        # type: (h2.events.Event) -> None
+        if isinstance(event, h2.events.ResponseReceived):
+            stream = self._streams.get(event.stream_id)
+
+            if stream and not stream.headers.done():
+                headers = [(k, v) for k, v in event.headers
+                           if not k.startswith(":")]
+                status = int(dict(event.headers)[":status"])
+                stream.headers.set_result((status, headers))
+
+        elif isinstance(event, h2.events.DataReceived):
+            stream = self._streams.get(event.stream_id)
+
+            # The data is acknowledged once it was read, data nobody is going
+            # to read is acknowledged right away so that it doesn't use up the
+            # window of the connection.
+            if stream:
+                stream.content.feed_data(
+                    event.data, event.flow_controlled_length
+                )
+            else:
+                self._h2.acknowledge_received_data(
+                    event.flow_controlled_length, event.stream_id
+                )
+
+        elif isinstance(event, h2.events.StreamEnded):
+            stream = self._streams.pop(event.stream_id, None)
+
+            if stream:
+                stream.content.feed_eof()
+
+            self._notify()
+
+        elif isinstance(event, h2.events.StreamReset):
+            stream = self._streams.pop(event.stream_id, None)
+
+            if stream:
+                self._fail_stream(
+                    stream,
+                    "Stream {} was reset by the server: {}".format(
+                        event.stream_id, event.error_code
+                    )
+                )
+
+            self._notify()
+
+        elif isinstance(event, h2.events.ConnectionTerminated):
+            # Streams the server won't process are failed right away, the
+            # others may still finish before the server closes the socket.
+            self.closed = True
+
+            for stream_id in list(self._streams):
+                if (event.last_stream_id is None
+                        or stream_id > event.last_stream_id):
+                    self._fail_stream(
+                        self._streams.pop(stream_id),
+                        "The server closed the HTTP/2 connection"
+                    )
+
+            self._notify()
+
+        elif isinstance(event, h2.events.RemoteSettingsChanged):
+            self._settings_received = True
+            self._notify()
+
+        elif isinstance(event, h2.events.WindowUpdated):
+            self._notify()
+
+        if self.closed and not self._streams:
+            self._writer.close()
+
+    @staticmethod
+    def _fail_stream(stream, message):
+        # type: (_Stream, str) -> None
+        if not stream.headers.done():
+            stream.headers.set_exception(ClientConnectionError(message))
+
+        stream.content.set_exception(ClientPayloadError(message))
+
+    def _connection_lost(self, error=None):
+        # type: (Optional[Exception]) -> None
+        self.closed = True
+
+        message = "The HTTP/2 connection was lost"
+
+        if error:
+            message = "{}: {}".format(message, error)
+
+        streams, self._streams = self._streams, dict()
+
+        for stream in streams.values():
+            self._fail_stream(stream, message)
+
+        self._notify()
+        self._writer.close()
+
+    async def close(self):
+        # type: () -> None
+        """Close the connection, requests that are in flight fail."""
+        if not self.closed:
+            self._h2.close_connection()
+            self._flush()
+
+        self._read_task.cancel()
+
+        try:
+            await self._read_task
+        except asyncio.CancelledError:
+            pass
+
+
+class Http2Transport(object):
+    """Send requests to a homeserver over a single HTTP/2 connection.
+
+    The connection is opened with the first request and reopened if it was
+    lost. For https URLs HTTP/2 is negotiated with ALPN, plain http URLs are
+    spoken to with HTTP/2 prior knowledge.
+
+    Args:
+        homeserver (str): The URL of the homeserver.
+        ssl (bool/ssl.SSLContext, optional): SSL validation mode, see
+            AsyncClient.
+        tcp_nodelay (bool): Set TCP_NODELAY on the connection.
+    """
+
+    def __init__(self, homeserver, ssl=None, tcp_nodelay=True):
+        # type: (str, Any, bool) -> None
+        url = URL(homeserver)
+
+        self.scheme = url.scheme
+        self.host = url.host
+        self.port = url.port
+        self.ssl = ssl
+        self.tcp_nodelay = tcp_nodelay
+
+        if url.is_default_port():
+            self.authority = url.raw_host
+        else:
+            self.authority = "{}:{}".format(url.raw_host, url.port)
+
+        self.connection = None  # type: Optional[Http2Connection]
+        self._connecting = None  # type: Optional[asyncio.Future]
+
+    def _ssl_context(self):
+        # type: () -> Optional[ssl.SSLContext]
+        if self.scheme != "https":
+            return None
+
+        if isinstance(self.ssl, ssl.SSLContext):
+            context = self.ssl
+        else:
+            context = ssl.create_default_context()
+
+            if self.ssl is False:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+
+        context.set_alpn_protocols(["h2"])
+        return context
+
+    async def _open_connection(self):
+        # type: () -> Http2Connection
+        context = self._ssl_context()
+
+        try:
+            reader, writer = await asyncio.open_connection(
+                self.host, self.port, ssl=context
+            )
+        except OSError as e:
+            raise ClientConnectionError(
+                "Cannot connect to {}: {}".format(self.authority, e)
+            ) from e
+
+        if context:
+            ssl_object = writer.get_extra_info("ssl_object")
+
+            if ssl_object.selected_alpn_protocol() != "h2":
+                writer.close()
+                raise RemoteTransportError(
+                    "{} doesn't support HTTP/2".format(self.authority)
+                )
+
+        sock = writer.get_extra_info("socket")
+
+        if sock is not None and sock.family in (socket.AF_INET,
+                                                socket.AF_INET6):
+            sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY, self.tcp_nodelay
+            )
+
+        connection = Http2Connection(
+            reader, writer, self.scheme, self.authority
+        )
+
+        try:
+            await connection.wait_for_settings()
+        except BaseException:
+            await connection.close()
+            raise
+
+        return connection
+
+    async def _get_connection(self):
+        # type: () -> Http2Connection
+        if self.connection and not self.connection.closed:
+            return self.connection
+
+        # Requests that are sent while the connection is being opened wait
+        # for it instead of opening their own one.
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._open_connection())
+
+        connecting = self._connecting
+
+        try:
+            connection = await asyncio.shield(connecting)
+        finally:
+            if self._connecting is connecting and connecting.done():
+                self._connecting = None
+
+        self.connection = connection
+        return connection
+
+    async def request(
+            self,
+            method,              # type: str
+            path,                # type: str
+            data=None,           # type: _BodyT
+            headers=None,        # type: Optional[Dict[str, str]]
+            trace_context=None,  # type: Any
+    ):
+        # type: (...) -> Http2ClientResponse
+        """Send a request to the homeserver.
+
+        Args:
+            method (str): The request method.
+            path (str): The URL path of the request, including the query.
+            data (bytes, str or iterable of bytes, optional): The request
+                body.
+            headers (Dict[str, str], optional): Additional request headers.
+            trace_context (Any, optional): A TransferMonitor that should be
+                updated while the request body is sent.
+
+        Raises ClientConnectionError if the connection couldn't be opened or
+        was lost before the response headers were received.
+        """
+        connection = await self._get_connection()
+        return await connection.request(
+            method, path, data, headers, trace_context
+        )
+
+    async def close(self):
+        # type: () -> None
+        """Close the connection of the transport."""
+        if self._connecting:
+            self._connecting.cancel()
+            self._connecting = None
+
+        if self.connection:
+            await self.connection.close()
+            self.connection = None
@@ -15,7 +15,6 @@
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 import cgi
-import json
 import pprint
 from builtins import str, super
 from collections import deque
@@ -36,13 +35,15 @@ except ImportError:
 
 
 from . import Client, ClientConfig
+from .. import _json
 from .base_client import logged_in, store_loaded
 from ..api import (Api, MessageDirection, ResizingMethod, RoomVisibility,
                    RoomPreset)
 from ..events import MegolmEvent
 from ..exceptions import LocalProtocolError, RemoteTransportError
-from ..http import (Http2Connection, Http2Request, HttpConnection, HttpRequest,
-                    TransportRequest, TransportResponse, TransportType)
+from ..http import (Http2Connection, Http2Request, HttpConnection,
+                    HttpConnectionPool, HttpRequest, TransportRequest,
+                    TransportResponse, TransportType)
 from ..log import logger_group
 from ..responses import (DeleteDevicesAuthResponse, DeleteDevicesResponse,
                          DownloadResponse, DevicesResponse, FileResponse,
@@ -68,15 +69,11 @@ if False:
     from .event_builders import ToDeviceMessage
     from .crypto import OlmDevice
 
-try:
-    from json.decoder import JSONDecodeError
-except ImportError:
-    JSONDecodeError = ValueError  # type: ignore
-
-
 logger = Logger("nio.client")
 logger_group.add_logger(logger)
 
+_ConnectionT = Union[HttpConnection, HttpConnectionPool, Http2Connection]
+
 
 def connected(func):
     @wraps(func)
@@ -110,7 +107,7 @@ class HttpClient(Client):
         self.partial_sync = None  # type: Optional[PartialSyncResponse]
 
         self.connection = None \
-            # type: Optional[Union[HttpConnection, Http2Connection]]
+            # type: Optional[_ConnectionT]
 
         super().__init__(user, device_id, store_path, config)
 
@@ -161,7 +158,7 @@ class HttpClient(Client):
 
         method, api_data = unpack_api_call(*api_response)
 
-        if isinstance(self.connection, HttpConnection):
+        if isinstance(self.connection, (HttpConnection, HttpConnectionPool)):
             if method == "GET":
                 path = self._add_extra_path(api_data[0])
                 return HttpRequest.get(self.host, path, timeout)
@@ -192,22 +189,85 @@ class HttpClient(Client):
     @property
     def lag(self):
         # type: () -> float
+        """How many seconds the longest waiting request is overdue.
+
+        The timeout of long-polling requests is not counted. With a
+        connection pool this is the lag of the slowest connection, the
+        number of requests every connection is waiting for is given by
+        queue_depths.
+        """
         if not self.connection:
             return 0
 
         return self.connection.elapsed
 
-    def connect(self, transport_type=TransportType.HTTP):
-        # type: (Optional[TransportType]) -> bytes
+    @property
+    def queue_depths(self):
+        # type: () -> List[int]
+        """The number of requests waiting for a response, per connection."""
+        if not self.connection:
+            return []
+
+        if isinstance(self.connection, HttpConnectionPool):
+            return self.connection.queue_depths
+
+        return [self.connection.queue_depth]
+
+    def connect(
+        self,
+        transport_type=TransportType.HTTP,  # type: Optional[TransportType]
+        connections=1,                      # type: int
+        pipelining=False,                   # type: bool
+    ):
+        # type: (...) -> bytes
+        """Set up the connection state of the client.
+
+        Args:
+            transport_type (TransportType): The transport that should be
+                used.
+            connections (int): The number of HTTP/1.1 connections. If more
+                than one is used, the first one is dedicated to long-polling
+                sync requests and the other requests are spread over the
+                rest. Every connection needs its own socket, the data is
+                exchanged with data_to_send() and receive() with the index of
+                the connection as the connection_id, the request methods
+                return no data in that case.
+            pipelining (bool): Pipeline idempotent GET requests on the
+                HTTP/1.1 connections instead of waiting for the response to
+                the previous request.
+
+        Returns the data that should be sent to the socket, or to every
+        socket of a connection pool.
+        """
         if transport_type == TransportType.HTTP:
-            self.connection = HttpConnection()
+            if connections > 1:
+                self.connection = HttpConnectionPool(connections, pipelining)
+            else:
+                self.connection = HttpConnection(pipelining)
         elif transport_type == TransportType.HTTP2:
+            if connections > 1:
+                raise LocalProtocolError(
+                    "HTTP/2 multiplexes requests over a single connection"
+                )
+
             self.connection = Http2Connection()
         else:
             raise NotImplementedError
 
         return self.connection.connect()
 
+    def _connection_args(self, connection_id):
+        # type: (Optional[int]) -> Tuple[int, ...]
+        if isinstance(self.connection, HttpConnectionPool):
+            if connection_id is None:
+                raise LocalProtocolError(
+                    "A connection id is required for a connection pool"
+                )
+
+            return (connection_id,)
+
+        return ()
+
     def _clear_queues(self):
         self.requests_made.clear()
         self.parse_queue.clear()
@@ -223,10 +283,18 @@ class HttpClient(Client):
         return data
 
     @connected
-    def data_to_send(self):
-        # type: () -> bytes
+    def data_to_send(self, connection_id=None):
+        # type: (Optional[int]) -> bytes
+        """Get the data that should be sent to the socket.
+
+        Args:
+            connection_id (int, optional): The index of the connection, only
+                used and required if there is a connection pool.
+        """
         assert self.connection
-        return self.connection.data_to_send()
+        return self.connection.data_to_send(
+            *self._connection_args(connection_id)
+        )
 
     @connected
     def login_info(self):
@@ -1197,7 +1265,13 @@ class HttpClient(Client):
             timeout
         )
 
-        return self._send(request, RequestInfo(SyncResponse))
+        return self._send(
+            request,
+            RequestInfo(
+                SyncResponse,
+                (0, self.validation_sampler, self._lazy_events())
+            )
+        )
 
     def parse_body(self, transport_response):
         # type: (TransportResponse) -> Dict[Any, Any]
@@ -1210,8 +1284,8 @@ class HttpClient(Client):
         Returns a dictionary representing the response.
         """
         try:
-            return json.loads(transport_response.text)
-        except JSONDecodeError:
+            return _json.loads(transport_response.content)
+        except ValueError:
             return {}
 
     def _create_response(self, request_info, transport_response, max_events=0):
@@ -1279,17 +1353,25 @@ class HttpClient(Client):
             self.olm.save_account()
 
     @connected
-    def receive(self, data):
-        # type: (bytes) -> None
-        """Pass received data to the client"""
+    def receive(self, data, connection_id=None):
+        # type: (bytes, Optional[int]) -> None
+        """Pass received data to the client
+
+        Args:
+            data (bytes): The data that was received.
+            connection_id (int, optional): The index of the connection the
+                data was received on, only used and required if there is a
+                connection pool.
+        """
         assert self.connection
+        args = self._connection_args(connection_id)
 
         try:
-            response = self.connection.receive(data)
+            response = self.connection.receive(data, *args)
         except (h11.RemoteProtocolError, h2.exceptions.ProtocolError) as e:
             raise RemoteTransportError(e)
 
-        if response:
+        while response:
             try:
                 request_info = self.requests_made.pop(response.uuid)
             except KeyError:
@@ -1311,7 +1393,15 @@ class HttpClient(Client):
                 )
 
             self.parse_queue.append((request_info, response))
-        return
+
+            if isinstance(self.connection, Http2Connection):
+                break
+
+            # Responses to pipelined requests may have been received at once.
+            try:
+                response = self.connection.next_buffered(*args)
+            except h11.RemoteProtocolError as e:
+                raise RemoteTransportError(e)
 
     def next_response(self, max_events=0):
         # type: (int) -> Optional[Union[TransportResponse, Response]]
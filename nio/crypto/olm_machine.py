@@ -32,6 +32,7 @@ from cachetools import LRUCache
 from . import (DeviceStore, GroupSessionStore, InboundGroupSession,
                InboundSession, OlmAccount, OlmDevice, OutboundGroupSession,
                OutboundSession, Session, SessionStore, logger)
+from .. import _json
 from ..api import Api
 from ..events import (BadEvent, BadEventType, Event,
                       ForwardedRoomKeyEvent, KeyVerificationAccept,
@@ -1483,8 +1484,8 @@ class Olm(object):
                     verified = True
 
         try:
-            parsed_dict = json.loads(plaintext)  # type: Dict[Any, Any]
-        except JSONDecodeError as e:
+            parsed_dict = _json.loads(plaintext)  # type: Dict[Any, Any]
+        except ValueError as e:
             raise EncryptionError("Error parsing payload: {}".format(str(e)))
 
         bad = validate_or_badevent(
@@ -1605,8 +1606,8 @@ class Olm(object):
 
         # The plaintext should be valid json, let's parse it and verify it.
         try:
-            parsed_payload = json.loads(plaintext)
-        except JSONDecodeError as e:
+            parsed_payload = _json.loads(plaintext)
+        except ValueError as e:
             # Failed parsing the payload, return early.
             logger.error(
                 "Failed to parse Olm message payload: {}".format(str(e))
@@ -33,7 +33,7 @@ from ..schemas import Schemas
 from .misc import verify
 
 
-@attr.s
+@attr.s(slots=True)
 class AccountDataEvent(object):
     """Abstract class for account data events."""
 
@@ -52,7 +52,7 @@ class AccountDataEvent(object):
         return UnknownAccountDataEvent.from_dict(event_dict)
 
 
-@attr.s
+@attr.s(slots=True)
 class FullyReadEvent(AccountDataEvent):
     """Read marker location event.
 
@@ -78,7 +78,7 @@ class FullyReadEvent(AccountDataEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class TagEvent(AccountDataEvent):
     """Event representing the tags of a room.
 
@@ -107,7 +107,7 @@ class TagEvent(AccountDataEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class UnknownAccountDataEvent(AccountDataEvent):
     """Account data event of an unknown type.
 
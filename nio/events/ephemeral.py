@@ -31,7 +31,7 @@ from ..schemas import Schemas
 from .misc import verify_or_none
 
 
-@attr.s
+@attr.s(slots=True)
 class EphemeralEvent(object):
     """Base class for ephemeral events."""
 
@@ -69,7 +69,7 @@ class EphemeralEvent(object):
         raise NotImplementedError()
 
 
-@attr.s
+@attr.s(slots=True)
 class TypingNoticeEvent(EphemeralEvent):
     """Informs the client of the list of users currently typing in a room.
 
@@ -37,7 +37,7 @@ from ..schemas import Schemas
 from .misc import BadEventType, verify, verify_or_none
 
 
-@attr.s
+@attr.s(slots=True)
 class InviteEvent(object):
     """Matrix Event class for events in invited rooms.
 
@@ -100,7 +100,7 @@ class InviteEvent(object):
         raise NotImplementedError()
 
 
-@attr.s
+@attr.s(slots=True)
 class InviteMemberEvent(InviteEvent):
     """Class representing to an m.room.member event in an invited room.
 
@@ -149,7 +149,7 @@ class InviteMemberEvent(InviteEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class InviteAliasEvent(InviteEvent):
     """An event informing us about which alias should be preferred.
 
@@ -172,7 +172,7 @@ class InviteAliasEvent(InviteEvent):
         return cls(parsed_dict, sender, canonical_alias)
 
 
-@attr.s
+@attr.s(slots=True)
 class InviteNameEvent(InviteEvent):
     """Event holding the name of the invited room.
 
@@ -14,8 +14,10 @@
 # CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
+import random
+import threading
 from functools import wraps
-from typing import Any, Dict, Optional, Union
+from typing import Any, Callable, Dict, Optional, Union
 
 import attr
 from jsonschema.exceptions import SchemaError, ValidationError
@@ -27,12 +29,81 @@ from ..schemas import validate_json
 logger = Logger("nio.events")
 logger_group.add_logger(logger)
 
+# Per thread flag that is set while a ValidationSampler parses an event
+# without validating it.
+_validation = threading.local()
+
+
+def _skip_validation():
+    # type: () -> bool
+    return getattr(_validation, "skip", False)
+
+
+@attr.s
+class ValidationSampler(object):
+    """Validate only a sample of the events that get parsed.
+
+    Events that aren't part of the sample are parsed without checking them
+    against their schema. If parsing such an event fails because it's
+    malformed, the event is parsed again with full validation, so malformed
+    events still turn into a BadEvent or UnknownBadEvent.
+
+    This is meant to be used with trusted homeservers, where the cost of
+    validating every single event isn't worth it.
+
+    Attributes:
+        sample_rate (float): The fraction of events that are validated,
+            between 0.0 (no event is validated) and 1.0 (every event is
+            validated).
+        validated (int): The number of events that were validated, either
+            because they were sampled or because parsing them failed.
+        skipped (int): The number of events that were parsed without
+            validation.
+        fallbacks (int): The number of events that failed to parse without
+            validation and had to be validated.
+
+    """
+
+    sample_rate = attr.ib(type=float, default=0.0)
+    validated = attr.ib(type=int, default=0, init=False)
+    skipped = attr.ib(type=int, default=0, init=False)
+    fallbacks = attr.ib(type=int, default=0, init=False)
+
+    def parse(self, parse_function, event_dict):
+        # type: (Callable, Dict[Any, Any]) -> Any
+        """Parse an event, validating it only if it's part of the sample.
+
+        Args:
+            parse_function (Callable): The function that parses the event,
+                e.g. Event.parse_event.
+            event_dict (dict): The dictionary representation of the event.
+
+        Returns the result of the parse function.
+        """
+        if random.random() >= self.sample_rate:
+            _validation.skip = True
+
+            try:
+                event = parse_function(event_dict)
+                self.skipped += 1
+                return event
+            except (KeyError, TypeError, AttributeError):
+                self.fallbacks += 1
+            finally:
+                _validation.skip = False
+
+        self.validated += 1
+        return parse_function(event_dict)
+
 
 def validate_or_badevent(
     parsed_dict,  # type: Dict[Any, Any]
     schema        # type: Dict[Any, Any]
 ):
     # type: (...) -> Optional[Union[BadEvent, UnknownBadEvent]]
+    if _skip_validation():
+        return None
+
     try:
         validate_json(parsed_dict, schema)
     except (ValidationError, SchemaError) as e:
@@ -66,6 +137,9 @@ def verify_or_none(schema):
         def wrapper(*args, **kwargs):
             event_dict = args[1]
 
+            if _skip_validation():
+                return f(*args, **kwargs)
+
             try:
                 validate_json(event_dict, schema)
             except (ValidationError, SchemaError) as e:
@@ -77,7 +151,7 @@ def verify_or_none(schema):
     return decorator
 
 
-@attr.s
+@attr.s(slots=True)
 class UnknownBadEvent(object):
     """An event that doesn't have the minimal necessary structure.
 
@@ -113,7 +187,7 @@ class UnknownBadEvent(object):
     session_id = attr.ib(default=None, init=False)      # type: Optional[str]
 
 
-@attr.s
+@attr.s(slots=True)
 class BadEvent(object):
     """An event that failed event schema and type validation.
 
@@ -143,6 +217,9 @@ class BadEvent(object):
         transaction_id (str, optional): The unique identifier that was used
             when the message was sent. Is only set if the message was sent from
             our own device, otherwise None.
+        room_id (str, optional): The unique identifier of the room the event
+            was decrypted for. Is only set if decrypted is True, otherwise
+            None.
 
     """
 
@@ -157,6 +234,7 @@ class BadEvent(object):
     sender_key = attr.ib(default=None, init=False)      # type: Optional[str]
     session_id = attr.ib(default=None, init=False)      # type: Optional[str]
     transaction_id = attr.ib(default=None, init=False)  # type: Optional[str]
+    room_id = attr.ib(default=None, init=False)         # type: Optional[str]
 
     def __str__(self):
         return "Bad event of type {}, from {}.".format(self.type, self.sender)
@@ -17,17 +17,18 @@
 from __future__ import unicode_literals
 
 import time
-from typing import Any, Dict, Optional, Union
+from typing import Any, Callable, Dict, Optional, Type, Union
 
 import attr
 
+from .._compat import intern_string
 from ..schemas import Schemas
 from .misc import (BadEventType, UnknownBadEvent, validate_or_badevent, verify,
                    BadEvent)
 from ..event_builders import ToDeviceMessage
 
 
-@attr.s
+@attr.s(slots=True)
 class Event(object):
     """Matrix Event class.
 
@@ -53,6 +54,9 @@ class Event(object):
         transaction_id (str, optional): The unique identifier that was used
             when the message was sent. Is only set if the message was sent from
             our own device, otherwise None.
+        room_id (str, optional): The unique identifier of the room the event
+            was decrypted for. Is only set if decrypted is True, otherwise
+            None.
 
     """
 
@@ -67,12 +71,47 @@ class Event(object):
     sender_key = attr.ib(default=None, init=False)  # type: Optional[str]
     session_id = attr.ib(default=None, init=False)  # type: Optional[str]
     transaction_id = attr.ib(default=None, init=False)  # type: Optional[str]
+    room_id = attr.ib(default=None, init=False)  # type: Optional[str]
+
+    # Mapping of event types to the function that parses events of this type,
+    # filled at the end of the module.
+    _event_parsers = {}  # type: Dict[str, Callable]
 
     def __attrs_post_init__(self):
         self.event_id = self.source["event_id"]
         self.sender = self.source["sender"]
         self.server_timestamp = self.source["origin_server_ts"]
 
+    @classmethod
+    def register_event_type(cls, event_type, event_class):
+        # type: (str, Type[Event]) -> None
+        """Register a class that should be used for events of a given type.
+
+        The from_dict() method of the class will be used to create the event
+        every time an event of the given type is parsed. This allows clients
+        to add support for custom event types or to replace the class of a
+        known event type.
+
+        Args:
+            event_type (str): The Matrix event type, e.g. "org.example.poll".
+            event_class (Type[Event]): A subclass of Event which implements
+                from_dict().
+
+        Example:
+            >>> @attr.s
+            >>> class PollEvent(Event):
+            >>>     question = attr.ib()
+            >>>
+            >>>     @classmethod
+            >>>     def from_dict(cls, parsed_dict):
+            >>>         return cls(parsed_dict,
+            >>>                    parsed_dict["content"]["question"])
+            >>>
+            >>> Event.register_event_type("org.example.poll", PollEvent)
+
+        """
+        Event._event_parsers[event_type] = event_class.from_dict
+
     @classmethod
     def from_dict(cls, parsed_dict):
         # type: (Dict[Any, Any]) -> Union[Event, BadEventType]
@@ -99,47 +138,79 @@ class Event(object):
 
         If the type of the event is now known an UnknownEvent will be produced.
 
+        The event type, sender and state key of the event are interned.
+
         Args:
             event_dict (dict): The dictionary representation of the event.
 
         """
+        for key in ("type", "sender", "state_key"):
+            if key in event_dict:
+                event_dict[key] = intern_string(event_dict[key])
+
         if "unsigned" in event_dict:
             if "redacted_because" in event_dict["unsigned"]:
                 return RedactedEvent.from_dict(event_dict)
 
-        if event_dict["type"] == "m.room.message":
-            return RoomMessage.parse_event(event_dict)
-        elif event_dict["type"] == "m.room.create":
-            return RoomCreateEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.guest_access":
-            return RoomGuestAccessEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.join_rules":
-            return RoomJoinRulesEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.history_visibility":
-            return RoomHistoryVisibilityEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.member":
-            return RoomMemberEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.canonical_alias":
-            return RoomAliasEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.name":
-            return RoomNameEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.topic":
-            return RoomTopicEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.avatar":
-            return RoomAvatarEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.power_levels":
-            return PowerLevelsEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.encryption":
-            return RoomEncryptionEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.redaction":
-            return RedactionEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.encrypted":
-            return Event.parse_encrypted_event(event_dict)
-        elif event_dict["type"].startswith("m.call"):
-            return CallEvent.parse_event(event_dict)
+        parser = Event._event_parsers.get(event_dict["type"])
+
+        if parser:
+            return parser(event_dict)
 
         return UnknownEvent.from_dict(event_dict)
 
+    @classmethod
+    def class_for_event(cls, event_dict):
+        # type: (Dict[Any, Any]) -> Type[Union[Event, BadEventType]]
+        """Get the class parse_event() will most likely produce for an event.
+
+        The class is looked up using the event type, the msgtype of messages
+        and the algorithm of encrypted events, the event itself isn't
+        validated. If the event fails validation once it's parsed the parsed
+        event will be a BadEvent instead.
+
+        Args:
+            event_dict (dict): The dictionary representation of the event.
+
+        """
+        if not isinstance(event_dict, dict):
+            return UnknownBadEvent
+
+        event_type = event_dict.get("type")
+        content = event_dict.get("content")
+        content = content if isinstance(content, dict) else {}
+        unsigned = event_dict.get("unsigned")
+
+        if not isinstance(event_type, str):
+            return UnknownBadEvent
+
+        if isinstance(unsigned, dict) and "redacted_because" in unsigned:
+            return RedactedEvent
+
+        if event_type == "m.room.message":
+            msgtype = content.get("msgtype")
+
+            if not isinstance(msgtype, str):
+                return RoomMessageUnknown
+
+            return RoomMessage._msgtype_classes.get(
+                msgtype,
+                RoomMessageUnknown
+            )
+
+        if event_type == "m.room.encrypted":
+            if content.get("algorithm") == "m.megolm.v1.aes-sha2":
+                return MegolmEvent
+            return UnknownEncryptedEvent
+
+        parser = Event._event_parsers.get(event_type)
+
+        if parser is None:
+            return UnknownEvent
+
+        # The parsers are from_dict() methods bound to the event class.
+        return getattr(parser, "__self__", Event)
+
     @classmethod
     @verify(Schemas.room_encrypted)
     def parse_encrypted_event(cls, event_dict):
@@ -159,6 +230,10 @@ class Event(object):
         """
         content = event_dict["content"]
 
+        for key in ("algorithm", "sender_key", "device_id"):
+            if key in content:
+                content[key] = intern_string(content[key])
+
         if content["algorithm"] == "m.megolm.v1.aes-sha2":
             return MegolmEvent.from_dict(event_dict)
 
@@ -189,7 +264,7 @@ class Event(object):
         return Event.parse_event(event_dict)
 
 
-@attr.s
+@attr.s(slots=True)
 class UnknownEvent(Event):
     """An Event which we do not understand.
 
@@ -212,7 +287,7 @@ class UnknownEvent(Event):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class UnknownEncryptedEvent(Event):
     """An encrypted event which we don't know how to decrypt.
 
@@ -237,7 +312,7 @@ class UnknownEncryptedEvent(Event):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class MegolmEvent(Event):
     """An undecrypted Megolm event.
 
@@ -349,7 +424,7 @@ class MegolmEvent(Event):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class CallEvent(Event):
     """Base Class for Matrix call signalling events.
 
@@ -394,7 +469,7 @@ class CallEvent(Event):
         return event
 
 
-@attr.s
+@attr.s(slots=True)
 class CallCandidatesEvent(CallEvent):
     """Call event holding additional VoIP ICE candidates.
 
@@ -420,7 +495,7 @@ class CallCandidatesEvent(CallEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class CallInviteEvent(CallEvent):
     """Event representing an invitation to a VoIP call.
 
@@ -457,7 +532,7 @@ class CallInviteEvent(CallEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class CallAnswerEvent(CallEvent):
     """Event representing the answer to a VoIP call.
 
@@ -484,7 +559,7 @@ class CallAnswerEvent(CallEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class CallHangupEvent(CallEvent):
     """An event representing the end of a VoIP call.
 
@@ -505,7 +580,7 @@ class CallHangupEvent(CallEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class RedactedEvent(Event):
     """An event that has been redacted.
 
@@ -549,7 +624,7 @@ class RedactedEvent(Event):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomEncryptionEvent(Event):
     """An event signaling that encryption has been enabled in a room."""
 
@@ -559,7 +634,7 @@ class RoomEncryptionEvent(Event):
         return cls(parsed_dict)
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomCreateEvent(Event):
     """The first event in a room, signaling that the room was created.
 
@@ -587,7 +662,7 @@ class RoomCreateEvent(Event):
         return cls(parsed_dict, creator, federate, version)
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomGuestAccessEvent(Event):
     """Event signaling whether guest users are allowed to join rooms.
 
@@ -608,7 +683,7 @@ class RoomGuestAccessEvent(Event):
         return cls(parsed_dict, guest_access)
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomJoinRulesEvent(Event):
     """An event telling us how users can join the room.
 
@@ -631,7 +706,7 @@ class RoomJoinRulesEvent(Event):
         return cls(parsed_dict, join_rule)
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomHistoryVisibilityEvent(Event):
     """An event telling whether users can read the room history.
 
@@ -673,7 +748,7 @@ class RoomHistoryVisibilityEvent(Event):
         return cls(parsed_dict, history_visibility)
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomAliasEvent(Event):
     """An event informing us about which alias should be preferred.
 
@@ -693,7 +768,7 @@ class RoomAliasEvent(Event):
         return cls(parsed_dict, canonical_alias)
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomNameEvent(Event):
     """Event holding the name of the room.
 
@@ -717,7 +792,7 @@ class RoomNameEvent(Event):
         return cls(parsed_dict, room_name)
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomTopicEvent(Event):
     """Event holding the topic of a room.
 
@@ -741,7 +816,7 @@ class RoomTopicEvent(Event):
         return cls(parsed_dict, canonical_alias)
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomAvatarEvent(Event):
     """Event holding a picture that is associated with the room.
 
@@ -761,7 +836,7 @@ class RoomAvatarEvent(Event):
         return cls(parsed_dict, room_avatar_url)
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomMessage(Event):
     """Abstract room message class.
 
@@ -771,28 +846,37 @@ class RoomMessage(Event):
     The class has one child class per msgtype.
     """
 
+    # Mappings of msgtypes to the classes that are used for them, filled at
+    # the end of the module.
+    _msgtype_classes = {}  # type: Dict[str, Type[RoomMessage]]
+    _decrypted_msgtype_classes = {}  # type: Dict[str, Type[RoomMessage]]
+
+    @classmethod
+    def register_msgtype(cls, msgtype, message_class):
+        # type: (str, Type[RoomMessage]) -> None
+        """Register a class that should be used for messages of a msgtype.
+
+        The from_dict() method of the class will be used to create the event
+        every time a m.room.message event with the given msgtype is parsed.
+
+        Args:
+            msgtype (str): The msgtype of the message, e.g.
+                "org.example.location".
+            message_class (Type[RoomMessage]): A subclass of RoomMessage
+                which implements from_dict().
+
+        """
+        RoomMessage._msgtype_classes[msgtype] = message_class
+
     @classmethod
     @verify(Schemas.room_message)
     def parse_event(cls, parsed_dict):
         # type: (Dict[Any, Any]) -> Union[RoomMessage, BadEventType]
-        content_dict = parsed_dict["content"]
-
-        if content_dict["msgtype"] == "m.text":
-            event = RoomMessageText.from_dict(parsed_dict)
-        elif content_dict["msgtype"] == "m.emote":
-            event = RoomMessageEmote.from_dict(parsed_dict)
-        elif content_dict["msgtype"] == "m.notice":
-            event = RoomMessageNotice.from_dict(parsed_dict)
-        elif content_dict["msgtype"] == "m.image":
-            event = RoomMessageImage.from_dict(parsed_dict)
-        elif content_dict["msgtype"] == "m.audio":
-            event = RoomMessageAudio.from_dict(parsed_dict)
-        elif content_dict["msgtype"] == "m.video":
-            event = RoomMessageVideo.from_dict(parsed_dict)
-        elif content_dict["msgtype"] == "m.file":
-            event = RoomMessageFile.from_dict(parsed_dict)
-        else:
-            event = RoomMessageUnknown.from_dict(parsed_dict)
+        message_class = RoomMessage._msgtype_classes.get(
+            parsed_dict["content"]["msgtype"],
+            RoomMessageUnknown
+        )
+        event = message_class.from_dict(parsed_dict)
 
         if "unsigned" in parsed_dict:
             txn_id = parsed_dict["unsigned"].get("transaction_id", None)
@@ -804,16 +888,12 @@ class RoomMessage(Event):
     @verify(Schemas.room_message)
     def parse_decrypted_event(cls, parsed_dict):
         # type: (Dict[Any, Any]) -> Union[RoomMessage, BadEventType]
-        msgtype = parsed_dict["content"]["msgtype"]
-
-        if msgtype == "m.image":
-            event = RoomEncryptedImage.from_dict(parsed_dict)
-        elif msgtype == "m.audio":
-            event = RoomEncryptedAudio.from_dict(parsed_dict)
-        elif msgtype == "m.video":
-            event = RoomEncryptedVideo.from_dict(parsed_dict)
-        elif msgtype == "m.file":
-            event = RoomEncryptedFile.from_dict(parsed_dict)
+        message_class = RoomMessage._decrypted_msgtype_classes.get(
+            parsed_dict["content"]["msgtype"]
+        )
+
+        if message_class:
+            event = message_class.from_dict(parsed_dict)
         else:
             event = RoomMessage.parse_event(parsed_dict)
 
@@ -824,7 +904,7 @@ class RoomMessage(Event):
         return event
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomMessageMedia(RoomMessage):
     """Base class for room messages containing a URI.
 
@@ -847,7 +927,7 @@ class RoomMessageMedia(RoomMessage):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomEncryptedMedia(RoomMessage):
     """Base class for encrypted room messages containing an URI.
 
@@ -880,47 +960,47 @@ class RoomEncryptedMedia(RoomMessage):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomEncryptedImage(RoomEncryptedMedia):
     """A room message containing an image where the file is encrypted."""
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomEncryptedAudio(RoomEncryptedMedia):
     """A room message containing an audio clip where the file is encrypted."""
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomEncryptedVideo(RoomEncryptedMedia):
     """A room message containing a video clip where the file is encrypted."""
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomEncryptedFile(RoomEncryptedMedia):
     """A room message containing a generic encrypted file."""
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomMessageImage(RoomMessageMedia):
     """A room message containing an image."""
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomMessageAudio(RoomMessageMedia):
     """A room message containing an audio clip."""
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomMessageVideo(RoomMessageMedia):
     """A room message containing a video clip."""
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomMessageFile(RoomMessageMedia):
     """A room message containing a generic file."""
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomMessageUnknown(RoomMessage):
     """A m.room.message which we do not understand.
 
@@ -956,7 +1036,7 @@ class RoomMessageUnknown(RoomMessage):
         return self.msgtype
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomMessageFormatted(RoomMessage):
     """Base abstract class for room messages that can have formatted bodies.
 
@@ -1008,7 +1088,7 @@ class RoomMessageFormatted(RoomMessage):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomMessageText(RoomMessageFormatted):
     """A room message corresponding to the m.text msgtype.
 
@@ -1030,7 +1110,7 @@ class RoomMessageText(RoomMessageFormatted):
         return validate_or_badevent(parsed_dict, Schemas.room_message_text)
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomMessageEmote(RoomMessageFormatted):
     """A room message coresponding to the m.emote msgtype.
 
@@ -1053,7 +1133,7 @@ class RoomMessageEmote(RoomMessageFormatted):
         return validate_or_badevent(parsed_dict, Schemas.room_message_emote)
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomMessageNotice(RoomMessageFormatted):
     """A room message corresponding to the m.notice msgtype.
 
@@ -1075,7 +1155,7 @@ class RoomMessageNotice(RoomMessageFormatted):
         return validate_or_badevent(parsed_dict, Schemas.room_message_notice)
 
 
-@attr.s
+@attr.s(slots=True)
 class DefaultLevels(object):
     """Class holding information about default power levels of a room.
 
@@ -1125,7 +1205,7 @@ class DefaultLevels(object):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class PowerLevels(object):
     """Class holding information of room power levels.
 
@@ -1239,7 +1319,7 @@ class PowerLevels(object):
         self.users.update(new_levels.users)
 
 
-@attr.s
+@attr.s(slots=True)
 class PowerLevelsEvent(Event):
     """Class representing a m.room.power_levels event.
 
@@ -1269,7 +1349,7 @@ class PowerLevelsEvent(Event):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class RedactionEvent(Event):
     """An event signaling that another event has been redacted.
 
@@ -1300,7 +1380,7 @@ class RedactionEvent(Event):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomMemberEvent(Event):
     """Class representing to an m.room.member event.
 
@@ -1346,3 +1426,146 @@ class RoomMemberEvent(Event):
             content,
             prev_content,
         )
+
+
+class LazyEvent(object):
+    """A room event that is parsed on first use.
+
+    Lazy events are produced instead of parsed events if lazy event parsing
+    is enabled in the client config. The event dictionary is validated and
+    parsed the first time an attribute of the event is accessed, the source
+    of the event is available without parsing.
+
+    The class of the event is guessed from the event type using
+    Event.class_for_event(), this allows isinstance() checks, like the ones
+    used for callback filters, to work without parsing the event. Since the
+    event isn't validated before it's parsed, an invalid event will pass
+    isinstance() checks for the class of its event type until it's parsed
+    into a BadEvent.
+
+    Attributes:
+        source (dict): The source dictionary of the event.
+
+    """
+
+    __slots__ = ("source", "_parser", "_event", "_class")
+
+    def __init__(self, source, parser=None):
+        # type: (Dict[Any, Any], Optional[Callable]) -> None
+        object.__setattr__(self, "source", source)
+        object.__setattr__(self, "_parser", parser or Event.parse_event)
+        object.__setattr__(self, "_event", None)
+        object.__setattr__(self, "_class", None)
+
+    @property  # type: ignore
+    def __class__(self):
+        if self._event is not None:
+            return type(self._event)
+
+        if self._class is None:
+            object.__setattr__(
+                self,
+                "_class",
+                Event.class_for_event(self.source)
+            )
+
+        return self._class
+
+    @property
+    def parsed(self):
+        # type: () -> bool
+        """Has the event been parsed."""
+        return self._event is not None
+
+    def resolve(self):
+        # type: () -> Union[Event, BadEventType]
+        """Parse the event if needed and return the parsed event."""
+        if self._event is None:
+            object.__setattr__(self, "_event", self._parser(self.source))
+
+        return self._event
+
+    @property
+    def event_id(self):
+        # The event id and sender are copied verbatim from the source by
+        # every event class, so they don't need the event to be parsed.
+        try:
+            return self.source["event_id"]
+        except (KeyError, TypeError):
+            return self.resolve().event_id
+
+    @property
+    def sender(self):
+        try:
+            return self.source["sender"]
+        except (KeyError, TypeError):
+            return self.resolve().sender
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyEvent):
+            other = other.resolve()
+
+        return self.resolve() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None  # type: ignore
+
+    def __reduce_ex__(self, protocol):
+        # Copies and pickles of a lazy event are parsed events.
+        return self.resolve().__reduce_ex__(protocol)
+
+    def __str__(self):
+        return str(self.resolve())
+
+    def __repr__(self):
+        return repr(self.resolve())
+
+
+Event._event_parsers.update({
+    "m.room.message": RoomMessage.parse_event,
+    "m.room.create": RoomCreateEvent.from_dict,
+    "m.room.guest_access": RoomGuestAccessEvent.from_dict,
+    "m.room.join_rules": RoomJoinRulesEvent.from_dict,
+    "m.room.history_visibility": RoomHistoryVisibilityEvent.from_dict,
+    "m.room.member": RoomMemberEvent.from_dict,
+    "m.room.canonical_alias": RoomAliasEvent.from_dict,
+    "m.room.name": RoomNameEvent.from_dict,
+    "m.room.topic": RoomTopicEvent.from_dict,
+    "m.room.avatar": RoomAvatarEvent.from_dict,
+    "m.room.power_levels": PowerLevelsEvent.from_dict,
+    "m.room.encryption": RoomEncryptionEvent.from_dict,
+    "m.room.redaction": RedactionEvent.from_dict,
+    "m.room.encrypted": Event.parse_encrypted_event,
+    "m.call.candidates": CallCandidatesEvent.from_dict,
+    "m.call.invite": CallInviteEvent.from_dict,
+    "m.call.answer": CallAnswerEvent.from_dict,
+    "m.call.hangup": CallHangupEvent.from_dict,
+})
+
+RoomMessage._msgtype_classes.update({
+    "m.text": RoomMessageText,
+    "m.emote": RoomMessageEmote,
+    "m.notice": RoomMessageNotice,
+    "m.image": RoomMessageImage,
+    "m.audio": RoomMessageAudio,
+    "m.video": RoomMessageVideo,
+    "m.file": RoomMessageFile,
+})
+
+RoomMessage._decrypted_msgtype_classes.update({
+    "m.image": RoomEncryptedImage,
+    "m.audio": RoomEncryptedAudio,
+    "m.video": RoomEncryptedVideo,
+    "m.file": RoomEncryptedFile,
+})
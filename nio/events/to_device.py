@@ -24,7 +24,7 @@ of a user.
 
 """
 
-from typing import Dict, List, Optional, Union
+from typing import Callable, Dict, List, Optional, Type, Union
 from copy import deepcopy
 
 import attr
@@ -33,7 +33,7 @@ from ..schemas import Schemas
 from .misc import BadEventType, verify, logger
 
 
-@attr.s
+@attr.s(slots=True)
 class ToDeviceEvent(object):
     """Base Event class for events that are sent using the to-device endpoint.
 
@@ -48,6 +48,26 @@ class ToDeviceEvent(object):
     source = attr.ib()
     sender = attr.ib()
 
+    # Mapping of event types to the function that parses events of this type,
+    # filled at the end of the module.
+    _event_parsers = {}  # type: Dict[str, Callable]
+
+    @classmethod
+    def register_event_type(cls, event_type, event_class):
+        # type: (str, Type[ToDeviceEvent]) -> None
+        """Register a class that should be used for events of a given type.
+
+        The from_dict() method of the class will be used to create the event
+        every time a to-device event of the given type is parsed.
+
+        Args:
+            event_type (str): The Matrix event type, e.g. "org.example.ping".
+            event_class (Type[ToDeviceEvent]): A subclass of ToDeviceEvent
+                which implements from_dict().
+
+        """
+        ToDeviceEvent._event_parsers[event_type] = event_class.from_dict
+
     @classmethod
     @verify(Schemas.to_device)
     def parse_event(cls, event_dict):
@@ -69,20 +89,10 @@ class ToDeviceEvent(object):
         if not event_dict["content"]:
             return None
 
-        if event_dict["type"] == "m.room.encrypted":
-            return ToDeviceEvent.parse_encrypted_event(event_dict)
-        elif event_dict["type"] == "m.key.verification.start":
-            return KeyVerificationStart.from_dict(event_dict)
-        elif event_dict["type"] == "m.key.verification.accept":
-            return KeyVerificationAccept.from_dict(event_dict)
-        elif event_dict["type"] == "m.key.verification.key":
-            return KeyVerificationKey.from_dict(event_dict)
-        elif event_dict["type"] == "m.key.verification.mac":
-            return KeyVerificationMac.from_dict(event_dict)
-        elif event_dict["type"] == "m.key.verification.cancel":
-            return KeyVerificationCancel.from_dict(event_dict)
-        elif event_dict["type"] == "m.room_key_request":
-            return BaseRoomKeyRequest.parse_event(event_dict)
+        parser = ToDeviceEvent._event_parsers.get(event_dict["type"])
+
+        if parser:
+            return parser(event_dict)
 
         return None
 
@@ -125,7 +135,7 @@ class ToDeviceEvent(object):
         raise NotImplementedError()
 
 
-@attr.s
+@attr.s(slots=True)
 class BaseRoomKeyRequest(ToDeviceEvent):
     """Base class for room key requests.
         requesting_device_id (str): The id of the device that is requesting the
@@ -144,7 +154,7 @@ class BaseRoomKeyRequest(ToDeviceEvent):
         return RoomKeyRequestCancellation.from_dict(event_dict)
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomKeyRequest(BaseRoomKeyRequest):
     """Event signaling that a room key was requested from us.
 
@@ -183,7 +193,7 @@ class RoomKeyRequest(BaseRoomKeyRequest):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomKeyRequestCancellation(BaseRoomKeyRequest):
     """Event signaling that a previous room key request was canceled."""
 
@@ -200,7 +210,7 @@ class RoomKeyRequestCancellation(BaseRoomKeyRequest):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class KeyVerificationEvent(ToDeviceEvent):
     """Base class for key verification events.
 
@@ -213,7 +223,7 @@ class KeyVerificationEvent(ToDeviceEvent):
     transaction_id = attr.ib(type=str)
 
 
-@attr.s
+@attr.s(slots=True)
 class KeyVerificationStart(KeyVerificationEvent):
     """Event signaling the start of a SAS key verification process.
 
@@ -256,7 +266,7 @@ class KeyVerificationStart(KeyVerificationEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class KeyVerificationAccept(KeyVerificationEvent):
     """Event signaling that the SAS verification start has been accepted.
 
@@ -295,7 +305,7 @@ class KeyVerificationAccept(KeyVerificationEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class KeyVerificationKey(KeyVerificationEvent):
     """Event carrying a key verification key.
 
@@ -322,7 +332,7 @@ class KeyVerificationKey(KeyVerificationEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class KeyVerificationMac(KeyVerificationEvent):
     """Event holding a message authentication code of the verification process.
 
@@ -355,7 +365,7 @@ class KeyVerificationMac(KeyVerificationEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class KeyVerificationCancel(KeyVerificationEvent):
     """Event signaling that a key verification process has been canceled.
 
@@ -382,12 +392,12 @@ class KeyVerificationCancel(KeyVerificationEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class EncryptedToDeviceEvent(ToDeviceEvent):
     pass
 
 
-@attr.s
+@attr.s(slots=True)
 class OlmEvent(EncryptedToDeviceEvent):
     """An Olm encrypted event.
 
@@ -435,7 +445,7 @@ class OlmEvent(EncryptedToDeviceEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class DummyEvent(ToDeviceEvent):
     """Event containing a dummy message.
 
@@ -462,7 +472,7 @@ class DummyEvent(ToDeviceEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class RoomKeyEvent(ToDeviceEvent):
     """Event containing a megolm room key that got sent to us.
 
@@ -500,7 +510,7 @@ class RoomKeyEvent(ToDeviceEvent):
         )
 
 
-@attr.s
+@attr.s(slots=True)
 class ForwardedRoomKeyEvent(RoomKeyEvent):
     """Event containing a room key that got forwarded to us.
 
@@ -536,3 +546,14 @@ class ForwardedRoomKeyEvent(RoomKeyEvent):
             content["session_id"],
             content["algorithm"]
         )
+
+
+ToDeviceEvent._event_parsers.update({
+    "m.room.encrypted": ToDeviceEvent.parse_encrypted_event,
+    "m.key.verification.start": KeyVerificationStart.from_dict,
+    "m.key.verification.accept": KeyVerificationAccept.from_dict,
+    "m.key.verification.key": KeyVerificationKey.from_dict,
+    "m.key.verification.mac": KeyVerificationMac.from_dict,
+    "m.key.verification.cancel": KeyVerificationCancel.from_dict,
+    "m.room_key_request": BaseRoomKeyRequest.parse_event,
+})
@@ -16,7 +16,6 @@
 
 from __future__ import unicode_literals
 
-import json
 import pprint
 import time
 from builtins import bytes, super
@@ -30,6 +29,7 @@ import h2.events
 import h11
 from logbook import Logger
 
+from . import _json
 from .log import logger_group
 
 logger = Logger("nio.http")
@@ -100,7 +100,7 @@ class HttpRequest(TransportRequest):
     @classmethod
     def _post_or_put(cls, method, host, target, data, timeout=0):
         request_data = (
-            json.dumps(data, separators=(",", ":"))
+            _json.dumps(data)
             if isinstance(data, dict)
             else data
         )
@@ -158,7 +158,7 @@ class Http2Request(TransportRequest):
     @classmethod
     def _post_or_put(cls, method, host, target, data, timeout):
         request_data = (
-            json.dumps(data, separators=(",", ":"))
+            _json.dumps(data)
             if isinstance(data, dict)
             else data
         )
@@ -202,7 +202,7 @@ class TransportResponse(object):
     def __init__(self, uuid=None, timeout=0):
         # type: (Optional[UUID], float) -> None
         self.headers = HeaderDict()  # type: HeaderDict
-        self.content = b""  # type: bytes
+        self._chunks = []  # type: List[bytes]
         self.status_code = None  # type: Optional[int]
         self.uuid = uuid or uuid4()
         self.creation_time = time.time()
@@ -216,7 +216,23 @@ class TransportResponse(object):
 
     def add_data(self, content):
         # type: (bytes) -> None
-        self.content = self.content + content
+        # The chunks are only joined once the content is accessed, appending
+        # to a bytes object would copy the whole body for every chunk.
+        self._chunks.append(content)
+
+    @property
+    def content(self):
+        # type: () -> bytes
+        # h11 may hand out bytearrays, joining always returns bytes.
+        if len(self._chunks) != 1 or not isinstance(self._chunks[0], bytes):
+            self._chunks = [b"".join(self._chunks)]
+
+        return self._chunks[0]
+
+    @content.setter
+    def content(self, content):
+        # type: (bytes) -> None
+        self._chunks = [content]
 
     def mark_as_sent(self):
         self.send_time = time.time()
@@ -302,11 +318,30 @@ class Connection(object):
 
 
 class HttpConnection(Connection):
-    def __init__(self):
-        # type: () -> None
+    """A HTTP/1.1 connection.
+
+    Requests are sent one after the other, a request is queued until the
+    response to the previous one was received. If pipelining is enabled, GET
+    requests are sent right away behind other GET requests, up to
+    max_pipelined requests that wait for their response. Long-polling
+    requests, those with a timeout, are never pipelined and no request is
+    pipelined behind them.
+
+    Args:
+        pipelining (bool): Pipeline idempotent GET requests.
+        max_pipelined (int): The maximum number of pipelined requests that
+            wait for their response at once.
+    """
+
+    def __init__(self, pipelining=False, max_pipelined=4):
+        # type: (bool, int) -> None
+        self.pipelining = pipelining
+        self.max_pipelined = max_pipelined
         self._connection = h11.Connection(our_role=h11.CLIENT)
         self._message_queue = deque()  # type: Deque[HttpRequest]
+        self._current_request = None  # type: Optional[HttpRequest]
         self._current_response = None  # type: Optional[HttpResponse]
+        self._pipelined = deque()  # type: Deque[HttpRequest]
 
     def data_to_send(self):
         # type: () -> bytes
@@ -333,10 +368,53 @@ class HttpConnection(Connection):
 
         return response.elapsed
 
+    @property
+    def queue_depth(self):
+        # type: () -> int
+        """The number of requests that wait for their response."""
+        current = 1 if self._current_response else 0
+        return current + len(self._pipelined) + len(self._message_queue)
+
+    @staticmethod
+    def _pipelinable(request):
+        # type: (Optional[HttpRequest]) -> bool
+        return (
+            request is not None
+            and request._request.method == b"GET"
+            and not request.timeout
+        )
+
+    def _can_pipeline(self, request):
+        # type: (HttpRequest) -> bool
+        return (
+            self.pipelining
+            and not self._message_queue
+            and len(self._pipelined) < self.max_pipelined
+            and self._pipelinable(request)
+            and self._pipelinable(self._current_request)
+        )
+
+    def _pipeline(self, request, uuid=None):
+        # type: (HttpRequest, Optional[UUID]) -> Tuple[UUID, bytes]
+        # Our h11 connection is still busy with the current request, so the
+        # request is serialized by a fresh one. It is passed to our h11
+        # connection once its response is next in line.
+        writer = h11.Connection(our_role=h11.CLIENT)
+        data = b"".join([
+            writer.send(request._request),
+            writer.send(request._end_of_message),
+        ])
+
+        if not request.response:
+            request.response = HttpResponse(uuid, request.timeout)
+
+        request.response.mark_as_sent()
+        self._pipelined.append(request)
+
+        return request.response.uuid, data
+
     def send(self, request, uuid=None):
         # type: (TransportRequest, Optional[UUID]) -> Tuple[UUID, bytes]
-        data = b""
-
         if not isinstance(request, HttpRequest):
             raise TypeError("Invalid request type for HttpConnection")
 
@@ -344,12 +422,13 @@ class HttpConnection(Connection):
             self._connection.our_state == h11.IDLE
             and not self._current_response
         ):
-            data = data + self._connection.send(request._request)
+            parts = [self._connection.send(request._request)]
 
             if request._data:
-                data = data + self._connection.send(request._data)
+                parts.append(self._connection.send(request._data))
 
-            data = data + self._connection.send(request._end_of_message)
+            parts.append(self._connection.send(request._end_of_message))
+            data = b"".join(parts)
 
             if request.response:
                 self._current_response = request.response
@@ -359,13 +438,43 @@ class HttpConnection(Connection):
             # Make mypy happy
             assert self._current_response
 
+            self._current_request = request
             self._current_response.mark_as_sent()
             return self._current_response.uuid, data
+        elif self._can_pipeline(request):
+            return self._pipeline(request, uuid)
         else:
             request.response = HttpResponse(uuid, request.timeout)
             self._message_queue.append(request)
             return request.response.uuid, b""
 
+    def _next_cycle(self):
+        # type: () -> None
+        self._current_request = None
+        self._current_response = None
+
+        try:
+            self._connection.start_next_cycle()
+        except h11.ProtocolError:
+            self._connection = h11.Connection(our_role=h11.CLIENT)
+
+            # The server won't answer the pipelined requests on this
+            # connection, they are idempotent so send them again.
+            self._message_queue.extendleft(reversed(self._pipelined))
+            self._pipelined.clear()
+            return
+
+        if self._pipelined:
+            request = self._pipelined.popleft()
+
+            # The request was already sent, our h11 connection only needs to
+            # know about it to parse its response.
+            self._connection.send(request._request)
+            self._connection.send(request._end_of_message)
+
+            self._current_request = request
+            self._current_response = request.response
+
     def _get_response(self):
         # type: () -> Optional[HttpResponse]
         ret = self._connection.next_event()
@@ -375,12 +484,8 @@ class HttpConnection(Connection):
 
         while ret != h11.NEED_DATA:
             if ret == h11.PAUSED or isinstance(ret, h11.EndOfMessage):
-                try:
-                    self._connection.start_next_cycle()
-                except h11.ProtocolError:
-                    self._connection = h11.Connection(our_role=h11.CLIENT)
                 response = self._current_response
-                self._current_response = None
+                self._next_cycle()
                 response.mark_as_received()
                 return response
             elif isinstance(ret, h11.InformationalResponse):
@@ -398,6 +503,110 @@ class HttpConnection(Connection):
         self._connection.receive_data(data)
         return self._get_response()
 
+    def next_buffered(self):
+        # type: () -> Optional[HttpResponse]
+        """Get a response that was received together with a previous one.
+
+        The responses to pipelined requests may arrive at once, receive()
+        only returns the first one.
+        """
+        if not self._current_response:
+            return None
+
+        return self._get_response()
+
+
+class HttpConnectionPool(Connection):
+    """A pool of HTTP/1.1 connections that requests are routed over.
+
+    The first connection of the pool is dedicated to long-polling requests,
+    like sync requests with a timeout, so they never delay other requests.
+    The other requests are sent over the connection that has the fewest
+    requests waiting for their response.
+
+    Every connection of the pool needs its own socket, the connections are
+    identified by their index. The data of a request isn't returned by
+    send(), it needs to be fetched per connection with data_to_send().
+
+    Args:
+        size (int): The number of connections, at least two.
+        pipelining (bool): Pipeline idempotent GET requests, see
+            HttpConnection.
+        max_pipelined (int): The maximum number of pipelined requests per
+            connection.
+    """
+
+    LONG_POLL_CONNECTION = 0
+
+    def __init__(self, size=2, pipelining=False, max_pipelined=4):
+        # type: (int, bool, int) -> None
+        if size < 2:
+            raise ValueError("A connection pool needs at least 2 connections")
+
+        self.connections = [
+            HttpConnection(pipelining, max_pipelined) for _ in range(size)
+        ]  # type: List[HttpConnection]
+        self._pending = [deque() for _ in range(size)] \
+            # type: List[Deque[bytes]]
+
+    def _route(self, request):
+        # type: (HttpRequest) -> int
+        if request.timeout:
+            return self.LONG_POLL_CONNECTION
+
+        return min(
+            range(1, len(self.connections)),
+            key=lambda i: self.connections[i].queue_depth,
+        )
+
+    def send(self, request, uuid=None):
+        # type: (TransportRequest, Optional[UUID]) -> Tuple[UUID, bytes]
+        if not isinstance(request, HttpRequest):
+            raise TypeError("Invalid request type for HttpConnectionPool")
+
+        index = self._route(request)
+        uuid, data = self.connections[index].send(request, uuid)
+
+        if data:
+            self._pending[index].append(data)
+
+        return uuid, b""
+
+    def data_to_send(self, connection_id):
+        # type: (int) -> bytes
+        pending = self._pending[connection_id]
+        pending.append(self.connections[connection_id].data_to_send())
+
+        data = b"".join(pending)
+        pending.clear()
+        return data
+
+    def receive(self, data, connection_id):
+        # type: (bytes, int) -> Optional[HttpResponse]
+        return self.connections[connection_id].receive(data)
+
+    def next_buffered(self, connection_id):
+        # type: (int) -> Optional[HttpResponse]
+        return self.connections[connection_id].next_buffered()
+
+    @property
+    def elapsed(self):
+        # type: () -> float
+        return max(connection.elapsed for connection in self.connections)
+
+    @property
+    def queue_depths(self):
+        # type: () -> List[int]
+        """The number of waiting requests of every connection."""
+        return [connection.queue_depth for connection in self.connections]
+
+    def disconnect(self):
+        # type: () -> bytes
+        for pending in self._pending:
+            pending.clear()
+
+        return b""
+
 
 class Http2Connection(Connection):
     def __init__(self):
@@ -406,7 +615,7 @@ class Http2Connection(Connection):
         self._responses = OrderedDict()  \
             # type: OrderedDict[int, Http2Response]
         self._data_to_send = OrderedDict() \
-            # type: OrderedDict[int, bytes]
+            # type: OrderedDict[int, memoryview]
 
     @property
     def elapsed(self):
@@ -416,6 +625,12 @@ class Http2Connection(Connection):
 
         return max(response.elapsed for response in self._responses.values())
 
+    @property
+    def queue_depth(self):
+        # type: () -> int
+        """The number of requests that wait for their response."""
+        return len(self._responses)
+
     def _handle_window_update(self, event):
         # We don't have any data to send, it doesn't matter that the window got
         # updated.
@@ -434,13 +649,17 @@ class Http2Connection(Connection):
         # The window changed for the whole connection, try to send out data for
         # every stream we have some data buffered.
         if event.stream_id == 0:
-            for stream_id, data in self._data_to_send.items():
+            for stream_id, data in list(self._data_to_send.items()):
                 self._send_data(
                     stream_id,
                     data
                 )
 
     def _send_data(self, stream_id, data):
+        # type: (int, Union[bytes, memoryview]) -> None
+        # Slices of a memoryview don't copy the data, only the frames that
+        # are sent out are copied.
+        data = memoryview(data)
         window_size = self._connection.local_flow_control_window(stream_id)
         max_frame_size = self._connection.max_outbound_frame_size
         request_size = len(data)
@@ -456,17 +675,10 @@ class Http2Connection(Connection):
 
         while bytes_to_send > 0:
             chunk_size = min(bytes_to_send, max_frame_size)
-
-            if chunk_size >= len(data):
-                chunk, data = data, ""
-            else:
-                chunk, data = (
-                    data[0:chunk_size],
-                    data[chunk_size:]
-                )
+            chunk, data = data[:chunk_size], data[chunk_size:]
 
             bytes_to_send -= chunk_size
-            self._connection.send_data(stream_id, chunk)
+            self._connection.send_data(stream_id, chunk.tobytes())
 
         if not data:
             self._connection.end_stream(stream_id)
@@ -13,11 +13,13 @@
 # CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
+import asyncio
 import time
+from bisect import bisect_left
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from threading import Thread
-from typing import Callable, List, Optional
+from typing import Callable, Iterable, List, Optional, Tuple
 
 
 @dataclass
@@ -179,3 +181,167 @@ class TransferMonitor:
     def done(self) -> bool:
         """Whether the transfer is finished."""
         return bool(self.end_time)
+
+
+@dataclass
+class TimeSliceScheduler:
+    """Yield to the event loop regularly during long running work.
+
+    The work calls ``resume()`` when it starts running, ``checkpoint()``
+    between small steps, and ``pause()`` when it awaits something else or is
+    done. Once a time slice was used up ``checkpoint()`` lets the event loop
+    run other tasks before the work continues.
+
+    The time the work blocked the event loop between two yields is recorded
+    in a histogram, ``reset()`` clears it.
+
+    The ``AsyncClient`` uses a ``TimeSliceScheduler`` to handle sync
+    responses, it's available through its ``sync_scheduler`` attribute and
+    the histogram is cleared for every sync.
+
+    Args:
+        time_slice (float, optional): How many seconds the work may block the
+            event loop before it yields. ``None`` never yields, the blocking
+            times are still recorded.
+
+        buckets (Tuple[float, ...]): The upper bounds, in seconds, of the
+            buckets of the histogram, in ascending order.
+
+    Attributes:
+        histogram (List[int]): The number of times the work blocked the event
+            loop, per bucket. The last entry counts the times that exceed the
+            largest bound.
+
+        max_blocking_time (float): The longest time in seconds the work
+            blocked the event loop.
+
+        yields (int): How many times ``checkpoint()`` yielded.
+    """
+
+    time_slice: Optional[float]    = None
+    buckets:    Tuple[float, ...] = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+    histogram:         List[int] = field(init=False)
+    max_blocking_time: float     = field(init=False, default=0.0)
+    yields:            int       = field(init=False, default=0)
+
+    _slice_start: Optional[float] = field(init=False, default=None)
+
+    def __post_init__(self) -> None:
+        self.histogram = [0] * (len(self.buckets) + 1)
+
+    def reset(self) -> None:
+        """Clear the recorded blocking times."""
+        self.histogram         = [0] * (len(self.buckets) + 1)
+        self.max_blocking_time = 0.0
+        self.yields            = 0
+
+    @property
+    def running(self) -> bool:
+        """Is the work running, between ``resume()`` and ``pause()``."""
+        return self._slice_start is not None
+
+    def resume(self) -> None:
+        """Start a new time slice, the work is about to run."""
+        if self._slice_start is None:
+            self._slice_start = time.perf_counter()
+
+    def pause(self) -> None:
+        """Record the current time slice, the work stopped running."""
+        if self._slice_start is not None:
+            self._record(time.perf_counter() - self._slice_start)
+            self._slice_start = None
+
+    async def checkpoint(self) -> None:
+        """Yield to the event loop if the current time slice is used up."""
+        if self.time_slice is None or self._slice_start is None:
+            return
+
+        now = time.perf_counter()
+
+        if now - self._slice_start < self.time_slice:
+            return
+
+        self._record(now - self._slice_start)
+        self.yields += 1
+
+        await asyncio.sleep(0)
+
+        self._slice_start = time.perf_counter()
+
+    def _record(self, blocking_time: float) -> None:
+        self.histogram[bisect_left(self.buckets, blocking_time)] += 1
+        self.max_blocking_time = max(self.max_blocking_time, blocking_time)
+
+
+@dataclass
+class SyncMetrics:
+    """Statistics about the syncs of one or more accounts.
+
+    The ``AsyncClientManager`` keeps a ``SyncMetrics`` object for every
+    account it syncs, ``SyncMetrics.combine()`` sums them up.
+
+    Attributes:
+        syncs (int): The number of successful sync requests.
+
+        errors (int): The number of sync requests that failed, either with
+            an error response or with an exception.
+
+        events (int): The number of room timeline events that were received.
+
+        total_time (float): The time in seconds spent syncing, including
+            the long-poll of the server and the handling of the responses.
+
+        last_time (float): The time in seconds the last sync took.
+
+        last_sync (float, optional): The ``time.monotonic()`` time the last
+            successful sync finished at.
+    """
+
+    syncs:      int             = 0
+    errors:     int             = 0
+    events:     int             = 0
+    total_time: float           = 0.0
+    last_time:  float           = 0.0
+    last_sync:  Optional[float] = None
+
+    @property
+    def average_time(self) -> float:
+        """The average time in seconds a sync took."""
+        count = self.syncs + self.errors
+        return self.total_time / count if count else 0.0
+
+    def record(self, duration: float, events: int = 0) -> None:
+        """Record a successful sync."""
+        self.syncs      += 1
+        self.events     += events
+        self.total_time += duration
+        self.last_time   = duration
+        self.last_sync   = time.monotonic()
+
+    def record_error(self, duration: float) -> None:
+        """Record a failed sync."""
+        self.errors     += 1
+        self.total_time += duration
+        self.last_time   = duration
+
+    @classmethod
+    def combine(cls, metrics: Iterable["SyncMetrics"]) -> "SyncMetrics":
+        """Sum up the metrics of several accounts.
+
+        The ``last_time`` of the result is the longest ``last_time`` of the
+        accounts and ``last_sync`` the time of the latest sync.
+        """
+        total = cls()
+
+        for m in metrics:
+            total.syncs      += m.syncs
+            total.errors     += m.errors
+            total.events     += m.events
+            total.total_time += m.total_time
+            total.last_time   = max(total.last_time, m.last_time)
+
+            if m.last_sync is not None:
+                total.last_sync = max(total.last_sync or 0.0, m.last_sync)
+
+        return total
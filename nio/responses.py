@@ -18,15 +18,19 @@ from __future__ import unicode_literals
 
 from builtins import str
 from datetime import datetime
-from functools import wraps
-from typing import Any, Dict, List, Optional, Set, Tuple, Union
+from functools import partial, wraps
+from typing import (Any, Callable, Dict, List, Optional, Set, Tuple, Type,
+                    Union)
 
 import attr
 from jsonschema.exceptions import SchemaError, ValidationError
 from logbook import Logger
 
+from . import _json
+from ._compat import intern_string
 from .events import (AccountDataEvent, BadEventType, Event, InviteEvent,
-                     ToDeviceEvent, EphemeralEvent)
+                     LazyEvent, ToDeviceEvent, EphemeralEvent,
+                     ValidationSampler)
 from .log import logger_group
 from .schemas import Schemas, validate_json
 
@@ -91,6 +95,7 @@ __all__ = [
     "ShareGroupSessionError",
     "SyncResponse",
     "PartialSyncResponse",
+    "SyncResponseStream",
     "SyncError",
     "Timeline",
     "UpdateDeviceResponse",
@@ -101,6 +106,8 @@ __all__ = [
     "RoomReadMarkersError",
     "UploadResponse",
     "UploadError",
+    "UploadFilterResponse",
+    "UploadFilterError",
     "ProfileGetResponse",
     "ProfileGetError",
     "ProfileGetDisplayNameResponse",
@@ -122,6 +129,22 @@ __all__ = [
 ]
 
 
+def _parse_event(parse_function, event_dict, sampler=None):
+    # type: (Callable, Dict[Any, Any], Optional[ValidationSampler]) -> Any
+    if sampler is not None:
+        return sampler.parse(parse_function, event_dict)
+
+    return parse_function(event_dict)
+
+
+def _is_lazy(event_dict, lazy):
+    # type: (Dict[Any, Any], Union[bool, Tuple[Type, ...]]) -> bool
+    if isinstance(lazy, tuple):
+        return not issubclass(Event.class_for_event(event_dict), lazy)
+
+    return bool(lazy)
+
+
 def verify(schema, error_class, pass_arguments=True):
     def decorator(f):
         @wraps(f)
@@ -189,12 +212,15 @@ class RoomInfo(object):
     summary = attr.ib(default=None, type=Optional[RoomSummary])
 
     @staticmethod
-    def parse_account_data(event_dict):
+    def parse_account_data(event_dict, sampler=None):
+        # type: (List[Dict[Any, Any]], Optional[ValidationSampler]) -> List
         """Parse the account data dictionary and produce a list of events."""
         events = []
 
         for event in event_dict:
-            events.append(AccountDataEvent.parse_event(event))
+            events.append(
+                _parse_event(AccountDataEvent.parse_event, event, sampler)
+            )
 
         return events
 
@@ -453,6 +479,10 @@ class DevicesError(ErrorResponse):
     pass
 
 
+class UploadFilterError(ErrorResponse):
+    pass
+
+
 class DeleteDevicesError(ErrorResponse):
     pass
 
@@ -879,11 +909,32 @@ class KeysQueryResponse(Response):
         factory=dict
     )
 
+    @staticmethod
+    def _intern_payload(payload):
+        # type: (Dict[str, Any]) -> Dict[str, Any]
+        for key in ("user_id", "device_id"):
+            if key in payload:
+                payload[key] = intern_string(payload[key])
+
+        keys = payload.get("keys")
+
+        if isinstance(keys, dict):
+            payload["keys"] = {
+                intern_string(k): intern_string(v) for k, v in keys.items()
+            }
+
+        return payload
+
     @classmethod
     @verify(Schemas.keys_query, KeysQueryError)
     def from_dict(cls, parsed_dict):
         # type: (Dict[Any, Any]) -> Union[KeysQueryResponse, ErrorResponse]
-        device_keys = parsed_dict["device_keys"]
+        device_keys = {
+            intern_string(user_id): {
+                intern_string(device_id): cls._intern_payload(payload)
+                for device_id, payload in devices.items()
+            } for user_id, devices in parsed_dict["device_keys"].items()
+        }
         failures = parsed_dict["failures"]
 
         return cls(device_keys, failures)
@@ -1039,6 +1090,27 @@ class ProfileGetDisplayNameResponse(Response):
         return cls(parsed_dict.get("displayname"))
 
 
+@attr.s
+class UploadFilterResponse(Response):
+    """Response representing a successful filter upload request.
+
+    Attributes:
+        filter_id (str): The id of the filter, it can be passed to sync()
+            instead of the filter itself.
+    """
+
+    filter_id = attr.ib(type=str)
+
+    @classmethod
+    @verify(Schemas.upload_filter, UploadFilterError)
+    def from_dict(
+        cls,
+        parsed_dict  # type: Dict[Any, Any]
+    ):
+        # type: (...) -> Union[UploadFilterResponse, ErrorResponse]
+        return cls(parsed_dict["filter_id"])
+
+
 class ProfileSetDisplayNameResponse(EmptyResponse):
     @staticmethod
     def create_error(parsed_dict):
@@ -1195,14 +1267,21 @@ class _SyncResponse(Response):
     @staticmethod
     def _get_room_events(
             parsed_dict,  # type: List[Dict[Any, Any]]
-            max_events=0  # type: int
+            max_events=0,  # type: int
+            sampler=None,  # type: Optional[ValidationSampler]
+            lazy=False,  # type: Union[bool, Tuple[Type, ...]]
     ):
         # type: (...) -> Tuple[int, List[Union[Event, BadEventType]]]
         events = []  # type: List[Union[Event, BadEventType]]
         counter = 0
 
+        parser = partial(sampler.parse, Event.parse_event) if sampler else None
+
         for counter, event_dict in enumerate(parsed_dict, 1):
-            event = Event.parse_event(event_dict)
+            if _is_lazy(event_dict, lazy):
+                event = LazyEvent(event_dict, parser)
+            else:
+                event = _parse_event(Event.parse_event, event_dict, sampler)
 
             if event:
                 events.append(event)
@@ -1213,11 +1292,15 @@ class _SyncResponse(Response):
         return counter, events
 
     @staticmethod
-    def _get_to_device(parsed_dict):
-        # type: (Dict[Any, Any]) -> List[ToDeviceEvent]
+    def _get_to_device(
+            parsed_dict,  # type: Dict[Any, Any]
+            sampler=None  # type: Optional[ValidationSampler]
+    ):
+        # type: (...) -> List[ToDeviceEvent]
         events = []  # type: List[ToDeviceEvent]
         for event_dict in parsed_dict["events"]:
-            event = ToDeviceEvent.parse_event(event_dict)
+            event = _parse_event(ToDeviceEvent.parse_event, event_dict,
+                                 sampler)
 
             if event:
                 events.append(event)
@@ -1225,13 +1308,20 @@ class _SyncResponse(Response):
         return events
 
     @staticmethod
-    def _get_timeline(parsed_dict, max_events=0):
-        # type: (Dict[Any, Any], int) -> Tuple[int, Timeline]
+    def _get_timeline(
+            parsed_dict,   # type: Dict[Any, Any]
+            max_events=0,  # type: int
+            sampler=None,  # type: Optional[ValidationSampler]
+            lazy=False,    # type: Union[bool, Tuple[Type, ...]]
+    ):
+        # type: (...) -> Tuple[int, Timeline]
         validate_json(parsed_dict, Schemas.room_timeline)
 
         counter, events = _SyncResponse._get_room_events(
             parsed_dict["events"],
-            max_events
+            max_events,
+            sampler,
+            lazy,
         )
 
         return counter, Timeline(
@@ -1239,22 +1329,24 @@ class _SyncResponse(Response):
         )
 
     @staticmethod
-    def _get_state(parsed_dict, max_events=0):
+    def _get_state(parsed_dict, max_events=0, sampler=None, lazy=False):
         validate_json(parsed_dict, Schemas.room_state)
         counter, events = _SyncResponse._get_room_events(
             parsed_dict["events"],
-            max_events
+            max_events,
+            sampler,
+            lazy,
         )
 
         return counter, events
 
     @staticmethod
-    def _get_invite_state(parsed_dict):
+    def _get_invite_state(parsed_dict, sampler=None):
         validate_json(parsed_dict, Schemas.room_state)
         events = []
 
         for event_dict in parsed_dict["events"]:
-            event = InviteEvent.parse_event(event_dict)
+            event = _parse_event(InviteEvent.parse_event, event_dict, sampler)
 
             if event:
                 events.append(event)
@@ -1262,10 +1354,11 @@ class _SyncResponse(Response):
         return events
 
     @staticmethod
-    def _get_ephemeral_events(parsed_dict):
+    def _get_ephemeral_events(parsed_dict, sampler=None):
         events = []
         for event_dict in parsed_dict:
-            event = EphemeralEvent.parse_event(event_dict)
+            event = _parse_event(EphemeralEvent.parse_event, event_dict,
+                                 sampler)
 
             if event:
                 events.append(event)
@@ -1280,12 +1373,16 @@ class _SyncResponse(Response):
         ephemeral_events,     # type: List[Any]
         summary_events,       # type: Dict[str, Any]
         account_data_events,  # type: List[Any]
-        max_events=0          # type: int
+        max_events=0,         # type: int
+        sampler=None,         # type: Optional[ValidationSampler]
+        lazy=False,           # type: Union[bool, Tuple[Type, ...]]
     ):
         # type: (...) -> Tuple[RoomInfo, Optional[RoomInfo]]
         counter, state = _SyncResponse._get_room_events(
             state_events,
-            max_events
+            max_events,
+            sampler,
+            lazy,
         )
 
         unhandled_state = state_events[counter:]
@@ -1301,7 +1398,7 @@ class _SyncResponse(Response):
             counter = 0
         else:
             counter, events = _SyncResponse._get_room_events(
-                timeline_events, timeline_max
+                timeline_events, timeline_max, sampler, lazy
             )
             timeline = Timeline(events, limited, prev_batch)
 
@@ -1312,7 +1409,8 @@ class _SyncResponse(Response):
         )
 
         ephemeral_event_list = _SyncResponse._get_ephemeral_events(
-            ephemeral_events
+            ephemeral_events,
+            sampler,
         )
 
         unhandled_info = None
@@ -1331,7 +1429,10 @@ class _SyncResponse(Response):
             summary_events.get("m.heroes", [])
         )
 
-        account_data = RoomInfo.parse_account_data(account_data_events)
+        account_data = RoomInfo.parse_account_data(
+            account_data_events,
+            sampler,
+        )
 
         join_info = RoomInfo(
             timeline,
@@ -1344,8 +1445,58 @@ class _SyncResponse(Response):
         return join_info, unhandled_info
 
     @staticmethod
-    def _get_room_info(parsed_dict, max_events=0):
-        # type: (Dict[Any, Any], int) -> Tuple[Rooms, Dict[str, RoomInfo]]
+    def _get_invite_info(room_dict, sampler=None):
+        # type: (Dict[Any, Any], Optional[ValidationSampler]) -> InviteInfo
+        state = _SyncResponse._get_invite_state(
+            room_dict["invite_state"],
+            sampler,
+        )
+        return InviteInfo(state)
+
+    @staticmethod
+    def _get_leave_info(room_dict, sampler=None, lazy=False):
+        # type: (Dict[Any, Any], Optional[ValidationSampler], Any) -> RoomInfo
+        _, state = _SyncResponse._get_state(
+            room_dict["state"],
+            sampler=sampler,
+            lazy=lazy,
+        )
+        _, timeline = _SyncResponse._get_timeline(
+            room_dict["timeline"],
+            sampler=sampler,
+            lazy=lazy,
+        )
+        return RoomInfo(timeline, state, [], [])
+
+    @staticmethod
+    def _get_joined_room_info(
+            room_dict,     # type: Dict[Any, Any]
+            max_events=0,  # type: int
+            sampler=None,  # type: Optional[ValidationSampler]
+            lazy=False,    # type: Union[bool, Tuple[Type, ...]]
+    ):
+        # type: (...) -> Tuple[RoomInfo, Optional[RoomInfo]]
+        return _SyncResponse._get_join_info(
+            room_dict["state"]["events"],
+            room_dict["timeline"]["events"],
+            room_dict["timeline"]["prev_batch"],
+            room_dict["timeline"]["limited"],
+            room_dict["ephemeral"]["events"],
+            room_dict.get("summary", {}),
+            room_dict["account_data"]["events"],
+            max_events,
+            sampler,
+            lazy,
+        )
+
+    @staticmethod
+    def _get_room_info(
+            parsed_dict,   # type: Dict[Any, Any]
+            max_events=0,  # type: int
+            sampler=None,  # type: Optional[ValidationSampler]
+            lazy=False,    # type: Union[bool, Tuple[Type, ...]]
+    ):
+        # type: (...) -> Tuple[Rooms, Dict[str, RoomInfo]]
         joined_rooms = {
             key: None for key in parsed_dict["join"].keys()
         }  # type: Dict[str, Optional[RoomInfo]]
@@ -1354,26 +1505,24 @@ class _SyncResponse(Response):
         unhandled_rooms = {}
 
         for room_id, room_dict in parsed_dict["invite"].items():
-            state = _SyncResponse._get_invite_state(room_dict["invite_state"])
-            invite_info = InviteInfo(state)
-            invited_rooms[room_id] = invite_info
+            invited_rooms[room_id] = _SyncResponse._get_invite_info(
+                room_dict,
+                sampler,
+            )
 
         for room_id, room_dict in parsed_dict["leave"].items():
-            _, state = _SyncResponse._get_state(room_dict["state"])
-            _, timeline = _SyncResponse._get_timeline(room_dict["timeline"])
-            leave_info = RoomInfo(timeline, state, [], [])
-            left_rooms[room_id] = leave_info
+            left_rooms[room_id] = _SyncResponse._get_leave_info(
+                room_dict,
+                sampler,
+                lazy,
+            )
 
         for room_id, room_dict in parsed_dict["join"].items():
-            join_info, unhandled_info = _SyncResponse._get_join_info(
-                room_dict["state"]["events"],
-                room_dict["timeline"]["events"],
-                room_dict["timeline"]["prev_batch"],
-                room_dict["timeline"]["limited"],
-                room_dict["ephemeral"]["events"],
-                room_dict.get("summary", {}),
-                room_dict["account_data"]["events"],
-                max_events
+            join_info, unhandled_info = _SyncResponse._get_joined_room_info(
+                room_dict,
+                max_events,
+                sampler,
+                lazy,
             )
 
             if unhandled_info:
@@ -1389,9 +1538,27 @@ class _SyncResponse(Response):
         cls,
         parsed_dict,  # type: Dict[Any, Any]
         max_events=0,  # type: int
+        sampler=None,  # type: Optional[ValidationSampler]
+        lazy=False,  # type: Union[bool, Tuple[Type, ...]]
     ):
         # type: (...) -> Union[SyncType, ErrorResponse]
-        to_device = cls._get_to_device(parsed_dict["to_device"])
+        """Create a sync response from a dictionary.
+
+        Args:
+            parsed_dict (dict): The dictionary representation of the response.
+            max_events (int, optional): The maximum number of room events
+                that should be parsed, the rest of the events will be
+                available through the PartialSyncResponse that is returned.
+                0 means that all events are parsed.
+            sampler (ValidationSampler, optional): A sampler that decides
+                which events get validated against their schema. By default
+                every event is validated.
+            lazy (bool, Tuple[Type], optional): Produce LazyEvent objects for
+                the room state and timeline events, the events are parsed once
+                they are used. If a tuple of event classes is given only the
+                events that aren't of one of the given classes are lazy.
+        """
+        to_device = cls._get_to_device(parsed_dict["to_device"], sampler)
 
         key_count_dict = parsed_dict["device_one_time_keys_count"]
         key_count = DeviceOneTimeKeyCount(
@@ -1405,7 +1572,7 @@ class _SyncResponse(Response):
         )
 
         rooms, unhandled_rooms = _SyncResponse._get_room_info(
-            parsed_dict["rooms"], max_events)
+            parsed_dict["rooms"], max_events, sampler, lazy)
 
         if unhandled_rooms:
             return PartialSyncResponse(
@@ -1415,6 +1582,8 @@ class _SyncResponse(Response):
                 devices,
                 to_device,
                 unhandled_rooms,
+                sampler,
+                lazy,
             )
 
         return SyncResponse(
@@ -1433,6 +1602,8 @@ class SyncResponse(_SyncResponse):
 @attr.s
 class PartialSyncResponse(_SyncResponse):
     unhandled_rooms = attr.ib(type=Dict[str, RoomInfo])
+    sampler = attr.ib(default=None, type=Optional[ValidationSampler])
+    lazy = attr.ib(default=False, type=Union[bool, Tuple[Type, ...]])
 
     def next_part(self, max_events=0):
         # type: (int) -> SyncType
@@ -1447,7 +1618,9 @@ class PartialSyncResponse(_SyncResponse):
                 [],
                 {},
                 [],
-                max_events
+                max_events,
+                self.sampler,
+                self.lazy,
             )
 
             if unhandled_info:
@@ -1465,6 +1638,8 @@ class PartialSyncResponse(_SyncResponse):
                 DeviceList([], []),
                 [],
                 unhandled_rooms,
+                self.sampler,
+                self.lazy,
             )  # type: SyncType
         else:
             next_response = SyncResponse(
@@ -1486,3 +1661,233 @@ class PartialSyncResponse(_SyncResponse):
 
 
 SyncType = Union[SyncResponse, PartialSyncResponse]
+
+
+class SyncResponseStream(object):
+    """Incremental parser for the body of a sync response.
+
+    The body is fed in chunks and every room, as well as the to-device
+    events, is returned as a SyncResponse of its own as soon as it was
+    received. Only the room that is currently being received needs to be
+    kept in memory instead of the whole response.
+
+    The partial responses contain a single room or the to-device events and
+    have an empty next_batch. A room with more than max_events events is
+    returned as a PartialSyncResponse, the rest of its events are available
+    through next_part(). Rooms that arrive before the to-device events
+    are held back until the to-device events were returned since those may
+    contain the keys for the encrypted room events. At most
+    max_pending_rooms rooms are held back, once there are more the oldest
+    one is returned right away, before the to-device events. The encrypted
+    events of such a room can only be decrypted if the keys arrived in an
+    earlier sync.
+
+    Once the body was fed completely, close() needs to be called, it sets the
+    response attribute to a SyncResponse containing the next_batch token,
+    the one-time key counts and the device lists, but no rooms or to-device
+    events, or to a SyncError if the body turned out to be invalid.
+
+    Args:
+        sampler (ValidationSampler, optional): A sampler that decides which
+            events get validated against their schema.
+        lazy (bool, Tuple[Type], optional): Produce LazyEvent objects for the
+            room state and timeline events, see SyncResponse.from_dict().
+        max_events (int, optional): The number of events after which a room
+            is split into multiple parts, 0 disables splitting.
+        max_pending_rooms (int, optional): The number of rooms that are held
+            back until the to-device events arrive.
+
+    Attributes:
+        response (SyncResponse, SyncError, optional): The final response, set
+            by close() or as soon as an error was encountered.
+
+    """
+
+    paths = (
+        (),
+        ("rooms",),
+        ("rooms", "invite"),
+        ("rooms", "join"),
+        ("rooms", "leave"),
+    )
+
+    def __init__(
+            self,
+            sampler=None,  # type: Optional[ValidationSampler]
+            lazy=False,    # type: Union[bool, Tuple[Type, ...]]
+            max_events=0,  # type: int
+            max_pending_rooms=100,  # type: int
+    ):
+        # type: (...) -> None
+        self.sampler = sampler
+        self.lazy = lazy
+        self.max_events = max_events
+        self.max_pending_rooms = max_pending_rooms
+        self.response = None  # type: Optional[Union[SyncResponse, SyncError]]
+
+        self._parser = _json.StreamParser(self.paths)
+        self._values = {}  # type: Dict[str, Any]
+        self._pending_rooms = []  # type: List[Tuple[Tuple[str, ...], Any]]
+
+    @staticmethod
+    def _partial_response(rooms=None, to_device=None):
+        # type: (Optional[Rooms], Optional[List]) -> SyncResponse
+        return SyncResponse(
+            "",
+            rooms or Rooms({}, {}, {}),
+            DeviceOneTimeKeyCount(None, None),
+            DeviceList([], []),
+            to_device or [],
+        )
+
+    def _parse_room(self, category, room_id, room_dict):
+        # type: (str, str, Any) -> SyncType
+        schema = Schemas.sync["properties"]["rooms"]["properties"][category]
+        validate_json({room_id: room_dict}, schema)
+
+        rooms = Rooms({}, {}, {})
+
+        if category == "invite":
+            rooms.invite[room_id] = _SyncResponse._get_invite_info(
+                room_dict,
+                self.sampler,
+            )
+        elif category == "join":
+            join_info, unhandled_info = _SyncResponse._get_joined_room_info(
+                room_dict,
+                self.max_events,
+                self.sampler,
+                self.lazy,
+            )
+            rooms.join[room_id] = join_info
+
+            if unhandled_info:
+                return PartialSyncResponse(
+                    "",
+                    rooms,
+                    DeviceOneTimeKeyCount(None, None),
+                    DeviceList([], []),
+                    [],
+                    {room_id: unhandled_info},
+                    self.sampler,
+                    self.lazy,
+                )
+        else:
+            rooms.leave[room_id] = _SyncResponse._get_leave_info(
+                room_dict,
+                self.sampler,
+                self.lazy,
+            )
+
+        return self._partial_response(rooms=rooms)
+
+    def _parse_items(self, items):
+        # type: (List[Tuple[Tuple[str, ...], Any]]) -> List[SyncType]
+        responses = []
+
+        for path, value in items:
+            if len(path) == 1:
+                schema = Schemas.sync["properties"].get(path[0])
+
+                if schema:
+                    validate_json(value, schema)
+
+                self._values[path[0]] = value
+
+                if path[0] != "to_device":
+                    continue
+
+                to_device = _SyncResponse._get_to_device(value, self.sampler)
+                responses.append(self._partial_response(to_device=to_device))
+
+                for room_path, room_dict in self._pending_rooms:
+                    responses.append(
+                        self._parse_room(room_path[0], room_path[1], room_dict)
+                    )
+
+                self._pending_rooms = []
+
+            elif len(path) == 2:
+                # A category that isn't an object, or an unknown one.
+                schema = Schemas.sync["properties"]["rooms"]["properties"].get(
+                    path[1]
+                )
+
+                if schema:
+                    validate_json(value, schema)
+
+            elif "to_device" in self._values:
+                responses.append(self._parse_room(path[1], path[2], value))
+
+            else:
+                self._pending_rooms.append((path[1:], value))
+
+                if len(self._pending_rooms) > self.max_pending_rooms:
+                    room_path, room_dict = self._pending_rooms.pop(0)
+                    responses.append(
+                        self._parse_room(room_path[0], room_path[1], room_dict)
+                    )
+
+        return responses
+
+    def _fail(self, error):
+        # type: (Exception) -> None
+        message = getattr(error, "message", None) or str(error)
+        logger.warn("Error parsing sync response: {}".format(message))
+        self.response = SyncError(message)
+
+    def feed(self, data):
+        # type: (bytes) -> List[SyncType]
+        """Parse a chunk of the response body.
+
+        Returns a list of partial SyncResponses for the rooms and to-device
+        events that were completed by this chunk.
+        """
+        if self.response:
+            return []
+
+        try:
+            return self._parse_items(self._parser.feed(data))
+        except (ValueError, SchemaError, ValidationError) as e:
+            self._fail(e)
+            return []
+
+    def close(self):
+        # type: () -> List[SyncType]
+        """Finish parsing the response body.
+
+        Returns a list of partial SyncResponses for the remaining rooms and
+        to-device events, the final response is available in the response
+        attribute afterwards.
+        """
+        if self.response:
+            return []
+
+        try:
+            responses = self._parse_items(self._parser.close())
+
+            for key in ("next_batch", "device_one_time_keys_count",
+                        "device_lists", "to_device"):
+                if key not in self._values:
+                    raise ValueError("{!r} is a required property".format(key))
+        except (ValueError, SchemaError, ValidationError) as e:
+            self._fail(e)
+            return []
+
+        key_count_dict = self._values["device_one_time_keys_count"]
+
+        self.response = SyncResponse(
+            self._values["next_batch"],
+            Rooms({}, {}, {}),
+            DeviceOneTimeKeyCount(
+                key_count_dict["curve25519"],
+                key_count_dict["signed_curve25519"]
+            ),
+            DeviceList(
+                self._values["device_lists"]["changed"],
+                self._values["device_lists"]["left"],
+            ),
+            [],
+        )
+
+        return responses
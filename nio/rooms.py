@@ -18,11 +18,13 @@ from __future__ import unicode_literals
 
 from builtins import super
 from collections import defaultdict
-from typing import Any, DefaultDict, Dict, List, NamedTuple, Optional
+from typing import (Any, Callable, DefaultDict, Dict, Iterable, List,
+                    NamedTuple, Optional)
 
 from jsonschema.exceptions import SchemaError, ValidationError
 from logbook import Logger
 
+from ._compat import intern_string
 from .events import (Event, InviteAliasEvent, InviteMemberEvent,
                      InviteNameEvent, PowerLevels, PowerLevelsEvent,
                      RoomAliasEvent, RoomCreateEvent, RoomEncryptionEvent,
@@ -35,6 +37,8 @@ from .responses import RoomSummary
 logger = Logger("nio.rooms")
 logger_group.add_logger(logger)
 
+_MemberLoader = Callable[[], Iterable["MatrixUser"]]
+
 __all__ = [
     "MatrixRoom",
     "MatrixInvitedRoom",
@@ -45,6 +49,22 @@ __all__ = [
 class MatrixRoom(object):
     """Represents a Matrix room."""
 
+    # The room events that change the room state, see handle_event() and
+    # handle_membership().
+    state_event_classes = (
+        RoomCreateEvent,
+        RoomGuestAccessEvent,
+        RoomHistoryVisibilityEvent,
+        RoomJoinRulesEvent,
+        RoomNameEvent,
+        RoomAliasEvent,
+        RoomTopicEvent,
+        RoomAvatarEvent,
+        RoomEncryptionEvent,
+        PowerLevelsEvent,
+        RoomMemberEvent,
+    )
+
     def __init__(self, room_id, own_user_id, encrypted=False):
         # type: (str, str, bool) -> None
         """Initialize a MatrixRoom object."""
@@ -60,16 +80,58 @@ class MatrixRoom(object):
         self.canonical_alias = None   # type: Optional[str]
         self.topic = None             # type: Optional[str]
         self.name = None              # type: Optional[str]
-        self.users = dict()           # type: Dict[str, MatrixUser]
-        self.invited_users = dict()   # type: Dict[str, MatrixUser]
-        self.names = defaultdict(list)  # type: DefaultDict[str, List[str]]
+        self._users = dict()          # type: Dict[str, MatrixUser]
+        self._invited_users = dict()  # type: Dict[str, MatrixUser]
+        self._names = defaultdict(list)  # type: DefaultDict[str, List[str]]
+        self.member_loader = None     # type: Optional[_MemberLoader]
         self.encrypted = encrypted    # type: bool
         self.power_levels = PowerLevels()  # type: PowerLevels
         self.typing_users = []        # type: List[str]
         self.summary = None           # type: Optional[RoomSummary]
+        self.members_loaded = False   # type: bool
         self.room_avatar_url = None        # type: Optional[str]
         # yapf: enable
 
+    def _load_members(self):
+        # type: () -> None
+        loader, self.member_loader = self.member_loader, None
+
+        for user in loader():
+            self.add_member(
+                user.user_id, user.display_name, user.avatar_url, user.invited
+            )
+
+    @property
+    def users(self):
+        # type: () -> Dict[str, MatrixUser]
+        """The members of the room, a mapping from user id to MatrixUser.
+
+        If the room was restored from a store, the members are loaded the
+        first time they are needed, see `member_loader`.
+        """
+        if self.member_loader:
+            self._load_members()
+
+        return self._users
+
+    @property
+    def invited_users(self):
+        # type: () -> Dict[str, MatrixUser]
+        """The invited members of the room."""
+        if self.member_loader:
+            self._load_members()
+
+        return self._invited_users
+
+    @property
+    def names(self):
+        # type: () -> DefaultDict[str, List[str]]
+        """A mapping from display name to the ids of users with that name."""
+        if self.member_loader:
+            self._load_members()
+
+        return self._names
+
     @property
     def display_name(self):
         """Calculate display name for a room.
@@ -103,28 +165,39 @@ class MatrixRoom(object):
         In other words, a display name based on the names of room members. This
         is used for ad-hoc groups of people (usually direct chats).
 
+        If the room summary contains heroes, they are used for the name and
+        the member counts of the summary are used for the number of users, so
+        the name is correct even if the members are lazily loaded.
+
         Returns None if there are no users.
         """
-        # Sort user display names, excluding our own user and using the
-        # mxid as the sorting key.
-
-        user_names = [
-            self.user_name(u)
-            for u in sorted(self.users.keys())
-            if u != self.own_user_id
-        ]
-        num_users = len(user_names)
-
-        if num_users == 1:
+        if self.summary and self.summary.heroes:
+            user_names = [
+                self.user_name(u) or u
+                for u in self.summary.heroes
+                if u != self.own_user_id
+            ]
+            num_users = max(self.member_count - 1, len(user_names))
+        else:
+            # Sort user display names, excluding our own user and using the
+            # mxid as the sorting key.
+            user_names = [
+                self.user_name(u)
+                for u in sorted(self.users.keys())
+                if u != self.own_user_id
+            ]
+            num_users = len(user_names)
+
+        if not user_names:
+            return None
+        elif num_users == 1:
             return user_names[0]
-        elif num_users == 2:
+        elif num_users == 2 and len(user_names) == 2:
             return " and ".join(user_names)
-        elif num_users >= 3:
+        else:
             return "{first_user} and {num} others".format(
                 first_user=user_names[0], num=num_users - 1
             )
-        else:
-            return None
 
     def user_name(self, user_id):
         """Get disambiguated display name for a user.
@@ -132,6 +205,10 @@ class MatrixRoom(object):
         Returns display name of a user if display name is unique or returns
         a display name in form "<display name> (<matrix id>)" if there is
         more than one user with same display name.
+
+        If the room members are lazily loaded, users that share a display name
+        with the user might not be loaded yet, see `members_synced`. The
+        members can be loaded with `AsyncClient.load_room_members()`.
         """
         if user_id not in self.users:
             return None
@@ -168,9 +245,10 @@ class MatrixRoom(object):
         if self.room_avatar_url:
             return self.room_avatar_url
 
-        if self.is_group or len(self.users) == 2:
+        if self.is_group or self.member_count == 2:
+            users = self.summary.heroes if self.summary else []
             user = next(
-                (u for u in self.users if u != self.own_user_id),
+                (u for u in users or self.users if u != self.own_user_id),
                 None
             )
             return self.avatar_url(user)
@@ -210,6 +288,8 @@ class MatrixRoom(object):
         if user_id in self.users:
             return False
 
+        user_id = intern_string(user_id)
+
         level = self.power_levels.users.get(
             user_id,
             self.power_levels.defaults.users_default,
@@ -373,6 +453,9 @@ class MatrixRoom(object):
         member list. This is crucial for encrypted rooms before sending any
         messages.
         """
+        if self.members_loaded:
+            return True
+
         if self.summary:
             joined  = self.summary.joined_member_count
             invited = self.summary.invited_member_count
@@ -384,6 +467,12 @@ class MatrixRoom(object):
 
     @property
     def member_count(self):
+        # type: () -> int
+        """The number of joined and invited members of the room.
+
+        The count comes from the room summary if there is one, it includes
+        the members that aren't loaded yet.
+        """
         if self.summary:
             joined  = self.summary.joined_member_count
             invited = self.summary.invited_member_count
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018-2019 Damir Jelić <poljar@termina.org.uk>
+#
+# Permission to use, copy, modify, and/or distribute this software for
+# any purpose with or without fee is hereby granted, provided that the
+# above copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER
+# RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF
+# CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""nio schema compiler.
+
+This module turns the JSON schemas found in nio.schemas into specialized
+Python validation functions.
+
+The generated functions accept and reject the same instances as the
+jsonschema Draft 4 validator with the default setting extension that nio
+uses. The keywords nio schemas use (type, properties, patternProperties,
+additionalProperties, required, enum, format, minimum, items and not) are
+turned into inline Python code, every other keyword is delegated to the
+jsonschema implementation of the keyword.
+
+Keywords are checked in the order they appear in the schema and validation
+stops at the first error, the same way jsonschema's validate() method does
+it.
+"""
+
+from __future__ import unicode_literals
+
+import re
+from numbers import Number
+from typing import Any, Dict, List
+
+from jsonschema.exceptions import ValidationError
+
+TYPE_CHECKS = {
+    "array": "isinstance({0}, list)",
+    "boolean": "isinstance({0}, bool)",
+    "integer": "(isinstance({0}, int) and not isinstance({0}, bool))",
+    "null": "{0} is None",
+    "number": "(isinstance({0}, Number) and not isinstance({0}, bool))",
+    "object": "isinstance({0}, dict)",
+    "string": "isinstance({0}, str)",
+}
+
+
+class CompiledValidator(object):
+    """A validator that uses a generated validation function.
+
+    Attributes:
+        schema (Dict): The schema the validator was compiled from.
+        source (str): The generated Python source of the validation function.
+
+    """
+
+    def __init__(self, schema, source, function):
+        self.schema = schema
+        self.source = source
+        self._validate = function
+
+    def validate(self, instance):
+        # type: (Any) -> None
+        """Validate the instance, raise a ValidationError if it's invalid."""
+        self._validate(instance)
+
+    def is_valid(self, instance):
+        # type: (Any) -> bool
+        try:
+            self._validate(instance)
+        except ValidationError:
+            return False
+
+        return True
+
+
+class _CodeGenerator(object):
+    def __init__(self, root_validator, format_checker):
+        self.lines = []      # type: List[str]
+        self.namespace = {
+            "Number": Number,
+            "ValidationError": ValidationError,
+            "root": root_validator,
+            "format_checker": format_checker,
+        }  # type: Dict[str, Any]
+        self.counter = 0
+        self.root_validator = root_validator
+
+    def emit(self, indent, line):
+        self.lines.append("    " * indent + line)
+
+    def name(self, prefix):
+        self.counter += 1
+        return "{}{}".format(prefix, self.counter)
+
+    def constant(self, value):
+        name = self.name("c")
+        self.namespace[name] = value
+        return name
+
+    def fail(self, indent, message, *args):
+        self.emit(indent, "raise ValidationError({}.format({}))".format(
+            repr(message), ", ".join(args)
+        ))
+
+    def generate(self, schema):
+        self.emit(0, "def validate(x0):")
+        self.schema(1, "x0", schema)
+        self.emit(1, "return None")
+
+        return "\n".join(self.lines)
+
+    def schema(self, indent, var, schema):
+        if "$ref" in schema:
+            self.emit(indent, "for error in root.descend({}, {}):".format(
+                var, self.constant(schema)
+            ))
+            self.emit(indent + 1, "raise error")
+            return
+
+        for keyword, value in schema.items():
+            method = getattr(self, "keyword_" + keyword.replace("$", ""),
+                             None)
+
+            if method and method(indent, var, value, schema) is not False:
+                continue
+
+            self.delegate(indent, var, keyword, value, schema)
+
+    def delegate(self, indent, var, keyword, value, schema):
+        function = self.root_validator.VALIDATORS.get(keyword)
+
+        if not function:
+            # Unknown keywords are ignored by jsonschema as well.
+            return
+
+        self.emit(indent, "for error in {}(root, {}, {}, {}):".format(
+            self.constant(function),
+            self.constant(value),
+            var,
+            self.constant(schema),
+        ))
+        self.emit(indent + 1, "raise error")
+
+    def keyword_type(self, indent, var, value, schema):
+        types = [value] if isinstance(value, str) else value
+
+        if not all(t in TYPE_CHECKS for t in types):
+            return False
+
+        checks = " or ".join(TYPE_CHECKS[t].format(var) for t in types)
+        names = ", ".join(repr(t) for t in types)
+        self.emit(indent, "if not ({}):".format(checks))
+        self.fail(indent + 1, "{!r} is not of type " + names, var)
+
+    def keyword_properties(self, indent, var, value, schema):
+        self.emit(indent, "if isinstance({}, dict):".format(var))
+        body = len(self.lines)
+
+        for name, subschema in value.items():
+            if "default" in subschema:
+                self.emit(indent + 1, "{}.setdefault({}, {})".format(
+                    var, repr(name), self.constant(subschema["default"])
+                ))
+
+        for name, subschema in value.items():
+            child = self.name("x")
+            self.emit(indent + 1, "if {} in {}:".format(repr(name), var))
+            self.emit(indent + 2, "{} = {}[{}]".format(child, var, repr(name)))
+            self.schema(indent + 2, child, subschema)
+
+        if len(self.lines) == body:
+            self.lines.pop()
+
+    def keyword_patternProperties(self, indent, var, value, schema):
+        self.emit(indent, "if isinstance({}, dict):".format(var))
+
+        for pattern, subschema in value.items():
+            key = self.name("k")
+            child = self.name("x")
+            regex = self.constant(re.compile(pattern))
+            self.emit(indent + 1, "for {}, {} in {}.items():".format(
+                key, child, var
+            ))
+            self.emit(indent + 2, "if {}.search({}):".format(regex, key))
+            self.emit(indent + 3, "pass")
+            self.schema(indent + 3, child, subschema)
+
+        if not value:
+            self.lines.pop()
+
+    def keyword_additionalProperties(self, indent, var, value, schema):
+        if value is True:
+            return None
+
+        properties = self.constant(schema.get("properties", {}))
+        patterns = "|".join(schema.get("patternProperties", {}))
+        key = self.name("k")
+
+        self.emit(indent, "if isinstance({}, dict):".format(var))
+        self.emit(indent + 1, "for {} in {}:".format(key, var))
+        self.emit(indent + 2, "if {} in {}:".format(key, properties))
+        self.emit(indent + 3, "continue")
+
+        if patterns:
+            regex = self.constant(re.compile(patterns))
+            self.emit(indent + 2, "if {}.search({}):".format(regex, key))
+            self.emit(indent + 3, "continue")
+
+        if value is False:
+            self.fail(indent + 2, "Additional property {!r} is not allowed",
+                      key)
+        else:
+            child = self.name("x")
+            self.emit(indent + 2, "{} = {}[{}]".format(child, var, key))
+            self.schema(indent + 2, child, value)
+
+    def keyword_required(self, indent, var, value, schema):
+        self.emit(indent, "if isinstance({}, dict):".format(var))
+
+        for name in value:
+            self.emit(indent + 1, "if {} not in {}:".format(repr(name), var))
+            self.fail(indent + 2, repr(name).replace("{", "{{").replace(
+                "}", "}}") + " is a required property")
+
+        if not value:
+            self.lines.pop()
+
+    def keyword_enum(self, indent, var, value, schema):
+        # Numbers and booleans need jsonschema's special handling of 0, 1,
+        # True and False.
+        if not all(isinstance(v, str) for v in value):
+            return False
+
+        enum = self.constant(tuple(value))
+        self.emit(indent, "if {} not in {}:".format(var, enum))
+        self.fail(indent + 1, "{!r} is not one of {!r}", var,
+                  self.constant(value))
+
+    def keyword_format(self, indent, var, value, schema):
+        checker = self.namespace["format_checker"]
+
+        if checker is None:
+            return None
+
+        self.emit(indent, "if not format_checker.conforms({}, {}):".format(
+            var, repr(value)
+        ))
+        self.fail(indent + 1, "{!r} is not a {!r}", var, repr(value))
+
+    def keyword_minimum(self, indent, var, value, schema):
+        comparison = "<=" if schema.get("exclusiveMinimum", False) else "<"
+
+        self.emit(indent, "if {} and {} {} {}:".format(
+            TYPE_CHECKS["number"].format(var), var, comparison, repr(value)
+        ))
+        self.fail(indent + 1, "{!r} is less than the minimum of " +
+                  repr(value), var)
+
+    def keyword_items(self, indent, var, value, schema):
+        child = self.name("x")
+
+        if isinstance(value, dict):
+            self.emit(indent, "if isinstance({}, list):".format(var))
+            self.emit(indent + 1, "for {} in {}:".format(child, var))
+            self.emit(indent + 2, "pass")
+            self.schema(indent + 2, child, value)
+            return None
+
+        self.emit(indent, "if isinstance({}, list):".format(var))
+        self.emit(indent + 1, "pass")
+
+        for index, subschema in enumerate(value):
+            self.emit(indent + 1, "if len({}) > {}:".format(var, index))
+            self.emit(indent + 2, "{} = {}[{}]".format(child, var, index))
+            self.schema(indent + 2, child, subschema)
+
+    def keyword_not(self, indent, var, value, schema):
+        self.emit(indent, "try:")
+        self.emit(indent + 1, "pass")
+        self.schema(indent + 1, var, value)
+        self.emit(indent, "except ValidationError:")
+        self.emit(indent + 1, "pass")
+        self.emit(indent, "else:")
+        self.fail(indent + 1, "{!r} is not allowed for {!r}", var,
+                  self.constant(value))
+
+
+def compile_validator(schema, root_validator, format_checker=None):
+    # type: (Dict[Any, Any], Any, Any) -> CompiledValidator
+    """Compile a JSON schema into a validator.
+
+    Args:
+        schema (Dict): The Draft 4 JSON schema that should be compiled.
+        root_validator: A jsonschema validator for the schema, used for
+            keywords that aren't compiled.
+        format_checker (FormatChecker, optional): The format checker that
+            should be used for the format keyword.
+
+    Returns a CompiledValidator.
+    """
+    generator = _CodeGenerator(root_validator, format_checker)
+    source = generator.generate(schema)
+
+    namespace = generator.namespace
+    exec(compile(source, "<nio schema>", "exec"), namespace)
+
+    return CompiledValidator(schema, source, namespace["validate"])
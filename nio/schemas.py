@@ -16,8 +16,12 @@
 
 from __future__ import unicode_literals
 
+from typing import Any, Dict, Tuple
+
 from jsonschema import Draft4Validator, FormatChecker, validators
 
+from .schema_compiler import compile_validator
+
 RoomRegex = "^!.+:.+$"
 UserIdRegex = "^@.*:.+$"
 EventTypeRegex = r"^.+\..+"
@@ -59,8 +63,64 @@ def check_user_id(value):
     return True
 
 
+format_checker = FormatChecker()
+
+# Compiled validators, keyed by the id of the schema they were built for. The
+# schema itself is stored next to the validator so that the id can't be
+# recycled for a different schema while it's in the cache.
+_validators = {}  # type: Dict[int, Tuple[Dict[Any, Any], Any]]
+_use_compiled_validators = False
+
+
+def use_compiled_validators(enabled=True):
+    # type: (bool) -> None
+    """Select the engine that is used to validate JSON schemas.
+
+    By default schemas are validated using jsonschema. If enabled, schemas
+    are instead turned into specialized Python functions by the
+    nio.schema_compiler module, these accept and reject the same data but
+    are considerably faster.
+
+    This is a process wide setting.
+
+    Args:
+        enabled (bool): True to use compiled validators, False to use
+            jsonschema.
+    """
+    global _use_compiled_validators
+
+    if enabled != _use_compiled_validators:
+        _use_compiled_validators = enabled
+        _validators.clear()
+
+
+def compile_schema(schema):
+    # type: (Dict[Any, Any]) -> Any
+    """Get a validator for the given schema.
+
+    The validator is created the first time this is called for a schema,
+    later calls return the cached validator.
+
+    Args:
+        schema (Dict): The JSON schema, usually one of the Schemas attributes.
+    """
+    cached = _validators.get(id(schema))
+
+    if cached and cached[0] is schema:
+        return cached[1]
+
+    validator = Validator(schema, format_checker=format_checker)
+
+    if _use_compiled_validators:
+        validator = compile_validator(schema, validator, format_checker)
+
+    _validators[id(schema)] = (schema, validator)
+
+    return validator
+
+
 def validate_json(instance, schema):
-    Validator(schema, format_checker=FormatChecker()).validate(instance)
+    compile_schema(schema).validate(instance)
 
 
 class Schemas(object):
@@ -173,8 +233,8 @@ class Schemas(object):
                                 "required": ["alg", "k"],
                             },
                         },
+                        "required": ["url", "hashes", "iv", "key"],
                     },
-                    "required": ["url", "hashes", "iv", "key"],
                 },
                 "required": ["body", "file", "msgtype"],
             }
@@ -789,7 +849,6 @@ class Schemas(object):
             "content": {
                 "type": "object",
                 "properties": {"alias": {"type": "string"}},
-                "required": [],
             },
         },
         "required": ["type", "sender", "content", "state_key"],
@@ -1156,8 +1215,8 @@ class Schemas(object):
                     ]
                 }
             },
-            "required": ["devices"]
         },
+        "required": ["devices"],
     }
 
     delete_devices = {
@@ -1173,8 +1232,8 @@ class Schemas(object):
                             "type": "array",
                             "items": {"type": "string"}
                         },
-                        "required": ["stages"]
                     },
+                    "required": ["stages"],
                 }
             },
             "params": {
@@ -1184,8 +1243,8 @@ class Schemas(object):
                     "patternProperties": {r".+": {"type": "string"}}
                 }},
             },
-            "required": ["session", "flows", "params"]
         },
+        "required": ["session", "flows", "params"],
     }
 
     joined_members = {
@@ -1441,6 +1500,12 @@ class Schemas(object):
         "not": {"required": ["errcode"]}
     }
 
+    upload_filter = {
+        "type": "object",
+        "properties": {"filter_id": {"type": "string"}},
+        "required": ["filter_id"],
+    }
+
     get_displayname = {
         "type": "object",
         "properties": {
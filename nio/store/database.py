@@ -11,11 +11,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import os
 import sqlite3
 from builtins import super
-from functools import wraps
-from typing import Optional, List, Dict
+from functools import partial, wraps
+from typing import Optional, Iterable, List, Dict
 
 import attr
 from peewee import DoesNotExist, SqliteDatabase
@@ -27,10 +28,13 @@ from . import (Accounts, DeviceKeys, DeviceKeys_v1, DeviceTrustState,
                LegacyForwardedChains, LegacyMegolmInboundSessions,
                LegacyOlmSessions, LegacyOutgoingKeyRequests,
                MegolmInboundSessions, OlmSessions, OutgoingKeyRequests,
-               StoreVersion, SyncTokens)
+               RoomMembers, Rooms, StoreVersion, SyncFilters, SyncTokens)
 from ..crypto import (DeviceStore, GroupSessionStore, InboundGroupSession,
                       OlmAccount, OlmDevice, OutgoingKeyRequest, Session,
                       SessionStore, TrustState)
+from ..events import DefaultLevels, PowerLevels
+from ..responses import RoomSummary
+from ..rooms import MatrixRoom, MatrixUser
 
 
 def use_database(fn):
@@ -467,7 +471,10 @@ class MatrixStore(object):
         OutgoingKeyRequests,
         StoreVersion,
         Keys,
-        SyncTokens
+        SyncTokens,
+        SyncFilters,
+        Rooms,
+        RoomMembers
     ]
     store_version = 2
 
@@ -944,6 +951,224 @@ class MatrixStore(object):
 
         return None
 
+    @use_database
+    def save_sync_filter(self, filter_hash, filter_id):
+        # type: (str, str) -> None
+        """Save the id of an uploaded sync filter.
+
+        Args:
+            filter_hash (str): A hash of the filter configuration.
+            filter_id (str): The id the server gave the filter.
+        """
+        account = self._get_account()
+        assert account
+
+        SyncFilters.replace(
+            account=account,
+            filter_hash=filter_hash,
+            filter_id=filter_id
+        ).execute()
+
+    @use_database
+    def load_sync_filter(self, filter_hash):
+        # type: (str) -> Optional[str]
+        """Load the id of an uploaded sync filter.
+
+        Args:
+            filter_hash (str): A hash of the filter configuration.
+
+        Returns the filter id or None if the filter wasn't uploaded yet.
+        """
+        account = self._get_account()
+
+        if not account:
+            return None
+
+        sync_filter = SyncFilters.get_or_none(
+            SyncFilters.account == account.id,
+            SyncFilters.filter_hash == filter_hash,
+        )
+
+        if sync_filter:
+            return sync_filter.filter_id
+
+        return None
+
+    @use_database_atomic
+    def save_room(self, room, changed_members=None):
+        # type: (MatrixRoom, Optional[Iterable[str]]) -> None
+        """Save the state of a joined room.
+
+        Args:
+            room (MatrixRoom): The room that should be saved.
+            changed_members (Iterable[str], optional): The ids of the members
+                that changed since the room was last saved. Members that
+                aren't part of the room anymore are deleted from the store. If
+                not given, every member of the room is saved. The members of
+                a restored room aren't loaded to save it.
+        """
+        account = self._get_account()
+        assert account
+
+        state = {
+            "creator": room.creator,
+            "federate": room.federate,
+            "room_version": room.room_version,
+            "guest_access": room.guest_access,
+            "join_rule": room.join_rule,
+            "history_visibility": room.history_visibility,
+            "canonical_alias": room.canonical_alias,
+            "topic": room.topic,
+            "name": room.name,
+            "avatar_url": room.room_avatar_url,
+            "encrypted": room.encrypted,
+            "members_loaded": room.members_loaded,
+            "power_levels": json.dumps(attr.asdict(room.power_levels)),
+            "summary": (json.dumps(attr.asdict(room.summary))
+                        if room.summary else None),
+        }
+
+        Rooms.insert(
+            room_id=room.room_id,
+            account=account,
+            **state
+        ).on_conflict_ignore().execute()
+
+        Rooms.update(**state).where(
+            (Rooms.room_id == room.room_id) & (Rooms.account == account)
+        ).execute()
+
+        db_room = Rooms.get(
+            Rooms.room_id == room.room_id,
+            Rooms.account == account
+        )
+
+        # The members of a restored room that weren't loaded yet are still
+        # unchanged in the store, loading them just to save them again would
+        # defeat the lazy loading. Whether the member list of the room is
+        # complete is tracked by members_loaded, partial lists are saved too.
+        pending = room.member_loader is not None
+        users = room._users if pending else room.users
+
+        if changed_members is None:
+            changed_members = users.keys()
+
+        data = []
+        removed = []
+
+        for user_id in changed_members:
+            user = users.get(user_id)
+
+            if user:
+                data.append((user.user_id, user.display_name,
+                             user.avatar_url, user.invited, db_room))
+            elif not pending:
+                removed.append(user_id)
+
+        for idx in range(0, len(data), 400):
+            rows = data[idx:idx + 400]
+            RoomMembers.replace_many(rows, fields=[
+                RoomMembers.user_id,
+                RoomMembers.display_name,
+                RoomMembers.avatar_url,
+                RoomMembers.invited,
+                RoomMembers.room
+            ]).execute()
+
+        for idx in range(0, len(removed), 400):
+            RoomMembers.delete().where(
+                (RoomMembers.room == db_room)
+                & RoomMembers.user_id.in_(removed[idx:idx + 400])
+            ).execute()
+
+    @use_database
+    def load_rooms(self):
+        # type: () -> Dict[str, MatrixRoom]
+        """Load the joined rooms of this account.
+
+        The members of the rooms are loaded once they are first accessed.
+
+        Returns:
+            ``Dict`` mapping room ids to ``MatrixRoom`` objects.
+
+        """
+        account = self._get_account()
+
+        if not account:
+            return dict()
+
+        rooms = dict()
+
+        for db_room in account.rooms:
+            room = MatrixRoom(db_room.room_id, self.user_id, db_room.encrypted)
+
+            room.creator = db_room.creator
+            room.federate = db_room.federate
+            room.room_version = db_room.room_version
+            room.guest_access = db_room.guest_access
+            room.join_rule = db_room.join_rule
+            room.history_visibility = db_room.history_visibility
+            room.canonical_alias = db_room.canonical_alias
+            room.topic = db_room.topic
+            room.name = db_room.name
+            room.room_avatar_url = db_room.avatar_url
+            room.members_loaded = db_room.members_loaded
+
+            if db_room.power_levels:
+                levels = json.loads(db_room.power_levels)
+                room.power_levels = PowerLevels(
+                    DefaultLevels(**levels["defaults"]),
+                    levels["users"],
+                    levels["events"],
+                )
+
+            if db_room.summary:
+                room.summary = RoomSummary(**json.loads(db_room.summary))
+
+            room.member_loader = partial(self.load_room_members, room.room_id)
+            rooms[room.room_id] = room
+
+        return rooms
+
+    @use_database
+    def load_room_members(self, room_id):
+        # type: (str) -> List[MatrixUser]
+        """Load the members of a joined room.
+
+        Args:
+            room_id (str): The id of the room.
+        """
+        account = self._get_account()
+
+        if not account:
+            return []
+
+        query = RoomMembers.select().join(Rooms).where(
+            (Rooms.room_id == room_id) & (Rooms.account == account)
+        )
+
+        return [
+            MatrixUser(
+                member.user_id,
+                member.display_name,
+                member.avatar_url,
+                invited=member.invited,
+            ) for member in query
+        ]
+
+    @use_database
+    def delete_room(self, room_id):
+        # type: (str) -> None
+        """Delete a room and its members from the store."""
+        account = self._get_account()
+
+        if not account:
+            return
+
+        Rooms.delete().where(
+            (Rooms.room_id == room_id) & (Rooms.account == account)
+        ).execute()
+
     @use_database
     def delete_encrypted_room(self, room):
         # type: (str) -> None
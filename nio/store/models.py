@@ -314,6 +314,63 @@ class SyncTokens(Model):
         constraints = [SQL("UNIQUE(account_id)")]
 
 
+class SyncFilters(Model):
+    filter_hash = TextField()
+    filter_id = TextField()
+    account = ForeignKeyField(
+        model=Accounts,
+        column_name="account_id",
+        on_delete="CASCADE",
+        backref="sync_filters",
+    )
+
+    class Meta:
+        constraints = [SQL("UNIQUE(account_id,filter_hash)")]
+
+
+class Rooms(Model):
+    room_id = TextField()
+    creator = TextField(default="")
+    federate = BooleanField(default=True)
+    room_version = TextField(default="1")
+    guest_access = TextField(default="forbidden")
+    join_rule = TextField(default="invite")
+    history_visibility = TextField(default="shared")
+    canonical_alias = TextField(null=True)
+    topic = TextField(null=True)
+    name = TextField(null=True)
+    avatar_url = TextField(null=True)
+    encrypted = BooleanField(default=False)
+    members_loaded = BooleanField(default=False)
+    power_levels = TextField(null=True)
+    summary = TextField(null=True)
+    account = ForeignKeyField(
+        model=Accounts,
+        column_name="account_id",
+        on_delete="CASCADE",
+        backref="rooms",
+    )
+
+    class Meta:
+        constraints = [SQL("UNIQUE(room_id,account_id)")]
+
+
+class RoomMembers(Model):
+    user_id = TextField()
+    display_name = TextField(null=True)
+    avatar_url = TextField(null=True)
+    invited = BooleanField(default=False)
+    room = ForeignKeyField(
+        model=Rooms,
+        column_name="room_id",
+        on_delete="CASCADE",
+        backref="members",
+    )
+
+    class Meta:
+        constraints = [SQL("UNIQUE(room_id,user_id)")]
+
+
 class TrackedUsers(Model):
     user_id = TextField()
     account = ForeignKeyField(
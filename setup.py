@@ -40,7 +40,10 @@ setup(
             "peewee>=3.9.5",
             "cachetools",
             "atomicwrites",
-        ]
+        ],
+        "fast-json": [
+            "orjson",
+        ],
     },
     zip_safe=False
 )
@@ -5,6 +5,7 @@ import re
 import time
 from pathlib import Path
 from os import path
+from collections import defaultdict
 from datetime import datetime, timedelta
 from urllib.parse import quote
 from uuid import uuid4
@@ -13,7 +14,7 @@ import aiofiles
 import pytest
 from aiohttp import ClientSession, TraceRequestChunkSentParams
 
-from helpers import faker
+from helpers import faker, synthetic_sync
 from nio import (DeviceList, DeviceOneTimeKeyCount, DownloadError,
                  DevicesResponse, DeleteDevicesAuthResponse,
                  DeleteDevicesResponse,
@@ -34,13 +35,15 @@ from nio import (DeviceList, DeviceOneTimeKeyCount, DownloadError,
                  RoomMemberEvent, RoomMessagesResponse, Rooms,
                  RoomRedactResponse, RoomSendResponse, RoomSummary,
                  ShareGroupSessionResponse,
-                 SyncResponse, ThumbnailError, ThumbnailResponse,
+                 SyncError, SyncResponse, ThumbnailError, ThumbnailResponse,
                  Timeline, TransferMonitor, TransferCancelledError,
                  UploadResponse,
                  RoomMessageText, RoomKeyRequest)
-from nio.api import ResizingMethod, RoomPreset, RoomVisibility
+from nio.api import (ResizingMethod, RoomPreset, RoomVisibility,
+                     lazy_loading_filter)
 from nio.crypto import OlmDevice, Session, decrypt_attachment
-from nio.client.async_client import on_request_chunk_sent
+from nio.client.async_client import (CallbackDispatcher,
+                                     on_request_chunk_sent)
 
 from aioresponses import CallbackResult
 
@@ -481,6 +484,361 @@ class TestClass(object):
         assert isinstance(resp, LoginResponse)
         assert isinstance(resp2, SyncResponse)
 
+    def test_sync_max_events(self, async_client, aioresponse):
+        loop = asyncio.get_event_loop()
+        ticks = []
+        events = []
+
+        async def ticker():
+            while True:
+                ticks.append(None)
+                await asyncio.sleep(0)
+
+        async def cb(room, event):
+            events.append((event, len(ticks)))
+
+        sync_response = synthetic_sync(1, 5)
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            "https://example.org/_matrix/client/r0/sync?access_token=abc123",
+            status=200,
+            payload=sync_response
+        )
+
+        async_client.add_event_callback(cb, RoomMessageText)
+
+        loop.run_until_complete(async_client.login("wordpass"))
+
+        task = loop.create_task(ticker())
+        resp = loop.run_until_complete(async_client.sync(max_events=2))
+        task.cancel()
+
+        expected = SyncResponse.from_dict(sync_response)
+        room_id, info = next(iter(expected.rooms.join.items()))
+
+        assert isinstance(resp, SyncResponse)
+        assert async_client.next_batch == expected.next_batch
+        assert async_client.rooms[room_id].member_count == 2
+        assert [event for event, _ in events] == info.timeline.events
+        # Other tasks ran between the parts of the response.
+        assert events[0][1] < events[-1][1]
+
+    def test_sync_time_slice(self, async_client, aioresponse):
+        loop = asyncio.get_event_loop()
+        ticks = []
+        events = []
+
+        async def ticker():
+            while True:
+                ticks.append(None)
+                await asyncio.sleep(0)
+
+        def cb(room, event):
+            events.append(len(ticks))
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            "https://example.org/_matrix/client/r0/sync?access_token=abc123",
+            status=200,
+            payload=synthetic_sync(2, 5)
+        )
+
+        async_client.add_event_callback(cb, RoomMessageText)
+        scheduler = async_client.sync_scheduler
+        scheduler.time_slice = 0
+
+        loop.run_until_complete(async_client.login("wordpass"))
+
+        task = loop.create_task(ticker())
+        resp = loop.run_until_complete(async_client.sync())
+        task.cancel()
+
+        assert isinstance(resp, SyncResponse)
+        assert len(events) == 10
+        assert events[0] < events[-1]
+        assert scheduler.yields > 0
+        assert sum(scheduler.histogram) == scheduler.yields + 1
+        assert scheduler.max_blocking_time > 0
+
+    def test_sync_time_slice_async_callback(self, async_client, aioresponse):
+        loop = asyncio.get_event_loop()
+        events = []
+
+        async def cb(room, event):
+            await asyncio.sleep(0.05)
+            events.append(event)
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            "https://example.org/_matrix/client/r0/sync?access_token=abc123",
+            status=200,
+            payload=synthetic_sync(1, 2)
+        )
+
+        async_client.add_event_callback(cb, RoomMessageText)
+        scheduler = async_client.sync_scheduler
+
+        loop.run_until_complete(async_client.login("wordpass"))
+        resp = loop.run_until_complete(async_client.sync())
+
+        assert isinstance(resp, SyncResponse)
+        assert len(events) == 2
+        # Awaiting the callbacks didn't count as blocking the event loop.
+        assert scheduler.max_blocking_time < 0.05
+        assert not scheduler.running
+
+    def test_sync_concurrent_callbacks(self, async_client, aioresponse):
+        loop = asyncio.get_event_loop()
+        events = defaultdict(list)
+        running = []
+        max_running = []
+
+        async def cb(room, event):
+            running.append(event)
+            max_running.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(event)
+            events[room.room_id].append(event)
+
+        sync_response = synthetic_sync(3, 4)
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            "https://example.org/_matrix/client/r0/sync?access_token=abc123",
+            status=200,
+            payload=sync_response
+        )
+
+        dispatcher = CallbackDispatcher(2, 5)
+        async_client.callback_dispatcher = dispatcher
+        async_client.add_event_callback(cb, RoomMessageText)
+
+        loop.run_until_complete(async_client.login("wordpass"))
+        resp = loop.run_until_complete(async_client.sync())
+
+        assert isinstance(resp, SyncResponse)
+        assert dispatcher.queued <= 5
+
+        loop.run_until_complete(dispatcher.join())
+
+        expected = SyncResponse.from_dict(sync_response)
+
+        assert dispatcher.queued == 0
+        assert max(max_running) == 2
+        assert events == {
+            room_id: info.timeline.events
+            for room_id, info in expected.rooms.join.items()
+        }
+
+    def test_events(self, async_client, aioresponse):
+        loop = asyncio.get_event_loop()
+        sync_response = synthetic_sync(2, 5)
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            "https://example.org/_matrix/client/r0/sync?access_token=abc123",
+            status=200,
+            payload=sync_response
+        )
+
+        loop.run_until_complete(async_client.login("wordpass"))
+
+        expected = SyncResponse.from_dict(sync_response)
+        room_id, info = next(iter(expected.rooms.join.items()))
+
+        stream = async_client.events(RoomMessageText, room_id=room_id,
+                                     maxsize=2)
+        dropping = async_client.events(maxsize=2, overflow="drop_oldest")
+
+        async def consume():
+            events = []
+
+            async with stream:
+                async for room, event in stream:
+                    assert room.room_id == room_id
+                    events.append(event)
+
+                    if len(events) == len(info.timeline.events):
+                        break
+
+            return events
+
+        sync = asyncio.ensure_future(async_client.sync())
+        events = loop.run_until_complete(consume())
+        resp = loop.run_until_complete(sync)
+
+        assert isinstance(resp, SyncResponse)
+        assert events == info.timeline.events
+        assert stream.closed
+        assert stream._callback not in async_client.event_callbacks
+
+        assert len(dropping._queue) == 2
+        assert dropping.dropped == 8
+
+        async def drain():
+            return [event async for _, event in dropping]
+
+        dropping.close()
+        last_info = list(expected.rooms.join.values())[-1]
+
+        assert loop.run_until_complete(drain()) == (
+            last_info.timeline.events[-2:]
+        )
+
+    def test_events_break(self, async_client, aioresponse):
+        loop = asyncio.get_event_loop()
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            "https://example.org/_matrix/client/r0/sync?access_token=abc123",
+            status=200,
+            payload=synthetic_sync(2, 5)
+        )
+
+        loop.run_until_complete(async_client.login("wordpass"))
+
+        stream = async_client.events(RoomMessageText, maxsize=1)
+
+        async def consume():
+            # The stream isn't closed explicitly.
+            async for room, event in stream:
+                return event
+
+        sync = asyncio.ensure_future(async_client.sync())
+        assert loop.run_until_complete(consume())
+
+        # Leaving the loop closed the stream, the sync doesn't block on it.
+        resp = loop.run_until_complete(asyncio.wait_for(sync, 5))
+        assert isinstance(resp, SyncResponse)
+        assert stream.closed
+        assert stream._callback not in async_client.event_callbacks
+
+    def test_sync_stream(self, async_client, aioresponse):
+        loop = asyncio.get_event_loop()
+        events = []
+
+        async def cb(room, event):
+            events.append((room.room_id, event))
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            "https://example.org/_matrix/client/r0/sync?access_token=abc123",
+            status=200,
+            payload=self.sync_response
+        )
+
+        async_client.config = AsyncClientConfig(stream_sync=True)
+        async_client.add_event_callback(cb, (RoomMemberEvent,
+                                             RoomMessageText))
+
+        loop.run_until_complete(async_client.login("wordpass"))
+        resp = loop.run_until_complete(async_client.sync())
+
+        expected = SyncResponse.from_dict(self.sync_response)
+
+        assert isinstance(resp, SyncResponse)
+        assert resp.next_batch == expected.next_batch
+        assert resp.device_key_count == expected.device_key_count
+        assert not resp.rooms.join
+        assert async_client.next_batch == expected.next_batch
+
+        room_id, info = next(iter(expected.rooms.join.items()))
+        room = async_client.rooms[room_id]
+
+        assert room.member_count == 2
+        assert events == [
+            (room_id, event) for event in info.timeline.events
+            if isinstance(event, (RoomMemberEvent, RoomMessageText))
+        ]
+
+    def test_sync_stream_error(self, async_client, aioresponse):
+        loop = asyncio.get_event_loop()
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        sync_response = self.sync_response
+        del sync_response["next_batch"]
+        aioresponse.get(
+            "https://example.org/_matrix/client/r0/sync?access_token=abc123",
+            status=200,
+            payload=sync_response
+        )
+
+        async_client.config = AsyncClientConfig(stream_sync=True)
+
+        loop.run_until_complete(async_client.login("wordpass"))
+        resp = loop.run_until_complete(async_client.sync())
+
+        assert isinstance(resp, SyncError)
+        assert not async_client.next_batch
+
+    def test_sync_stream_retry(self, async_client, aioresponse):
+        loop = asyncio.get_event_loop()
+        events = []
+
+        async def cb(room, event):
+            events.append(event)
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        sync_url = "https://example.org/_matrix/client/r0/sync?access_token=abc123"
+        broken_response = self.sync_response
+        del broken_response["next_batch"]
+        aioresponse.get(sync_url, status=200, payload=broken_response)
+        aioresponse.get(sync_url, status=200, payload=self.sync_response)
+
+        async_client.config = AsyncClientConfig(stream_sync=True)
+        async_client.add_event_callback(cb, RoomMessageText)
+
+        loop.run_until_complete(async_client.login("wordpass"))
+
+        resp = loop.run_until_complete(async_client.sync())
+        assert isinstance(resp, SyncError)
+        assert events
+
+        handled = list(events)
+
+        # The retry contains the same events, their callbacks don't run again.
+        resp = loop.run_until_complete(async_client.sync())
+        assert isinstance(resp, SyncResponse)
+        assert events == handled
+        assert not async_client._sync_progress
+
     def test_keys_upload(self, async_client, aioresponse):
         loop = asyncio.get_event_loop()
 
@@ -618,6 +976,59 @@ class TestClass(object):
         assert not async_client.get_missing_sessions(TEST_ROOM_ID)
         assert async_client.olm.session_store.get(alice_device.curve25519)
 
+    async def test_load_room_members(self, async_client, aioresponse):
+        await async_client.receive_response(
+            LoginResponse.from_dict(self.login_response)
+        )
+        assert async_client.logged_in
+
+        await async_client.receive_response(self.encryption_sync_response)
+
+        requests = []
+
+        def joined_members_cb(url, **kwargs):
+            requests.append(url)
+            return CallbackResult(
+                status=200,
+                payload=self.joined_members_resopnse
+            )
+
+        aioresponse.get(
+            "https://example.org/_matrix/client/r0/rooms/{}/"
+            "joined_members?access_token=abc123".format(TEST_ROOM_ID),
+            callback=joined_members_cb,
+            repeat=True,
+        )
+        # The keys of the newly loaded member are queried.
+        keys_query_response = self.keys_query_response
+        keys_query_response["device_keys"]["@bar:example.com"] = {}
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/keys/query?access_token=abc123",
+            status=200,
+            payload=keys_query_response
+        )
+
+        room = async_client.rooms[TEST_ROOM_ID]
+        assert not room.members_synced
+
+        responses = await asyncio.gather(
+            async_client.load_room_members(TEST_ROOM_ID),
+            async_client.load_room_members(TEST_ROOM_ID),
+        )
+
+        assert len(requests) == 1
+        assert all(isinstance(r, JoinedMembersResponse) for r in responses)
+        assert room.members_synced
+        assert not async_client.should_query_keys
+
+        assert await async_client.load_room_members(TEST_ROOM_ID) is None
+        assert len(requests) == 1
+
+        assert await async_client.room_user_name(
+            TEST_ROOM_ID, "@bar:example.com"
+        ) == "Bar"
+
     async def test_session_sharing(self, alice_client, async_client, aioresponse):
         await async_client.receive_response(
             LoginResponse.from_dict(self.login_response)
@@ -762,6 +1173,50 @@ class TestClass(object):
 
         assert imported_session.id == out_session.id
 
+    async def test_sync_filter_upload(self, async_client, aioresponse):
+        await async_client.receive_response(
+            LoginResponse.from_dict(self.login_response)
+        )
+        assert async_client.logged_in
+
+        uploads = []
+        sync_urls = []
+
+        def upload_cb(url, data=None, **kwargs):
+            uploads.append(json.loads(data))
+            return CallbackResult(status=200, payload={"filter_id": "10"})
+
+        def sync_cb(url, **kwargs):
+            sync_urls.append(url)
+            return CallbackResult(status=200, payload=self.empty_sync)
+
+        aioresponse.post(
+            re.compile(r"^https://example\.org/_matrix/client/r0/user/"
+                       r"[^/]+/filter\?access_token=abc123$"),
+            callback=upload_cb,
+            repeat=True,
+        )
+        aioresponse.get(
+            re.compile(r"^https://example\.org/_matrix/client/r0/sync\?.*"),
+            callback=sync_cb,
+            repeat=True,
+        )
+
+        sync_filter = lazy_loading_filter(timeline_limit=10)
+
+        await async_client.sync(sync_filter=sync_filter)
+        await async_client.sync(sync_filter=lazy_loading_filter(10))
+
+        assert uploads == [sync_filter]
+        assert len(sync_urls) == 2
+        assert all(url.query["filter"] == "10" for url in sync_urls)
+
+        async_client._sync_filter_ids.clear()
+        await async_client.sync(sync_filter=sync_filter)
+
+        # The filter id was loaded from the store.
+        assert len(uploads) == 1
+
     async def test_room_create(self, async_client, aioresponse):
         await async_client.receive_response(
             LoginResponse.from_dict(self.login_response)
@@ -1209,6 +1664,50 @@ class TestClass(object):
         assert monitor.remaining_time.microseconds == 0
         assert monitor.done is True
 
+    async def test_connection_pools(self, async_client, aioresponse):
+        async_client.config = AsyncClientConfig(
+            separate_connection_pools=True,
+            max_connections_per_host=2,
+            dns_cache_ttl=0,
+        )
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            re.compile(r"^https://example\.org/_matrix/client/r0/sync\?.*"),
+            status=200,
+            payload=self.sync_response
+        )
+        aioresponse.get(
+            "https://example.org/_matrix/media/r0/download/example.org/"
+            "abc?allow_remote=true",
+            status=200,
+            content_type="image/png",
+            body=self.file_response,
+        )
+
+        await async_client.login("wordpass")
+        session = async_client.client_session
+
+        assert session.connector.limit_per_host == 2
+        assert not session.connector.use_dns_cache
+        assert not async_client._pool_sessions
+
+        await async_client.sync()
+        await async_client.download("example.org", "abc")
+
+        sync_session = async_client._pool_sessions["sync"]
+        media_session = async_client._pool_sessions["media"]
+        assert len({session, sync_session, media_session}) == 3
+
+        await async_client.close()
+        assert sync_session.closed
+        assert media_session.closed
+        assert not async_client._pool_sessions
+
     async def test_download(self, async_client, aioresponse):
         server_name = "example.org"
         media_id = "ascERGshawAWawugaAcauga"
@@ -1605,6 +2104,64 @@ class TestClass(object):
         task.cancel()
         await task
 
+    async def test_sync_forever_pipelined(self, async_client, aioresponse,
+                                          loop):
+        sync_url = re.compile(
+            r'^https://example\.org/_matrix/client/r0/sync\?access_token=.*'
+        )
+        sync_requests = []
+        sent_before_callback = []
+
+        def sync_cb(url, **kwargs):
+            sync_requests.append(url)
+            payload = self.empty_sync if sync_requests[1:] else (
+                self.sync_response
+            )
+            return CallbackResult(status=200, payload=payload)
+
+        async def response_cb(response):
+            await asyncio.sleep(0.05)
+            sent_before_callback.append(len(sync_requests))
+
+        aioresponse.get(sync_url, callback=sync_cb, repeat=True)
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/keys/upload?access_token=abc123",
+            status=200,
+            payload=self.keys_upload_response,
+            repeat=True
+        )
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/keys/query?access_token=abc123",
+            status=200,
+            payload=self.keys_query_response,
+            repeat=True
+        )
+
+        await async_client.receive_response(
+            LoginResponse.from_dict(self.login_response)
+        )
+        async_client.add_response_callback(response_cb, SyncResponse)
+
+        task = loop.create_task(async_client.sync_forever(pipelined=True))
+
+        await async_client.synced.wait()
+        await async_client.synced.wait()
+        await asyncio.sleep(0.1)
+
+        task.cancel()
+        await task
+
+        assert not async_client.should_upload_keys
+        assert async_client.next_batch == self.empty_sync["next_batch"]
+        # The second sync request went out before the callbacks for the
+        # first response ran.
+        assert sent_before_callback[0] >= 2
+        assert "since=" + self.sync_response["next_batch"] in str(
+            sync_requests[1]
+        )
+
     async def test_session_unwedging(self, async_client_pair, aioresponse, loop):
         alice, bob = async_client_pair
 
@@ -2323,6 +2880,11 @@ class TestClass(object):
         await alice.receive_response(self.synce_response_for(alice.user_id, bob.user_id))
         await bob.receive_response(self.synce_response_for(bob.user_id, alice.user_id))
 
+        # Both clients are the same user now, which makes the member list
+        # look incomplete. Don't let sharing the group session load it.
+        alice.rooms[TEST_ROOM_ID].members_loaded = True
+        bob.rooms[TEST_ROOM_ID].members_loaded = True
+
         alice_device = OlmDevice(
             alice.user_id,
             alice.device_id,
@@ -2581,6 +3143,11 @@ class TestClass(object):
         await alice.receive_response(self.synce_response_for(alice.user_id, bob.user_id))
         await bob.receive_response(self.synce_response_for(bob.user_id, alice.user_id))
 
+        # Both clients are the same user now, which makes the member list
+        # look incomplete. Don't let sharing the group session load it.
+        alice.rooms[TEST_ROOM_ID].members_loaded = True
+        bob.rooms[TEST_ROOM_ID].members_loaded = True
+
         alice_device = OlmDevice(
             alice.user_id,
             alice.device_id,
@@ -0,0 +1,239 @@
+import asyncio
+import time
+from urllib.parse import unquote
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from yarl import URL
+
+from helpers import H2TestServer
+from nio import (AsyncClient, AsyncClientConfig, LocalProtocolError,
+                 LoginResponse, MatrixRoom, RoomSendResponse)
+from nio.client.http2_transport import (Http2ClientResponse,
+                                        Http2StreamContent, Http2Transport)
+
+ALICE_ID = "@alice:example.org"
+ALICE_DEVICE_ID = "JLAFKJWSCS"
+TEST_ROOM_ID = "!testroom:example.org"
+
+SEND_COUNT = 1000
+SERVER_DELAY = 0.005
+
+
+async def _logged_in_client(homeserver, tempdir, http2):
+    client = AsyncClient(
+        homeserver,
+        ALICE_ID,
+        ALICE_DEVICE_ID,
+        tempdir,
+        config=AsyncClientConfig(
+            http2=http2,
+            encryption_enabled=False,
+            max_timeouts=3,
+        ),
+    )
+    await client.receive_response(
+        LoginResponse(ALICE_ID, ALICE_DEVICE_ID, "alice_1234")
+    )
+    client.rooms[TEST_ROOM_ID] = MatrixRoom(TEST_ROOM_ID, ALICE_ID)
+    return client
+
+
+async def _http11_server(delay):
+    async def send(request):
+        await request.read()
+        await asyncio.sleep(delay)
+        return web.json_response(
+            {"event_id": "$" + request.match_info["tx_id"]}
+        )
+
+    app = web.Application()
+    app.router.add_put(
+        "/_matrix/client/r0/rooms/{room_id}/send/{event_type}/{tx_id}", send,
+    )
+
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    return server
+
+
+async def _timed_sends(client, count):
+    async def send(tx_id):
+        start = time.monotonic()
+        response = await client.room_send(
+            TEST_ROOM_ID, "m.room.message", {"body": "hello"}, str(tx_id)
+        )
+        assert isinstance(response, RoomSendResponse)
+        assert response.event_id == "${}".format(tx_id)
+        return time.monotonic() - start
+
+    return await asyncio.gather(*(send(i) for i in range(count)))
+
+
+class TestClass(object):
+    async def test_http2_room_send(self, tempdir):
+        server = H2TestServer(delay=0.01)
+        await server.start()
+
+        client = await _logged_in_client(server.url, tempdir, True)
+        await _timed_sends(client, 50)
+
+        # All the requests were multiplexed over one connection.
+        assert server.connections == 1
+        assert len(server.requests) == 50
+
+        method, path, body = server.requests[0]
+        assert method == "PUT"
+        assert unquote(path).startswith(
+            "/_matrix/client/r0/rooms/{}/send/m.room.message/".format(
+                TEST_ROOM_ID
+            )
+        )
+        assert b"hello" in body
+
+        await client.close()
+        assert not client._http2_transport
+        await server.close()
+
+    async def test_http2_stream_limit(self, tempdir):
+        server = H2TestServer(delay=0.01, max_concurrent_streams=2)
+        await server.start()
+
+        client = await _logged_in_client(server.url, tempdir, True)
+        await _timed_sends(client, 10)
+
+        assert server.connections == 1
+        assert len(server.requests) == 10
+
+        await client.close()
+        await server.close()
+
+    async def test_http2_transport_body(self):
+        server = H2TestServer(
+            handler=lambda method, path, body: (404, {
+                "errcode": "M_NOT_FOUND", "error": "Not found",
+            })
+        )
+        await server.start()
+
+        async def chunks():
+            for chunk in (b"123", b"456", b"789"):
+                yield chunk
+
+        transport = Http2Transport(server.url)
+        response = await transport.request("POST", "/test", chunks())
+
+        assert isinstance(response, Http2ClientResponse)
+        assert response.status == 404
+        assert response.content_type == "application/json"
+        assert response.headers["content-type"] == "application/json"
+        assert response.content_disposition is None
+        assert b"M_NOT_FOUND" in await response.read()
+
+        assert server.requests == [("POST", "/test", b"123456789")]
+
+        # A lost connection is replaced with a new one.
+        await server.close()
+        await transport.connection.close()
+
+        await server.start()
+        transport.port = server.port
+
+        response = await transport.request("GET", "/test")
+        assert response.status == 404
+        assert server.connections == 2
+
+        await transport.close()
+        await server.close()
+
+    async def test_http2_stream_content_acknowledge(self):
+        acknowledged = []
+        content = Http2StreamContent(acknowledged.append)
+
+        content.feed_data(b"123", 5)
+        content.feed_data(b"456")
+        content.feed_data(b"", 2)
+
+        # Only padding is acknowledged before it's read.
+        assert acknowledged == [2]
+
+        assert await content.readany() == b"123"
+        assert acknowledged == [2, 5]
+
+        content.feed_eof()
+        assert await content.read() == b"456"
+        assert acknowledged == [2, 5, 3]
+
+    async def test_http2_response_release(self):
+        acknowledged = []
+        resets = []
+
+        content = Http2StreamContent(acknowledged.append)
+        response = Http2ClientResponse(
+            "GET", URL("http://example.org/test"), 200, [], content,
+            lambda: resets.append(True),
+        )
+
+        content.feed_data(b"123")
+        content.feed_data(b"456")
+
+        # The unread chunks are dropped and the stream is reset.
+        response.release()
+        assert acknowledged == [3, 3]
+        assert resets == [True]
+
+        content = Http2StreamContent(acknowledged.append)
+        response = Http2ClientResponse(
+            "GET", URL("http://example.org/test"), 200, [], content,
+            lambda: resets.append(True),
+        )
+
+        content.feed_data(b"123")
+        content.feed_eof()
+        assert await response.read() == b"123"
+
+        # A completely read response doesn't need a reset.
+        response.release()
+        assert resets == [True]
+
+    def test_http2_proxy(self, loop):
+        with pytest.raises(LocalProtocolError):
+            AsyncClient(
+                "https://example.org",
+                config=AsyncClientConfig(http2=True),
+                proxy="http://localhost:8080",
+            )
+
+    @pytest.mark.parametrize("http2", [False, True], ids=["http1", "http2"])
+    def test_concurrent_send_latency(self, benchmark, loop, tempdir, http2):
+        if http2:
+            server = H2TestServer(
+                delay=SERVER_DELAY, max_concurrent_streams=SEND_COUNT
+            )
+            loop.run_until_complete(server.start())
+            url = server.url
+        else:
+            server = loop.run_until_complete(_http11_server(SERVER_DELAY))
+            url = str(server.make_url("")).rstrip("/")
+
+        client = loop.run_until_complete(
+            _logged_in_client(url, tempdir, http2)
+        )
+        latencies = []
+
+        def send_all():
+            latencies[:] = loop.run_until_complete(
+                _timed_sends(client, SEND_COUNT)
+            )
+
+        benchmark.pedantic(send_all, rounds=3)
+
+        latencies.sort()
+        benchmark.extra_info["mean_latency"] = sum(latencies) / len(latencies)
+        benchmark.extra_info["p99_latency"] = latencies[
+            int(len(latencies) * 0.99) - 1
+        ]
+
+        loop.run_until_complete(client.close())
+        loop.run_until_complete(server.close())
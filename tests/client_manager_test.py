@@ -0,0 +1,184 @@
+import asyncio
+import re
+
+import pytest
+from aioresponses import CallbackResult
+
+from helpers import synthetic_sync
+from nio import (AsyncClientConfig, AsyncClientManager, LocalProtocolError,
+                 LoginResponse, SyncMetrics)
+
+ALICE_ID = "@alice:example.org"
+BOB_ID = "@bob:example.org"
+
+
+class TestClass(object):
+    async def test_manager_sync(self, aioresponse):
+        manager = AsyncClientManager(
+            "https://example.org",
+            AsyncClientConfig(max_timeouts=3),
+            max_concurrent_syncs=1,
+            stagger=0,
+        )
+
+        alice = manager.add_client(ALICE_ID)
+        bob = manager.add_client(BOB_ID)
+
+        with pytest.raises(LocalProtocolError):
+            manager.add_client(ALICE_ID)
+
+        assert alice.client_session is bob.client_session
+
+        await alice.receive_response(
+            LoginResponse(ALICE_ID, "ALICEDEVICE", "alice_token")
+        )
+        await bob.receive_response(
+            LoginResponse(BOB_ID, "BOBDEVICE", "bob_token")
+        )
+
+        tokens = []
+        done = asyncio.Event()
+
+        def sync_cb(url, **kwargs):
+            tokens.append(url.query["access_token"])
+
+            if len(tokens) == 4:
+                done.set()
+
+            return CallbackResult(status=200, payload=synthetic_sync(1, 3))
+
+        aioresponse.get(
+            re.compile(r"^https://example\.org/_matrix/client/r0/sync\?.*"),
+            callback=sync_cb,
+            repeat=True,
+        )
+
+        task = asyncio.ensure_future(manager.run())
+        await asyncio.wait_for(done.wait(), 5)
+        task.cancel()
+        await task
+
+        # A single sync worker syncs the accounts in turn.
+        assert tokens[:4] == [
+            "alice_token", "bob_token", "alice_token", "bob_token"
+        ]
+        assert manager.active_syncs == 0
+
+        metrics = manager.metrics
+        assert metrics[ALICE_ID].syncs == 2
+        assert metrics[BOB_ID].syncs >= 1
+        assert metrics[ALICE_ID].events > 0
+
+        total = manager.aggregate_metrics()
+        assert isinstance(total, SyncMetrics)
+        assert total.syncs == metrics[ALICE_ID].syncs + metrics[BOB_ID].syncs
+        assert total.events == (
+            metrics[ALICE_ID].events + metrics[BOB_ID].events
+        )
+
+        assert manager.remove_client(BOB_ID) is bob
+        assert list(manager.clients) == [ALICE_ID]
+
+        await manager.close()
+        assert alice.client_session.closed
+
+    async def test_manager_initial_sync(self, aioresponse):
+        manager = AsyncClientManager(
+            "https://example.org",
+            AsyncClientConfig(max_timeouts=3),
+            max_concurrent_syncs=1,
+            stagger=0,
+            error_delay=0,
+        )
+
+        alice = manager.add_client(ALICE_ID, since="s1", full_state=True)
+        await alice.receive_response(
+            LoginResponse(ALICE_ID, "ALICEDEVICE", "alice_token")
+        )
+
+        queries = []
+        done = asyncio.Event()
+
+        def sync_cb(url, **kwargs):
+            queries.append(url.query)
+
+            if len(queries) == 1:
+                return CallbackResult(status=400, payload={
+                    "errcode": "M_UNKNOWN", "error": "Try again",
+                })
+
+            if len(queries) == 3:
+                done.set()
+
+            return CallbackResult(status=200, payload=synthetic_sync(1, 3))
+
+        aioresponse.get(
+            re.compile(r"^https://example\.org/_matrix/client/r0/sync\?.*"),
+            callback=sync_cb,
+            repeat=True,
+        )
+
+        task = asyncio.ensure_future(manager.run())
+        await asyncio.wait_for(done.wait(), 5)
+        task.cancel()
+        await task
+
+        # The failed sync is retried with the initial sync settings.
+        assert [q.get("since") for q in queries[:2]] == ["s1", "s1"]
+        assert [q.get("full_state") for q in queries[:2]] == ["true", "true"]
+        assert queries[2]["since"] == alice.next_batch
+        assert "full_state" not in queries[2]
+
+        # The syncs long-poll by default.
+        assert all(q["timeout"] == "30000" for q in queries)
+
+        metrics = manager.metrics[ALICE_ID]
+        assert metrics.errors == 1
+        assert metrics.events == 3
+
+        await manager.close()
+
+    async def test_manager_readd_client(self):
+        manager = AsyncClientManager(
+            "https://example.org",
+            max_concurrent_syncs=2,
+            stagger=0,
+            error_delay=60,
+        )
+
+        first = manager.add_client(ALICE_ID)
+
+        task = asyncio.ensure_future(manager.run())
+        await asyncio.sleep(0)
+
+        # The account is queued but the workers didn't take it yet, the
+        # entry is bound to the removed registration.
+        assert manager.queued == 1
+        assert manager.remove_client(ALICE_ID) is first
+        second = manager.add_client(ALICE_ID)
+        assert manager.queued == 2
+
+        await asyncio.sleep(0.1)
+
+        # The stale entry is dropped, the new account isn't logged in and
+        # waits for a single turn.
+        account = manager._accounts[ALICE_ID]
+        assert account.client is second
+        assert manager.queued == 0
+        assert not account.queued
+        assert account.timer
+
+        # Queuing the account again doesn't add a second entry.
+        manager._requeue(account)
+        manager._requeue(account)
+        assert manager.queued == 1
+        assert not account.timer
+
+        manager._requeue(account, 60)
+        assert manager.remove_client(ALICE_ID) is second
+        assert not account.timer
+
+        task.cancel()
+        await task
+
+        await manager.close()
@@ -18,7 +18,8 @@ from nio import (Client, DeviceList, DeviceOneTimeKeyCount, DownloadResponse,
                  RoomSummary, RoomTypingResponse, RoomRedactResponse,
                  ShareGroupSessionResponse, SyncResponse,
                  Timeline, ThumbnailResponse, TransportType, TypingNoticeEvent,
-                 InviteMemberEvent, InviteInfo, ClientConfig)
+                 InviteMemberEvent, InviteInfo, ClientConfig, LazyEvent,
+                 RoomMessageText, BadEvent)
 from nio.event_builders import ToDeviceMessage
 
 HOST = "example.org"
@@ -741,6 +742,100 @@ class TestClass(object):
         assert isinstance(response, SyncResponse)
         assert http_client.access_token == "ABCD"
 
+    def test_http_client_sampled_sync(self, tempdir):
+        http_client = HttpClient(
+            "example.org",
+            "ephemeral",
+            "DEVICEID",
+            tempdir,
+            ClientConfig(event_validation_sample_rate=0.0)
+        )
+        http_client.connect(TransportType.HTTP2)
+
+        _, _ = http_client.login("1234")
+        http_client.receive(self.login_byte_response)
+        http_client.next_response()
+
+        _, _ = http_client.sync()
+        http_client.receive(self.sync_byte_response)
+        response = http_client.next_response()
+
+        assert isinstance(response, SyncResponse)
+        assert http_client.validation_sampler.skipped > 0
+
+    def test_http_client_lazy_sync(self, tempdir, synced_client):
+        http_client = HttpClient(
+            "example.org",
+            "ephemeral",
+            "DEVICEID",
+            tempdir,
+            ClientConfig(lazy_events=True)
+        )
+        http_client.connect(TransportType.HTTP2)
+
+        _, _ = http_client.login("1234")
+        http_client.receive(self.login_byte_response)
+        http_client.next_response()
+
+        _, _ = http_client.sync()
+        http_client.receive(self.sync_byte_response)
+        response = http_client.next_response()
+
+        assert isinstance(response, SyncResponse)
+
+        assert http_client.rooms.keys() == synced_client.rooms.keys()
+
+        for room_id, room in synced_client.rooms.items():
+            lazy_room = http_client.rooms[room_id]
+            assert lazy_room.display_name == room.display_name
+            assert lazy_room.users.keys() == room.users.keys()
+            assert lazy_room.encrypted == room.encrypted
+
+    def test_http_client_callback_events_only(self, tempdir, synced_client):
+        http_client = HttpClient(
+            "example.org",
+            "ephemeral",
+            "DEVICEID",
+            tempdir,
+            ClientConfig(parse_callback_events_only=True)
+        )
+        http_client.connect(TransportType.HTTP2)
+
+        messages = []
+        http_client.add_event_callback(
+            lambda room, event: messages.append(event),
+            RoomMessageText
+        )
+
+        _, _ = http_client.login("1234")
+        http_client.receive(self.login_byte_response)
+        http_client.next_response()
+
+        _, _ = http_client.sync()
+        http_client.receive(self.sync_byte_response)
+        response = http_client.next_response()
+
+        assert isinstance(response, SyncResponse)
+
+        room_id = "!SVkFJHzfwvuaIEawgC:localhost"
+        join_info = response.rooms.join[room_id]
+        assert [type(e) for e in join_info.timeline.events] == [
+            RoomMessageText
+        ]
+        assert messages == join_info.timeline.events
+
+        unknown = [e for e in join_info.state if type(e) is LazyEvent]
+        assert [e.source["type"] for e in unknown] == ["m.room.aliases"]
+
+        room = http_client.rooms[room_id]
+        synced_room = synced_client.rooms[room_id]
+        assert room.users.keys() == synced_room.users.keys()
+        assert room.canonical_alias == synced_room.canonical_alias
+        assert room.topic == synced_room.topic
+
+        http_client.add_event_callback(lambda room, event: None, BadEvent)
+        assert http_client._lazy_events() is False
+
     def test_http_client_keys_query(self, http_client):
         http_client.connect(TransportType.HTTP2)
 
@@ -1011,6 +1106,158 @@ class TestClass(object):
         with pytest.raises(CallbackException):
             client.receive_response(self.sync_response)
 
+    def test_event_callback_index(self, client):
+        def member_cb(room, event):
+            pass
+
+        def any_cb(room, event):
+            pass
+
+        client.add_event_callback(member_cb, RoomMemberEvent)
+
+        member_event = self.sync_response.rooms.join[
+            TEST_ROOM_ID
+        ].timeline.events[0]
+        callbacks = client.event_callbacks
+
+        assert [cb.func for cb in callbacks.matching(member_event)] == [
+            member_cb
+        ]
+
+        client.add_event_callback(any_cb, None)
+        assert [cb.func for cb in callbacks.matching(member_event)] == [
+            member_cb, any_cb
+        ]
+
+        callbacks.remove(callbacks[0])
+        assert [cb.func for cb in callbacks.matching(member_event)] == [
+            any_cb
+        ]
+
+        lazy_event = LazyEvent({
+            "type": "m.room.member",
+            "event_id": "$event_id_4",
+            "sender": ALICE_ID,
+            "origin_server_ts": 1516809890615,
+            "state_key": ALICE_ID,
+            "content": {"membership": "join"},
+        })
+        client.add_event_callback(member_cb, RoomMemberEvent)
+        assert [cb.func for cb in callbacks.matching(lazy_event)] == [
+            any_cb, member_cb
+        ]
+        assert not lazy_event.parsed
+
+    def test_event_callback_scope(self, client):
+        client.receive_response(self.login_response)
+
+        calls = []
+
+        def callback(name):
+            return lambda room, event: calls.append(
+                (name, room.room_id, event.event_id)
+            )
+
+        client.add_event_callback(callback("room"), RoomMemberEvent,
+                                  room_id=TEST_ROOM_ID)
+        client.add_event_callback(callback("other room"), None,
+                                  room_id="!other:example.org")
+        client.add_event_callback(callback("alice"), None, sender=ALICE_ID)
+        client.add_event_callback(callback("bob"), None, sender=BOB_ID)
+        client.add_event_callback(callback("text"), None, msgtype="m.text")
+        client.add_event_callback(callback("alice in room"), None,
+                                  room_id=TEST_ROOM_ID, sender=ALICE_ID)
+
+        client.receive_response(self.sync_response)
+
+        assert calls == [
+            ("room", TEST_ROOM_ID, "event_id_1"),
+            ("alice", TEST_ROOM_ID, "event_id_1"),
+            ("alice in room", TEST_ROOM_ID, "event_id_1"),
+            ("room", TEST_ROOM_ID, "event_id_2"),
+            ("alice", TEST_ROOM_ID, "event_id_2"),
+            ("alice in room", TEST_ROOM_ID, "event_id_2"),
+            ("alice", TEST_ROOM_ID, "event_id_3"),
+            ("alice in room", TEST_ROOM_ID, "event_id_3"),
+        ]
+
+        message = RoomMessageText.from_dict({
+            "type": "m.room.message",
+            "event_id": "$event_id_4",
+            "sender": BOB_ID,
+            "origin_server_ts": 1516809890615,
+            "content": {"msgtype": "m.text", "body": "hello"},
+        })
+
+        assert [
+            cb.func for cb in client.event_callbacks.matching(
+                message, "!other:example.org"
+            )
+        ] == [
+            client.event_callbacks[1].func,
+            client.event_callbacks[3].func,
+            client.event_callbacks[4].func,
+        ]
+
+        # Unvalidated values of lazy events don't break the lookup.
+        malformed = LazyEvent({
+            "type": "m.room.message",
+            "event_id": "$event_id_5",
+            "sender": [BOB_ID],
+            "origin_server_ts": 1516809890615,
+            "content": {"msgtype": {"m.text": True}, "body": "hello"},
+        })
+
+        assert [
+            cb.func for cb in client.event_callbacks.matching(
+                malformed, "!other:example.org"
+            )
+        ] == [client.event_callbacks[1].func]
+
+    def test_lazy_bad_member_event(self, client):
+        client.receive_response(self.login_response)
+
+        def member_event(event_id, state_key=None):
+            source = {
+                "type": "m.room.member",
+                "event_id": event_id,
+                "sender": ALICE_ID,
+                "origin_server_ts": 1516809890615,
+                "content": {"membership": "join"},
+            }
+
+            if state_key:
+                source["state_key"] = state_key
+
+            return LazyEvent(source)
+
+        bad_state = member_event("$bad_state")
+        bad_timeline = member_event("$bad_timeline")
+        assert isinstance(bad_state, RoomMemberEvent)
+
+        timeline = Timeline(
+            [bad_timeline, member_event("$alice", ALICE_ID)],
+            False,
+            "prev_batch_token"
+        )
+        rooms = Rooms(
+            {},
+            {TEST_ROOM_ID: RoomInfo(timeline, [bad_state], [], [])},
+            {}
+        )
+
+        client.receive_response(SyncResponse(
+            "token123",
+            rooms,
+            DeviceOneTimeKeyCount(49, 50),
+            DeviceList([], []),
+            []
+        ))
+
+        assert isinstance(bad_state.resolve(), BadEvent)
+        assert isinstance(bad_timeline.resolve(), BadEvent)
+        assert list(client.rooms[TEST_ROOM_ID].users) == [ALICE_ID]
+
     def test_to_device_cb(self, client):
         client.receive_response(self.login_response)
 
@@ -1157,3 +1404,27 @@ class TestClass(object):
         client = Client(user, device_id, path, config=config)
         client.receive_response(self.login_response)
         assert client.loaded_sync_token
+
+    def test_room_state_restoring(self, client):
+        user = client.user_id
+        device_id = client.device_id
+        path = client.store_path
+        del client
+
+        config = ClientConfig(store_sync_tokens=True, store_room_state=True)
+        client = Client(user, device_id, path, config=config)
+
+        client.receive_response(self.login_response)
+        client.receive_response(self.sync_response)
+        room = client.rooms[TEST_ROOM_ID]
+
+        client = Client(user, device_id, path, config=config)
+        client.receive_response(self.login_response)
+        assert client.loaded_sync_token
+
+        restored = client.rooms[TEST_ROOM_ID]
+        assert restored.encrypted
+        assert restored.summary == room.summary
+        assert restored.member_loader
+        assert set(restored.users) == set(room.users)
+        assert set(restored.invited_users) == {CAROL_ID}
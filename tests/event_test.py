@@ -2,8 +2,13 @@
 
 from __future__ import unicode_literals
 
+import copy
 import json
 import pdb
+import tracemalloc
+
+import attr
+import pytest
 
 from nio.events import (BadEvent, OlmEvent, PowerLevelsEvent, RedactedEvent,
                         RedactionEvent, RoomAliasEvent, RoomCreateEvent,
@@ -21,7 +26,9 @@ from nio.events import (BadEvent, OlmEvent, PowerLevelsEvent, RedactedEvent,
                         CallCandidatesEvent, KeyVerificationStart,
                         KeyVerificationAccept, KeyVerificationCancel,
                         KeyVerificationKey, KeyVerificationMac, TagEvent,
-                        DummyEvent, RoomKeyRequest, RoomKeyRequestCancellation)
+                        DummyEvent, RoomKeyRequest, RoomKeyRequestCancellation,
+                        RoomMessage, UnknownEvent, ValidationSampler,
+                        LazyEvent)
 
 
 class TestClass(object):
@@ -417,3 +424,179 @@ class TestClass(object):
         event = ToDeviceEvent.parse_event(parsed_dict)
 
         assert isinstance(event, RoomKeyRequestCancellation)
+
+    def test_custom_event_type(self):
+        @attr.s
+        class PollEvent(Event):
+            question = attr.ib()
+
+            @classmethod
+            def from_dict(cls, parsed_dict):
+                return cls(parsed_dict, parsed_dict["content"]["question"])
+
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/message_text.json")
+        parsed_dict["type"] = "org.example.poll"
+        parsed_dict["content"] = {"question": "Lunch?"}
+
+        assert isinstance(Event.parse_event(parsed_dict), UnknownEvent)
+
+        Event.register_event_type("org.example.poll", PollEvent)
+
+        try:
+            event = Event.parse_event(parsed_dict)
+        finally:
+            del Event._event_parsers["org.example.poll"]
+
+        assert isinstance(event, PollEvent)
+        assert event.question == "Lunch?"
+
+    def test_custom_msgtype(self):
+        @attr.s
+        class LocationMessage(RoomMessage):
+            geo_uri = attr.ib()
+
+            @classmethod
+            def from_dict(cls, parsed_dict):
+                return cls(parsed_dict, parsed_dict["content"]["geo_uri"])
+
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/message_text.json")
+        parsed_dict["content"] = {
+            "msgtype": "m.location",
+            "body": "Here",
+            "geo_uri": "geo:0,0",
+        }
+
+        RoomMessage.register_msgtype("m.location", LocationMessage)
+
+        try:
+            event = Event.parse_event(parsed_dict)
+        finally:
+            del RoomMessage._msgtype_classes["m.location"]
+
+        assert isinstance(event, LocationMessage)
+        assert event.geo_uri == "geo:0,0"
+
+    def test_custom_to_device_event_type(self):
+        @attr.s
+        class PingEvent(ToDeviceEvent):
+            @classmethod
+            def from_dict(cls, parsed_dict):
+                return cls(parsed_dict, parsed_dict["sender"])
+
+        parsed_dict = {
+            "sender": "@alice:example.org",
+            "type": "org.example.ping",
+            "content": {"ping": True},
+        }
+
+        assert ToDeviceEvent.parse_event(parsed_dict) is None
+
+        ToDeviceEvent.register_event_type("org.example.ping", PingEvent)
+
+        try:
+            event = ToDeviceEvent.parse_event(parsed_dict)
+        finally:
+            del ToDeviceEvent._event_parsers["org.example.ping"]
+
+        assert isinstance(event, PingEvent)
+
+    def test_class_for_event(self):
+        for filename in ("message_text.json", "megolm.json", "member.json",
+                         "redacted.json", "name.json", "call_invite.json"):
+            parsed_dict = TestClass._load_response(
+                "tests/data/events/{}".format(filename))
+
+            event_class = Event.class_for_event(parsed_dict)
+            assert type(Event.parse_event(parsed_dict)) is event_class
+
+        assert Event.class_for_event({"type": "org.example"}) is UnknownEvent
+        assert Event.class_for_event(None) is UnknownBadEvent
+
+    def test_lazy_event(self):
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/message_text.json")
+        event = LazyEvent(parsed_dict)
+
+        assert isinstance(event, LazyEvent)
+        assert isinstance(event, RoomMessageText)
+        assert event.sender == parsed_dict["sender"]
+        assert not event.parsed
+
+        assert event.body == parsed_dict["content"]["body"]
+        assert event.parsed
+
+        event.decrypted = True
+        assert event.resolve().decrypted
+
+        assert copy.copy(event) == event
+        assert type(copy.copy(event)) is RoomMessageText
+
+    def test_event_dispatch(self, benchmark):
+        # A rough mix of the event types found in a busy room.
+        mix = [
+            ("message_text.json", 60),
+            ("megolm.json", 20),
+            ("member.json", 8),
+            ("redaction.json", 4),
+            ("message_notice.json", 3),
+            ("message_emote.json", 2),
+            ("name.json", 1),
+            ("power_levels.json", 1),
+            ("topic.json", 1),
+        ]
+        events = []
+
+        for filename, count in mix:
+            events.extend([TestClass._load_response(
+                "tests/data/events/{}".format(filename)
+            )] * count)
+
+        # Skip the validation so the dispatch and object creation cost is
+        # measured.
+        sampler = ValidationSampler(0.0)
+
+        def parse_events(events):
+            return [sampler.parse(Event.parse_event, e) for e in events]
+
+        # Some events get modified while they are parsed, so every round
+        # needs fresh copies.
+        def setup():
+            return ([copy.deepcopy(e) for e in events], ), {}
+
+        parsed = benchmark.pedantic(parse_events, setup=setup, rounds=100)
+
+        assert not any(isinstance(e, (BadEvent, UnknownEvent)) for e in parsed)
+
+    @pytest.mark.parametrize("filename", [
+        "message_text.json",
+        "member.json",
+        "megolm.json",
+        "redaction.json",
+        "name.json",
+    ])
+    def test_event_memory(self, benchmark, filename):
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/{}".format(filename))
+        count = 1000
+        sources = [copy.deepcopy(parsed_dict) for _ in range(count)]
+
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        events = [Event.parse_event(source) for source in sources]
+        size = tracemalloc.get_traced_memory()[0] - start
+        tracemalloc.stop()
+
+        # Only the event objects are counted, the source dictionaries are
+        # allocated beforehand.
+        benchmark.extra_info["bytes_per_event"] = size // count
+
+        event = benchmark.pedantic(
+            Event.parse_event,
+            setup=lambda: ((copy.deepcopy(parsed_dict), ), {}),
+            rounds=100
+        )
+
+        assert type(event) is type(events[0])
+        assert not hasattr(event, "__dict__")
@@ -6,10 +6,18 @@ helpers
 This module contains helpers for the nio tests.
 """
 
+import asyncio
+import copy
+import json
 import os
 from random import choice
 from string import ascii_letters, ascii_uppercase
+from urllib.parse import urlsplit
 
+import h2.config
+import h2.connection
+import h2.events
+import h2.settings
 from faker import Faker
 from faker.providers import BaseProvider
 from hpack.hpack import Encoder
@@ -231,3 +239,175 @@ class FrameFactory(object):
         f.origin = origin
         f.field = field
         return f
+
+
+def synthetic_sync(room_count=10, events_per_room=100):
+    """Build a large sync response dictionary for benchmarks.
+
+    The state of every room is taken from the sync response in the test data
+    while the timeline is filled with generated text messages.
+    """
+    with open(os.path.join(os.curdir, "tests/data/sync.json")) as f:
+        template = json.load(f)
+
+    room_template = next(iter(template["rooms"]["join"].values()))
+    senders = [faker.mx_id() for _ in range(20)]
+
+    rooms = {}
+
+    for room_number in range(room_count):
+        room = copy.deepcopy(room_template)
+        room["timeline"]["events"] = [
+            {
+                "content": {
+                    "body": faker.sentence(),
+                    "msgtype": "m.text",
+                },
+                "event_id": "${}_{}:example.org".format(room_number, i),
+                "origin_server_ts": 1516809890615 + i,
+                "sender": senders[i % len(senders)],
+                "type": "m.room.message",
+                "unsigned": {"age": 43289803095},
+            }
+            for i in range(events_per_room)
+        ]
+        rooms["!room{}:example.org".format(room_number)] = room
+
+    template["rooms"]["join"] = rooms
+
+    return template
+
+
+class H2TestServer(object):
+    """A minimal local HTTP/2 server for the tests.
+
+    The server speaks HTTP/2 with prior knowledge over plain TCP and answers
+    every request with a JSON body, by default one containing an event id
+    like the send endpoints of a homeserver do.
+
+    Args:
+        handler (Callable, optional): A function that gets the method, path
+            and body of a request and returns the status and the JSON
+            response dictionary.
+        delay (float): Seconds every response is delayed by, to simulate
+            the processing time of a server.
+        max_concurrent_streams (int): The number of streams a client may
+            open concurrently.
+    """
+
+    def __init__(self, handler=None, delay=0.0, max_concurrent_streams=100):
+        self.handler = handler or self.send_handler
+        self.delay = delay
+        self.max_concurrent_streams = max_concurrent_streams
+        self.connections = 0
+        self.requests = []
+        self.port = None
+        self._server = None
+        self._writers = []
+        self._tasks = set()
+
+    @staticmethod
+    def send_handler(method, path, body):
+        tx_id = urlsplit(path).path.rsplit("/", 1)[-1]
+        return 200, {"event_id": "$" + tx_id}
+
+    def _track(self, task):
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.port)
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._accept, "127.0.0.1", 0
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        for writer in self._writers:
+            writer.close()
+
+        self._writers = []
+
+        # Cancel the connection handlers and the responses that are still
+        # delayed so no coroutine outlives the server.
+        for task in list(self._tasks):
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _accept(self, reader, writer):
+        self._track(asyncio.ensure_future(self._serve(reader, writer)))
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        self._writers.append(writer)
+
+        config = h2.config.H2Configuration(
+            client_side=False, header_encoding="utf-8"
+        )
+        connection = h2.connection.H2Connection(config=config)
+        connection.local_settings = h2.settings.Settings(
+            client=False,
+            initial_values={
+                h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS:
+                    self.max_concurrent_streams,
+            },
+        )
+        connection.initiate_connection()
+        writer.write(connection.data_to_send())
+
+        requests = {}
+
+        while True:
+            try:
+                data = await reader.read(65535)
+            except ConnectionError:
+                break
+
+            if not data:
+                break
+
+            for event in connection.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    requests[event.stream_id] = (dict(event.headers), [])
+
+                elif isinstance(event, h2.events.DataReceived):
+                    requests[event.stream_id][1].append(event.data)
+                    connection.acknowledge_received_data(
+                        event.flow_controlled_length, event.stream_id
+                    )
+
+                elif isinstance(event, h2.events.StreamEnded):
+                    headers, body = requests.pop(event.stream_id)
+                    self._track(asyncio.ensure_future(self._respond(
+                        connection, writer, event.stream_id, headers,
+                        b"".join(body)
+                    )))
+
+            writer.write(connection.data_to_send())
+
+    async def _respond(self, connection, writer, stream_id, headers, body):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        method, path = headers[":method"], headers[":path"]
+        self.requests.append((method, path, body))
+
+        status, payload = self.handler(method, path, body)
+        data = json.dumps(payload).encode("utf-8")
+
+        connection.send_headers(stream_id, [
+            (":status", str(status)),
+            ("content-type", "application/json"),
+            ("content-length", str(len(data))),
+        ])
+        connection.send_data(stream_id, data, end_stream=True)
+
+        if not writer.transport.is_closing():
+            writer.write(connection.data_to_send())
@@ -2,8 +2,12 @@
 
 from __future__ import unicode_literals
 
-from nio.client import HttpClient
+import pytest
+
+from nio.client import HttpClient, TransportType
+from nio.exceptions import LocalProtocolError
 from nio.http import TransportResponse
+from nio.responses import LoginResponse, ProfileGetResponse
 
 
 class TestClass(object):
@@ -13,6 +17,19 @@ class TestClass(object):
         with open(filename, "rb") as f:
             return f.read()
 
+    @staticmethod
+    def _http_response(filename):
+        with open(filename, "rb") as f:
+            body = f.read()
+
+        head = (
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: application/json\r\n"
+            "Content-Length: {}\r\n\r\n".format(len(body))
+        )
+
+        return head.encode("utf-8") + body
+
     def test_503(self):
         client = HttpClient("localhost", "example")
         client.connect()
@@ -30,3 +47,101 @@ class TestClass(object):
         client.receive(transport_response)
         response = client.next_response()
         assert response.status_code == 502
+
+    def test_large_body_receive(self, benchmark):
+        body = b"[" + b",".join([b'"' + b"a" * 1022 + b'"'] * 8192) + b"]"
+        head = (
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: application/json\r\n"
+            "Content-Length: {}\r\n\r\n".format(len(body))
+        ).encode("utf-8")
+        chunk_size = 16 * 1024
+        chunks = [head] + [
+            body[i:i + chunk_size] for i in range(0, len(body), chunk_size)
+        ]
+
+        def setup():
+            client = HttpClient("localhost", "example")
+            client.connect()
+            client.login("test")
+            return (client,), {}
+
+        def receive(client):
+            for chunk in chunks:
+                client.receive(chunk)
+
+            return client
+
+        client = benchmark.pedantic(receive, setup=setup, rounds=10)
+
+        _, response = client.parse_queue[0]
+        assert response.status_code == 200
+        assert response.content == body
+
+    def test_connection_pool(self):
+        client = HttpClient("localhost", "example")
+        client.connect(TransportType.HTTP, connections=3)
+
+        _, data = client.login("test")
+        assert data == b""
+        assert client.queue_depths == [0, 1, 0]
+
+        with pytest.raises(LocalProtocolError):
+            client.data_to_send()
+
+        assert client.data_to_send(1).startswith(b"POST ")
+
+        client.receive(
+            self._http_response("tests/data/login_response.json"), 1
+        )
+        assert isinstance(client.next_response(), LoginResponse)
+
+        # The long-poll gets the first connection, the other requests don't
+        # have to wait for it.
+        client.sync(timeout=30000)
+        profile_uuid, _ = client.get_profile()
+        assert client.queue_depths == [1, 1, 0]
+
+        assert client.data_to_send(0).startswith(
+            b"GET /_matrix/client/r0/sync"
+        )
+        assert client.data_to_send(1).startswith(
+            b"GET /_matrix/client/r0/profile"
+        )
+
+        client.receive(
+            self._http_response("tests/data/get_profile_response.json"), 1
+        )
+        response = client.next_response()
+        assert isinstance(response, ProfileGetResponse)
+        assert response.uuid == profile_uuid
+        assert client.queue_depths == [1, 0, 0]
+
+    @pytest.mark.parametrize("pipelining", [False, True])
+    def test_pipelining(self, pipelining):
+        client = HttpClient("localhost", "example")
+        client.connect(TransportType.HTTP, pipelining=pipelining)
+
+        client.login("test")
+        client.receive(self._http_response("tests/data/login_response.json"))
+        client.next_response()
+
+        first, data = client.get_profile()
+        assert data
+
+        second, data = client.get_profile()
+        assert bool(data) == pipelining
+        assert client.queue_depths == [2]
+
+        profile = self._http_response("tests/data/get_profile_response.json")
+
+        if pipelining:
+            client.receive(profile + profile)
+        else:
+            client.receive(profile)
+            assert client.data_to_send()
+            client.receive(profile)
+
+        uuids = [client.next_response().uuid, client.next_response().uuid]
+        assert uuids == [first, second]
+        assert client.queue_depths == [0]
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+from contextlib import contextmanager
+
+import pytest
+from hypothesis import given, settings
+from hypothesis.strategies import (booleans, dictionaries, floats, integers,
+                                   lists, none, recursive, text)
+
+from helpers import synthetic_sync
+from nio import _json
+from nio._compat import package_installed
+from nio.api import Api
+from nio.responses import SyncResponse
+
+BACKENDS = [
+    pytest.param(
+        name,
+        marks=pytest.mark.skipif(
+            name != "json" and not package_installed(name),
+            reason="{} isn't installed".format(name)
+        )
+    ) for name in _json.BACKENDS
+]
+
+
+def json_values(max_integer):
+    return recursive(
+        none() | booleans() | integers(-max_integer, max_integer) | text() |
+        floats(allow_nan=False, allow_infinity=False),
+        lambda children: lists(children, max_size=4) | dictionaries(
+            text(), children, max_size=4
+        ),
+        max_leaves=30,
+    )
+
+
+def canonical_json(value):
+    return json.dumps(
+        value,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        sort_keys=True,
+    )
+
+
+def stream(data, chunk_size, expand=((),)):
+    parser = _json.StreamParser(expand)
+    items = []
+
+    for i in range(0, len(data), chunk_size):
+        items.extend(parser.feed(data[i:i + chunk_size]))
+
+    items.extend(parser.close())
+
+    return items
+
+
+@contextmanager
+def json_backend(name):
+    previous = _json.backend
+    _json.use_json_backend(name)
+
+    try:
+        yield
+    finally:
+        _json.use_json_backend(previous)
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    with json_backend(request.param):
+        yield request.param
+
+
+class TestClass(object):
+    @pytest.mark.parametrize("name", BACKENDS)
+    @settings(max_examples=200, deadline=None)
+    @given(value=json_values(2 ** 70))
+    def test_canonical_json(self, name, value):
+        with json_backend(name):
+            assert Api.to_canonical_json(value) == canonical_json(value)
+
+    def test_canonical_json_surrogates(self, backend):
+        value = {"b": "\ud800", "a": [2 ** 64, 1.5]}
+        assert Api.to_canonical_json(value) == canonical_json(value)
+
+    @pytest.mark.parametrize("name", BACKENDS)
+    @settings(max_examples=200, deadline=None)
+    @given(value=json_values(2 ** 63 - 1))
+    def test_roundtrip(self, name, value):
+        with json_backend(name):
+            assert _json.loads(Api.to_json(value)) == value
+            assert _json.loads(Api.to_json(value).encode("utf-8")) == value
+
+    def test_invalid_json(self, backend):
+        for data in (b"", b"{", b"\xff", "[1,"):
+            with pytest.raises(ValueError):
+                _json.loads(data)
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            _json.use_json_backend("simplejson")
+
+    def test_sync_decode(self, benchmark, backend):
+        data = json.dumps(synthetic_sync(10, 100)).encode("utf-8")
+
+        parsed_dict = benchmark(_json.loads, data)
+        assert isinstance(SyncResponse.from_dict(parsed_dict), SyncResponse)
+
+    @settings(max_examples=200, deadline=None)
+    @given(
+        value=dictionaries(text(), json_values(2 ** 70), max_size=5),
+        chunk_size=integers(1, 64),
+    )
+    def test_stream_parser(self, value, chunk_size):
+        data = json.dumps(value, indent=1).encode("utf-8")
+        items = stream(data, chunk_size)
+
+        assert items == [((key,), value) for key, value in value.items()]
+
+    def test_stream_parser_nested(self):
+        with open("tests/data/sync.json", "rb") as f:
+            data = f.read()
+
+        expected = json.loads(data.decode("utf-8"))
+        room_id, room = next(iter(expected["rooms"]["join"].items()))
+
+        items = dict(stream(data, 3, [(), ("rooms",), ("rooms", "join")]))
+
+        assert items[("rooms", "join", room_id)] == room
+        assert items[("rooms", "invite")] == {}
+        assert items[("next_batch",)] == expected["next_batch"]
+        assert items[("to_device",)] == expected["to_device"]
+
+    def test_stream_parser_split_number(self):
+        for data in (b'{"a": 0.0}', b'{"a": 1e5}', b'{"a": -2.5E-3}'):
+            expected = [(("a",), json.loads(data.decode("utf-8"))["a"])]
+            assert stream(data, 1) == expected
+
+    def test_stream_parser_invalid(self):
+        for data in (b"", b"{", b'{"a" 1}', b'{"a": 1,}', b'{"a": 1}]',
+                     b'{"a": [1}', b"\xff"):
+            with pytest.raises(ValueError):
+                stream(data, 1)
+
+    def test_stream_parser_large_value(self):
+        value = "x" * 1000000
+        data = json.dumps({"a": value, "b": 1}).encode("utf-8")
+
+        parser = _json.StreamParser()
+        items = []
+        joins = 0
+
+        for i in range(0, len(data), 1024):
+            buffer = parser._buffer
+            items.extend(parser.feed(data[i:i + 1024]))
+            joins += parser._buffer is not buffer
+
+        items.extend(parser.close())
+
+        # The chunks of the string are only joined once the buffered data
+        # doubled in size, not for every chunk.
+        assert joins < 50
+        assert items == [(("a",), value), (("b",), 1)]
+
+    def test_stream_parser_error_position(self):
+        data = '{{"a": "{}", "b": 1 x}}'.format("x" * 100000).encode("utf-8")
+
+        with pytest.raises(ValueError, match="position {}".format(
+            data.index(b" x") + 1
+        )):
+            stream(data, 100)
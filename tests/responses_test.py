@@ -3,6 +3,9 @@
 from __future__ import unicode_literals
 
 import json
+import tracemalloc
+
+import pytest
 
 from nio.responses import (DeleteDevicesAuthResponse, DevicesResponse,
                            DownloadResponse, DownloadError,
@@ -18,9 +21,14 @@ from nio.responses import (DeleteDevicesAuthResponse, DevicesResponse,
                            RoomKeyRequestError, RoomKeyRequestResponse,
                            RoomLeaveResponse, RoomMessagesResponse,
                            RoomTypingResponse, SyncError,
-                           SyncResponse, ThumbnailResponse, ThumbnailError,
+                           SyncResponse, SyncResponseStream,
+                           ThumbnailResponse, ThumbnailError,
                            ToDeviceError, ToDeviceResponse,
+                           UploadFilterError, UploadFilterResponse,
                            UploadResponse, _ErrorWithRoomId, LoginInfoResponse)
+from helpers import synthetic_sync
+from nio.events import (BadEvent, LazyEvent, RoomMemberEvent,
+                        RoomMessageText, ValidationSampler)
 
 TEST_ROOM_ID = "!test:example.org"
 
@@ -78,6 +86,11 @@ class TestClass(object):
         response = KeysQueryResponse.from_dict(parsed_dict)
         assert isinstance(response, KeysQueryResponse)
 
+        for user_id, devices in response.device_keys.items():
+            for device_id, payload in devices.items():
+                assert payload["user_id"] is user_id
+                assert payload["device_id"] is device_id
+
     def test_keys_claim(self):
         parsed_dict = TestClass._load_response(
             "tests/data/keys_claim.json")
@@ -159,6 +172,273 @@ class TestClass(object):
         response = SyncResponse.from_dict(parsed_dict)
         assert type(response) == SyncResponse
 
+    def test_sync_sampled_validation(self):
+        parsed_dict = TestClass._load_response(
+            "tests/data/sync.json")
+        sampler = ValidationSampler(0.0)
+        response = SyncResponse.from_dict(parsed_dict, 0, sampler)
+        assert type(response) == SyncResponse
+
+        full_response = SyncResponse.from_dict(
+            TestClass._load_response("tests/data/sync.json")
+        )
+        room_id = "!SVkFJHzfwvuaIEawgC:localhost"
+        assert (
+            [type(e) for e in response.rooms.join[room_id].state]
+            == [type(e) for e in full_response.rooms.join[room_id].state]
+        )
+        # The create event relies on defaults that are set by the schema
+        # validation so it needs to be validated.
+        assert sampler.validated == sampler.fallbacks == 1
+        assert sampler.skipped > 0
+
+        sampler = ValidationSampler(1.0)
+        SyncResponse.from_dict(parsed_dict, 0, sampler)
+        assert sampler.skipped == 0
+        assert sampler.validated > 0
+
+    def test_sync_sampled_validation_fallback(self):
+        parsed_dict = TestClass._load_response(
+            "tests/data/sync.json")
+        room_id = "!SVkFJHzfwvuaIEawgC:localhost"
+        state = parsed_dict["rooms"]["join"][room_id]["state"]["events"]
+        member = next(e for e in state if e["type"] == "m.room.member")
+        del member["content"]
+
+        sampler = ValidationSampler(0.0)
+        response = SyncResponse.from_dict(parsed_dict, 0, sampler)
+
+        assert sampler.validated == sampler.fallbacks == 2
+        assert any(
+            isinstance(e, BadEvent) for e in response.rooms.join[room_id].state
+        )
+
+    def test_sync_lazy(self):
+        parsed_dict = TestClass._load_response(
+            "tests/data/sync.json")
+        room_id = "!SVkFJHzfwvuaIEawgC:localhost"
+
+        eager = SyncResponse.from_dict(
+            TestClass._load_response("tests/data/sync.json"))
+        response = SyncResponse.from_dict(parsed_dict, lazy=True)
+
+        assert isinstance(response, SyncResponse)
+
+        timeline = response.rooms.join[room_id].timeline.events
+        state = response.rooms.join[room_id].state
+
+        assert all(type(e) is LazyEvent for e in timeline + state)
+        assert not any(e.parsed for e in timeline + state)
+
+        assert any(isinstance(e, RoomMessageText) for e in timeline)
+        assert any(isinstance(e, RoomMemberEvent) for e in state)
+        assert [e.sender for e in timeline] == [
+            e.source["sender"] for e in timeline
+        ]
+        assert not any(e.parsed for e in timeline + state)
+
+        assert timeline == eager.rooms.join[room_id].timeline.events
+        assert state == eager.rooms.join[room_id].state
+        assert all(e.parsed for e in timeline + state)
+
+    def test_sync_lazy_bad_event(self):
+        parsed_dict = TestClass._load_response(
+            "tests/data/sync.json")
+        room_id = "!SVkFJHzfwvuaIEawgC:localhost"
+        state = parsed_dict["rooms"]["join"][room_id]["state"]["events"]
+        member = next(e for e in state if e["type"] == "m.room.member")
+        del member["content"]
+
+        sampler = ValidationSampler(0.0)
+        response = SyncResponse.from_dict(parsed_dict, 0, sampler, True)
+        event = next(
+            e for e in response.rooms.join[room_id].state
+            if e.source is member
+        )
+
+        assert isinstance(event, RoomMemberEvent)
+        assert sampler.validated == 0
+
+        assert event.sender == member["sender"]
+        assert isinstance(event.resolve(), BadEvent)
+        assert isinstance(event, BadEvent)
+        assert sampler.validated == sampler.fallbacks == 1
+
+    def test_sync_lazy_event_classes(self):
+        parsed_dict = TestClass._load_response(
+            "tests/data/sync.json")
+        room_id = "!SVkFJHzfwvuaIEawgC:localhost"
+
+        response = SyncResponse.from_dict(parsed_dict,
+                                          lazy=(RoomMemberEvent,))
+        join_info = response.rooms.join[room_id]
+
+        for event in join_info.state:
+            if event.source["type"] == "m.room.member":
+                assert type(event) is RoomMemberEvent
+            else:
+                assert type(event) is LazyEvent
+
+        assert all(type(e) is LazyEvent for e in join_info.timeline.events)
+
+    def test_sync_parse_lazy(self, benchmark):
+        parsed_dict = synthetic_sync(10, 100)
+        response = benchmark(SyncResponse.from_dict, parsed_dict, lazy=True)
+        assert isinstance(response, SyncResponse)
+
+    @staticmethod
+    def _stream_sync(data, chunk_size, stream=None):
+        stream = stream or SyncResponseStream()
+        parts = []
+
+        for i in range(0, len(data), chunk_size):
+            parts.extend(stream.feed(data[i:i + chunk_size]))
+
+        parts.extend(stream.close())
+
+        return stream.response, parts
+
+    @pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+    def test_sync_stream(self, chunk_size):
+        data = self._load_bytes("tests/data/sync.json")
+        expected = SyncResponse.from_dict(json.loads(data.decode("utf-8")))
+
+        response, parts = self._stream_sync(data, chunk_size)
+
+        assert isinstance(response, SyncResponse)
+        assert response.next_batch == expected.next_batch
+        assert response.device_key_count == expected.device_key_count
+        assert response.device_list == expected.device_list
+
+        # The to-device events come first, even though the test data sends
+        # them after the rooms.
+        assert parts[0].to_device_events == expected.to_device_events
+        assert not parts[0].rooms.join
+
+        joined = {}
+
+        for part in parts[1:]:
+            assert not part.to_device_events
+            joined.update(part.rooms.join)
+
+        assert joined == expected.rooms.join
+
+    def test_sync_stream_max_events(self):
+        data = self._load_bytes("tests/data/sync.json")
+        expected = SyncResponse.from_dict(json.loads(data.decode("utf-8")))
+        room_id, info = next(iter(expected.rooms.join.items()))
+
+        response, parts = self._stream_sync(
+            data, 4096, SyncResponseStream(max_events=1)
+        )
+        assert isinstance(response, SyncResponse)
+
+        part = next(part for part in parts if room_id in part.rooms.join)
+        assert isinstance(part, PartialSyncResponse)
+
+        events = []
+
+        while True:
+            join_info = part.rooms.join[room_id]
+            events.extend(join_info.state + join_info.timeline.events)
+            assert len(join_info.state + join_info.timeline.events) <= 1
+
+            if not isinstance(part, PartialSyncResponse):
+                break
+
+            part = part.next_part(1)
+
+        assert events == info.state + info.timeline.events
+
+    def test_sync_stream_error(self):
+        data = self._load_bytes("tests/data/sync.json")
+
+        response, parts = self._stream_sync(data[:-10], 4096)
+        assert isinstance(response, SyncError)
+
+        parsed_dict = json.loads(data.decode("utf-8"))
+        parsed_dict["to_device"] = {}
+        response, parts = self._stream_sync(
+            json.dumps(parsed_dict).encode("utf-8"), 4096
+        )
+        assert isinstance(response, SyncError)
+        assert not parts
+
+        parsed_dict = synthetic_sync(2, 1)
+        parsed_dict["rooms"]["join"]["not a room id"] = {}
+        response, parts = self._stream_sync(
+            json.dumps(parsed_dict).encode("utf-8"), 4096
+        )
+        assert isinstance(response, SyncError)
+
+        parsed_dict = synthetic_sync(2, 1)
+        parsed_dict["rooms"]["invite"] = []
+        response, parts = self._stream_sync(
+            json.dumps(parsed_dict).encode("utf-8"), 4096
+        )
+        assert isinstance(response, SyncError)
+
+    def test_sync_stream_max_pending_rooms(self):
+        parsed_dict = synthetic_sync(3, 1)
+        parsed_dict["to_device"] = parsed_dict.pop("to_device")
+        data = json.dumps(parsed_dict).encode("utf-8")
+
+        response, parts = self._stream_sync(
+            data, 4096, SyncResponseStream(max_pending_rooms=1)
+        )
+        assert isinstance(response, SyncResponse)
+
+        # Only the last room waited for the to-device events.
+        assert [list(part.rooms.join) for part in parts] == [
+            ["!room0:example.org"],
+            ["!room1:example.org"],
+            [],
+            ["!room2:example.org"],
+        ]
+
+    def test_sync_stream_memory(self, benchmark):
+        parsed_dict = synthetic_sync(100, 200)
+        # Servers send the to-device events before the rooms, otherwise the
+        # rooms need to be held back until the to-device events arrive.
+        parsed_dict = dict(
+            [("to_device", parsed_dict.pop("to_device"))],
+            **parsed_dict
+        )
+        data = json.dumps(parsed_dict).encode("utf-8")
+        sampler = ValidationSampler(0.0)
+
+        def parse_whole():
+            return SyncResponse.from_dict(
+                json.loads(data.decode("utf-8")),
+                sampler=sampler
+            )
+
+        def parse_stream():
+            stream = SyncResponseStream(sampler)
+            for i in range(0, len(data), 65536):
+                stream.feed(data[i:i + 65536])
+            stream.close()
+            return stream.response
+
+        def peak(function):
+            tracemalloc.start()
+            try:
+                function()
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        whole = peak(parse_whole)
+        streamed = peak(parse_stream)
+
+        response = benchmark(parse_stream)
+
+        benchmark.extra_info["peak_bytes"] = streamed
+        benchmark.extra_info["peak_bytes_whole"] = whole
+
+        assert isinstance(response, SyncResponse)
+        assert streamed * 5 < whole
+
     def test_keyshare_request(self):
         parsed_dict = {
             "errcode": "M_LIMIT_EXCEEDED",
@@ -273,6 +553,14 @@ class TestClass(object):
         response = RoomCreateResponse.from_dict(parsed_dict)
         assert isinstance(response, RoomCreateResponse)
 
+    def test_upload_filter(self):
+        response = UploadFilterResponse.from_dict({"filter_id": "10"})
+        assert isinstance(response, UploadFilterResponse)
+        assert response.filter_id == "10"
+
+        response = UploadFilterResponse.from_dict({})
+        assert isinstance(response, UploadFilterError)
+
     def test_join(self):
         parsed_dict = TestClass._load_response(
             "tests/data/room_id.json")
@@ -1,10 +1,16 @@
+import json
+import tracemalloc
+
 import pytest
 
+import nio.events.room_events
+import nio.rooms
 from helpers import faker
-from nio.events import (InviteAliasEvent, InviteMemberEvent, InviteNameEvent,
-                        RoomCreateEvent, RoomGuestAccessEvent,
-                        RoomHistoryVisibilityEvent, RoomJoinRulesEvent,
-                        RoomMemberEvent, RoomNameEvent, TypingNoticeEvent)
+from nio.events import (Event, InviteAliasEvent, InviteMemberEvent,
+                        InviteNameEvent, RoomCreateEvent,
+                        RoomGuestAccessEvent, RoomHistoryVisibilityEvent,
+                        RoomJoinRulesEvent, RoomMemberEvent, RoomNameEvent,
+                        TypingNoticeEvent, ValidationSampler)
 from nio.responses import RoomSummary
 from nio.rooms import MatrixInvitedRoom, MatrixRoom
 
@@ -12,6 +18,55 @@ TEST_ROOM = "!test:example.org"
 BOB_ID = "@bob:example.org"
 ALICE_ID = "@alice:example.org"
 
+
+def load_large_room(member_count):
+    members = [{
+        "content": {
+            "avatar_url": None,
+            "displayname": "User {}".format(i),
+            "membership": "join"
+        },
+        "event_id": "$event{}:example.org".format(i),
+        "origin_server_ts": 1518001405556,
+        "sender": "@user{}:example.org".format(i),
+        "state_key": "@user{}:example.org".format(i),
+        "type": "m.room.member",
+    } for i in range(member_count)]
+    messages = [{
+        "content": {"body": "Hello", "msgtype": "m.text"},
+        "event_id": "$message{}:example.org".format(i),
+        "origin_server_ts": 1518001405556,
+        "sender": "@user{}:example.org".format(i),
+        "type": "m.room.message",
+    } for i in range(member_count)]
+
+    # Decode the events from JSON so that every string is a separate object,
+    # like in a sync response.
+    state_events, timeline_events = json.loads(
+        json.dumps([members, messages])
+    )
+    del members, messages
+
+    # Skip the validation to keep the benchmark fast.
+    sampler = ValidationSampler(0.0)
+    room = MatrixRoom(TEST_ROOM, BOB_ID)
+    state = [sampler.parse(Event.parse_event, e) for e in state_events]
+    timeline = [sampler.parse(Event.parse_event, e) for e in timeline_events]
+
+    for event in state:
+        room.handle_membership(event)
+
+    return room, state, timeline
+
+
+def retained_memory(function, *args):
+    tracemalloc.start()
+    result = function(*args)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return result, size
+
 class TestClass(object):
     def _create_test_data(self):
         pass
@@ -218,6 +273,23 @@ class TestClass(object):
         assert room.member_count == 4
         assert room.summary.heroes == ["@alice:example.org"]
 
+    def test_lazy_loaded_members(self):
+        room = self.test_room
+        room.add_member(ALICE_ID, "Alice", None)
+        room.update_summary(
+            RoomSummary(0, 4, [ALICE_ID, "@malory:example.org"])
+        )
+
+        assert not room.members_synced
+        assert room.member_count == 4
+        assert room.display_name == "Alice and 2 others"
+
+        room.update_summary(RoomSummary(0, 3, []))
+        assert room.display_name == "Alice and @malory:example.org"
+
+        room.members_loaded = True
+        assert room.members_synced
+
     def test_invited_room(self):
         room = MatrixInvitedRoom(TEST_ROOM, BOB_ID)
         room.handle_event(InviteMemberEvent(
@@ -312,3 +384,30 @@ class TestClass(object):
         room.handle_membership(leaves_event)
         assert not room.users
         assert not room.invited_users
+
+    def test_large_room_memory(self, benchmark, monkeypatch):
+        member_count = 50000
+
+        (room, _, _), interned = retained_memory(
+            load_large_room,
+            member_count
+        )
+        assert room.member_count == member_count
+        del room
+
+        monkeypatch.setattr(nio.rooms, "intern_string", lambda s: s)
+        monkeypatch.setattr(
+            nio.events.room_events,
+            "intern_string",
+            lambda s: s
+        )
+        _, plain = retained_memory(load_large_room, member_count)
+        monkeypatch.undo()
+
+        benchmark.extra_info["bytes_per_member"] = interned // member_count
+        benchmark.extra_info["bytes_per_member_without_interning"] = (
+            plain // member_count
+        )
+        assert interned < plain
+
+        benchmark.pedantic(load_large_room, args=(member_count, ), rounds=1)
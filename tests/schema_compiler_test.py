@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import copy
+import glob
+import json
+
+import pytest
+from hypothesis import given, settings
+from hypothesis.strategies import (booleans, dictionaries, integers, lists,
+                                   none, one_of, recursive, sampled_from,
+                                   text)
+from jsonschema.exceptions import ValidationError
+
+import nio.schemas
+from helpers import synthetic_sync
+from nio import Client, ClientConfig
+from nio.responses import SyncResponse
+from nio.schema_compiler import compile_validator
+from nio.schemas import Schemas, Validator, format_checker
+
+SCHEMAS = sorted(
+    name for name, value in vars(Schemas).items() if isinstance(value, dict)
+)
+
+
+def schema_keys(schema, keys):
+    if isinstance(schema, dict):
+        for key, value in schema.items():
+            if key in ("properties", "patternProperties"):
+                keys.update(value)
+            schema_keys(value, keys)
+    elif isinstance(schema, list):
+        for value in schema:
+            schema_keys(value, keys)
+
+    return keys
+
+
+KEYS = sorted(set().union(
+    *(schema_keys(getattr(Schemas, name), set()) for name in SCHEMAS)
+))
+
+json_values = recursive(
+    none() | booleans() | integers(-2, 2) | text(max_size=3) |
+    sampled_from(["@alice:example.org", "!room:example.org", "m.text",
+                  "m.room.message", "m.megolm.v1.aes-sha2"]),
+    lambda children: lists(children, max_size=3) | dictionaries(
+        one_of(sampled_from(KEYS), text(max_size=2)),
+        children,
+        max_size=6
+    ),
+    max_leaves=20,
+)
+
+
+def collect(value, samples):
+    """Collect every object and array found in the test data."""
+    if isinstance(value, dict):
+        samples.append(value)
+        for child in value.values():
+            collect(child, samples)
+    elif isinstance(value, list):
+        samples.append(value)
+        for child in value:
+            collect(child, samples)
+
+
+def mutations(sample):
+    yield sample
+
+    if not isinstance(sample, dict):
+        return
+
+    for key in sample:
+        removed = dict(sample)
+        del removed[key]
+        yield removed
+
+        for replacement in (None, 1, True, "", [], {}):
+            changed = dict(sample)
+            changed[key] = replacement
+            yield changed
+
+
+def load_samples():
+    samples = []
+
+    for filename in sorted(glob.glob("tests/data/**/*.json", recursive=True)):
+        with open(filename) as f:
+            collect(json.load(f), samples)
+
+    return [mutation for s in samples for mutation in mutations(s)]
+
+
+SAMPLES = load_samples()
+
+
+def engines(schema):
+    validator = Validator(schema, format_checker=format_checker)
+    return validator, compile_validator(schema, validator, format_checker)
+
+
+def outcome(validator, instance):
+    instance = copy.deepcopy(instance)
+
+    try:
+        validator.validate(instance)
+    except ValidationError:
+        return False, instance
+
+    return True, instance
+
+
+class TestClass(object):
+    @pytest.mark.parametrize("name", SCHEMAS)
+    def test_test_data(self, name):
+        reference, compiled = engines(getattr(Schemas, name))
+
+        for sample in SAMPLES:
+            assert outcome(reference, sample) == outcome(compiled, sample)
+
+    @pytest.mark.parametrize("name", SCHEMAS)
+    @settings(max_examples=25, deadline=None)
+    @given(instance=json_values)
+    def test_generated_data(self, name, instance):
+        reference, compiled = engines(getattr(Schemas, name))
+        assert outcome(reference, instance) == outcome(compiled, instance)
+
+    def test_unknown_keyword_delegation(self):
+        schema = {
+            "type": "object",
+            "properties": {"a": {"anyOf": [{"type": "string"},
+                                           {"type": "integer"}]}},
+            "maxProperties": 1,
+        }
+        _, compiled = engines(schema)
+
+        compiled.validate({"a": 1})
+
+        with pytest.raises(ValidationError):
+            compiled.validate({"a": None})
+
+        with pytest.raises(ValidationError):
+            compiled.validate({"a": 1, "b": 2})
+
+    def test_defaults(self):
+        _, compiled = engines(Schemas.sync)
+        sync = synthetic_sync(1, 1)
+
+        compiled.validate(sync)
+        assert sync["device_one_time_keys_count"]["curve25519"] == 0
+
+    def test_config_switch(self, tempdir):
+        try:
+            Client("ephemeral", "DEVICEID", tempdir,
+                   ClientConfig(compiled_validators=True))
+            validator = nio.schemas.compile_schema(Schemas.room_message)
+            assert validator.source
+        finally:
+            nio.schemas.use_compiled_validators(False)
+
+        assert not hasattr(
+            nio.schemas.compile_schema(Schemas.room_message), "source"
+        )
+
+    def test_sync_parse_compiled(self, benchmark):
+        parsed_dict = synthetic_sync(10, 100)
+
+        try:
+            nio.schemas.use_compiled_validators()
+            response = benchmark(SyncResponse.from_dict, parsed_dict)
+        finally:
+            nio.schemas.use_compiled_validators(False)
+
+        assert isinstance(response, SyncResponse)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pytest
+from jsonschema import Draft4Validator
+from jsonschema.exceptions import ValidationError
+
+import nio.schemas
+from helpers import synthetic_sync
+from nio.responses import SyncResponse
+from nio.schemas import (Schemas, Validator, compile_schema, format_checker,
+                         validate_json)
+
+SCHEMAS = [
+    name for name, value in vars(Schemas).items() if isinstance(value, dict)
+]
+
+
+def uncached_compile_schema(schema):
+    return Validator(schema, format_checker=format_checker)
+
+
+class TestClass(object):
+    @pytest.mark.parametrize("name", SCHEMAS)
+    def test_schemas_are_valid(self, name):
+        Draft4Validator.check_schema(getattr(Schemas, name))
+
+    def test_validator_cache(self):
+        validator = compile_schema(Schemas.room_message)
+        assert validator is compile_schema(Schemas.room_message)
+        assert validator is not compile_schema(Schemas.room_message_text)
+
+    def test_schema_not_checked(self):
+        # Schemas aren't checked against the meta-schema, like the validation
+        # before the validators were cached.
+        validate_json({}, {"type": "object", "required": []})
+
+    def test_validation(self):
+        validate_json({"room_id": "!test:example.org"}, Schemas.room_id)
+
+        with pytest.raises(ValidationError):
+            validate_json({}, Schemas.room_id)
+
+    def test_sync_parse_uncached(self, benchmark, monkeypatch):
+        monkeypatch.setattr(
+            nio.schemas,
+            "compile_schema",
+            uncached_compile_schema
+        )
+        parsed_dict = synthetic_sync(10, 100)
+        response = benchmark(SyncResponse.from_dict, parsed_dict)
+        assert isinstance(response, SyncResponse)
+
+    def test_sync_parse_cached(self, benchmark):
+        parsed_dict = synthetic_sync(10, 100)
+        response = benchmark(SyncResponse.from_dict, parsed_dict)
+        assert isinstance(response, SyncResponse)
@@ -13,6 +13,8 @@ from nio.crypto import (InboundGroupSession, OlmAccount, OlmDevice,
                         OutboundGroupSession, OutboundSession,
                         OutgoingKeyRequest, TrustState)
 from nio.exceptions import OlmTrustError
+from nio.responses import RoomSummary
+from nio.rooms import MatrixRoom
 from nio.store import (Ed25519Key, Key, KeyStore, LegacyMatrixStore,
                        MatrixStore, DefaultStore, SqliteMemoryStore, SqliteStore)
 
@@ -783,3 +785,85 @@ class TestClass(object):
         sqlstore.save_sync_token(token)
         loaded_token = sqlstore.load_sync_token()
         assert token == loaded_token
+
+    def test_sync_filter_loading(self, sqlstore):
+        assert sqlstore.load_sync_filter("hash") is None
+
+        sqlstore.save_sync_filter("hash", "1")
+        sqlstore.save_sync_filter("other hash", "2")
+        assert sqlstore.load_sync_filter("hash") == "1"
+        assert sqlstore.load_sync_filter("other hash") == "2"
+
+        sqlstore.save_sync_filter("hash", "3")
+        assert sqlstore.load_sync_filter("hash") == "3"
+
+    def test_room_state_loading(self, sqlstore):
+        assert sqlstore.load_rooms() == {}
+
+        room = MatrixRoom(TEST_ROOM, BOB_ID, encrypted=True)
+        room.name = "Test room"
+        room.topic = "Testing"
+        room.power_levels.users[BOB_ID] = 100
+        room.update_summary(RoomSummary(1, 2, [BOB_ID]))
+        room.add_member(BOB_ID, "Bob", None)
+        room.add_member("@alice:example.org", None, "mxc://example.org/a")
+        sqlstore.save_room(room)
+
+        rooms = sqlstore.load_rooms()
+        loaded = rooms[TEST_ROOM]
+
+        assert loaded.name == "Test room"
+        assert loaded.topic == "Testing"
+        assert loaded.encrypted
+        assert loaded.power_levels.get_user_level(BOB_ID) == 100
+        assert loaded.summary == room.summary
+        assert loaded.member_loader
+
+        assert loaded.users[BOB_ID].power_level == 100
+        assert loaded.user_name(BOB_ID) == "Bob"
+        assert (loaded.avatar_url("@alice:example.org")
+                == "mxc://example.org/a")
+        assert not loaded.member_loader
+
+        room.remove_member("@alice:example.org")
+        room.add_member("@carol:example.org", "Carol", None, invited=True)
+        sqlstore.save_room(room, ["@alice:example.org", "@carol:example.org"])
+
+        loaded = sqlstore.load_rooms()[TEST_ROOM]
+        assert set(loaded.users) == {BOB_ID, "@carol:example.org"}
+        assert set(loaded.invited_users) == {"@carol:example.org"}
+
+        sqlstore.delete_room(TEST_ROOM)
+        assert sqlstore.load_rooms() == {}
+        assert sqlstore.load_room_members(TEST_ROOM) == []
+
+    def test_room_state_saving_restored(self, sqlstore):
+        room = MatrixRoom(TEST_ROOM, BOB_ID)
+        room.add_member(BOB_ID, "Bob", None)
+        room.add_member("@alice:example.org", "Alice", None)
+        sqlstore.save_room(room)
+
+        # Saving a restored room doesn't load its members.
+        loaded = sqlstore.load_rooms()[TEST_ROOM]
+        loaded.topic = "Testing"
+        sqlstore.save_room(loaded)
+        sqlstore.save_room(loaded, [BOB_ID])
+        assert loaded.member_loader
+
+        loaded = sqlstore.load_rooms()[TEST_ROOM]
+        assert loaded.topic == "Testing"
+        assert not loaded.members_loaded
+        assert set(loaded.users) == {BOB_ID, "@alice:example.org"}
+
+        # The partial member list stays partial until all the members are
+        # loaded.
+        loaded.remove_member("@alice:example.org")
+        sqlstore.save_room(loaded, ["@alice:example.org"])
+
+        loaded = sqlstore.load_rooms()[TEST_ROOM]
+        assert not loaded.members_loaded
+        assert set(loaded.users) == {BOB_ID}
+
+        loaded.members_loaded = True
+        sqlstore.save_room(loaded)
+        assert sqlstore.load_rooms()[TEST_ROOM].members_loaded